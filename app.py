@@ -1,74 +1,189 @@
-from fastapi import FastAPI,  status,  BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
-import cv2, serial, numpy as np
-import asyncio, json, time, os, sys
+from fastapi import FastAPI,  status,  Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
+from email.utils import formatdate, parsedate_to_datetime
+import serial
+import asyncio, functools, time, os
 # from camera2 import takePicture
-from camera3 import IdsCamera
-from threading import Thread, Lock
+from backends import create_camera, create_serial_link, parse_devices, CAMERAS, AXES
+from serial_link import MOTION_TIMEOUT, MotionInterrupted
+from controller_state import ControllerState
+from frame_ring import FrameRing, RING_PROFILE
+from recorder import Recorder
+from archive import SnapshotArchive, QUERY_LIMIT
+from frame_hub import FrameHub
+from encode_pool import FairEncodePool
+from capture_engine import CaptureEngine
+from camera_settings import ROI_PRESETS, roi_settings
+from jpeg_encoders import create_encoder
+from h264_stream import H264Stream, h264_available
+from stream_profiles import PROFILES, DEFAULT_PROFILE
+from motion_capture import PositionCapture, SETTLE_TIME
+from scan import ScanManager, scan_positions
+from trigger_capture import TriggeredCapture, TRIGGER_TIMEOUT
+import metrics
+from metrics import FRAMES_SERVED, STREAM_SEND
+from pydantic import BaseModel
+from typing import List, Optional
 
 
 folder_path = './output'
-if not os.path.exists(folder_path):
-    os.makedirs(folder_path)
 
-def delete_file(file_path: str):
-    if os.path.exists(file_path):  # 파일이 존재하는지 확인
-        os.remove(file_path)  # 파일 삭제
+# background: 서버는 바로 응답하고 카메라는 뒤에서 초기화 / lazy: 첫 이미지 요청에서 초기화 / eager: 초기화 후 서버 시작
+CAMERA_STARTUP = os.environ.get("CAMERA_STARTUP", "background")
 
-def send_json_data(ser, data):
+def process_uptime():
+    """
+    :return: seconds since this process started (Linux /proc), since import elsewhere
+    """
     try:
-        # 데이터 전송
-        ser.write(json.dumps(data).encode('utf-8') + b'\n')
-    except Exception as e:
-        print(f"Error communicating with serial device: {e}")
-    finally:
-        return None
-
-def receive_multiple_responses(ser, response_count=1):
-    responses = []
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _import_start
+
+_import_start = time.monotonic()
+
+# 카메라에서 BGR8 로 변환되어 오므로 cvtColor 없이 바로 인코딩
+encode_jpeg = create_encoder()
+
+# 카메라 / 축마다 capture thread, buffer pool, frame hub, serial link 를 따로 두고 encode worker 만 공유
+camera_devices = parse_devices(CAMERAS)
+axis_ports = parse_devices(AXES)
+# 예전 endpoint 는 첫번째 카메라와 축만 사용: /get_image, /video_feed, /camera/*, /capture_at, /trigger_image,
+# /scan, /history, /record, /archive 와 /status, /go/{x}, /stop, ...
+# 카메라 / 축을 고르려면 /cam/{camera_id}/... 와 /axis/{axis_id}/..., /metrics 와 /ready 는 전부를 포함
+DEFAULT_CAMERA = next(iter(camera_devices))
+DEFAULT_AXIS = next(iter(axis_ports))
+
+# 바쁜 카메라가 다른 카메라의 인코딩 시간을 다 쓰지 않도록 카메라마다 차례로 처리
+encode_pool = FairEncodePool()
+frame_hubs = {}
+capture_engines = {}
+for camera_id, device in camera_devices.items():
+    frame_hubs[camera_id] = FrameHub(encode_jpeg, workers=encode_pool.workers, executor=encode_pool.queue(camera_id))
+    capture_engines[camera_id] = CaptureEngine(functools.partial(create_camera, device=device),
+                                               frame_hubs[camera_id], clock=process_uptime, name=camera_id)
+serial_links = {axis_id: create_serial_link(port=port) for axis_id, port in axis_ports.items()}
+controller_states = {axis_id: ControllerState(link) for axis_id, link in serial_links.items()}
+
+frame_hub = frame_hubs[DEFAULT_CAMERA]
+capture_engine = capture_engines[DEFAULT_CAMERA]
+serial_link = serial_links[DEFAULT_AXIS]
+controller_state = controller_states[DEFAULT_AXIS]
+position_capture = PositionCapture(serial_link, frame_hub)
+scan_manager = ScanManager(position_capture, os.path.join(folder_path, "scans"))
+triggered_capture = TriggeredCapture(lambda: capture_engine.camera, frame_hub)
+h264_streams = {}  # profile 별로 한번만 인코딩해서 모든 viewer 가 공유
+frame_ring = FrameRing(frame_hub, PROFILES[RING_PROFILE],
+                       position=lambda: (controller_state.x, controller_state.moving))
+archive = SnapshotArchive(os.path.join(folder_path, "archive"))
+recorder = Recorder(frame_hub, os.path.join(folder_path, "recordings"),
+                    position=lambda: (controller_state.x, controller_state.moving))
+
+metrics.Gauge("video_feed_subscribers", "Connected /video_feed clients",
+              lambda: {camera_id: hub.subscriber_count for camera_id, hub in frame_hubs.items()}, ["camera"])
+metrics.Gauge("camera_healthy", "Cameras delivering frames",
+              lambda: sum(engine.healthy for engine in capture_engines.values()))
+metrics.Gauge("serial_queue_depth", "Motion controller requests waiting",
+              lambda: {axis_id: link.stats()["queue_depth"] for axis_id, link in serial_links.items()}, ["axis"])
+
+async def communicate_with_serial(command, response_count=1, timeout=None, link=None):
     try:
-        while len(responses) < response_count:
-            line = ser.readline().decode('utf-8').strip()
-            if line:
-                responses.append(json.loads(line))
-    except Exception as e:
-        print(f"Error receiving data from serial device: {e}")
-        return None
-    return responses
+        # 하나의 serial 연결을 공유하는 요청 큐로 전달
+        return await (link or serial_link).request(command, response_count, timeout)
 
-async def communicate_with_serial(command, response_count=1):
-    try:
-        def serial_operation():
-            ser = serial.Serial("/dev/ttyAMA0", 115200, timeout=1)
-            send_json_data(ser, command)
-            return receive_multiple_responses(ser, response_count)
-            
-        # serial 통신을 비동기 이벤트 루프에서 실행
-        result = await asyncio.to_thread(serial_operation)
-        return result
-        
     except serial.SerialException as e:
         return JSONResponse(content=f"Serial communication error: {e}", 
                           status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except TimeoutError as e:
+        return JSONResponse(content=f"No response from UART device: {e}",
+                          status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    except MotionInterrupted as e:
+        return JSONResponse(content={"error": str(e), "responses": e.responses},
+                          status_code=status.HTTP_409_CONFLICT)
     except Exception as e:
         return JSONResponse(content=f"An error occurred: {e}", 
                           status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-def makeFileName():
-    timestr = time.strftime("%Y%m%d-%H_%M_%S")
-    return f"./output/{timestr}.jpeg"
-
 
 app = FastAPI()
             
 
+@app.on_event("startup")
+async def open_storage():
+    # import 할 때는 디스크에 아무것도 만들지 않음
+    os.makedirs(folder_path, exist_ok=True)
+    recorder.open()
+    await asyncio.to_thread(archive.open)
+
+@app.on_event("startup")
+async def start_controller_state():
+    # client 수와 관계없이 일정한 간격으로만 UART 에 status 를 물어봄
+    for state in controller_states.values():
+        state.start()
+    frame_ring.start()
+
+@app.on_event("shutdown")
+async def close_serial_link():
+    await recorder.stop()
+    await frame_ring.stop()
+    for axis_id, link in serial_links.items():
+        await controller_states[axis_id].stop()
+        await link.close()
+    await asyncio.gather(*(asyncio.to_thread(engine.stop, 10) for engine in capture_engines.values()))
+    for hub in frame_hubs.values():
+        hub.close()
+    encode_pool.shutdown()
+    for stream in h264_streams.values():
+        stream.close()
+
+@app.get("/metrics")
+async def get_metrics():
+    # 수집은 항상 하고, 텍스트 변환은 scrape 할 때만 수행
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/serial/stats")
+async def get_serial_stats():
+    return serial_link.stats()
+
+async def cached_state(fresh, command, axis_id=DEFAULT_AXIS):
+    """
+    :return: the cached controller state, read from the UART first if fresh or nothing is cached
+    """
+    state = controller_states[axis_id]
+    if fresh or state.updated_at is None:
+        responses = await communicate_with_serial(command, link=serial_links[axis_id])
+        if isinstance(responses, JSONResponse):
+            return responses
+    return state.read()
+
 @app.get("/status")
-async def get_status():
-    return await communicate_with_serial({"cmd": "status"})
+async def get_status(fresh: bool = False):
+    state = await cached_state(fresh, {"cmd": "status"})
+    if isinstance(state, JSONResponse):
+        return state
+    return [state]
 
 @app.get("/location")
-async def get_camera_location():
-    return await communicate_with_serial({"cmd": "get_x"})
+async def get_camera_location(fresh: bool = False):
+    state = await cached_state(fresh, {"cmd": "get_x"})
+    if isinstance(state, JSONResponse):
+        return state
+    return [{"x": state["x"], "timestamp": state["timestamp"], "age_ms": state["age_ms"]}]
+
+@app.get("/state/events")
+async def controller_state_events():
+    """
+    Server-sent events with the controller state whenever it changes
+    """
+    return StreamingResponse(controller_state.events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/state/stats")
+async def controller_state_stats():
+    return controller_state.stats()
 
 @app.get("/stop")
 async def stop_moving_camera():
@@ -76,11 +191,11 @@ async def stop_moving_camera():
 
 @app.get("/go/{x}")
 async def go_moving_camera(x: str):
-    return await communicate_with_serial({"cmd": "go_x", "x": x}, 2)
+    return await communicate_with_serial({"cmd": "go_x", "x": x}, 2, MOTION_TIMEOUT)
 
 @app.get("/calibrate")
 async def calibrate():
-    return await communicate_with_serial({"cmd": "calibrate"})
+    return await communicate_with_serial({"cmd": "calibrate"}, timeout=MOTION_TIMEOUT)
 
 @app.get("/setmaximum/manual/{x_max}")
 async def set_maximum_manual(x_max: str):
@@ -88,105 +203,589 @@ async def set_maximum_manual(x_max: str):
 
 @app.get("/setmaximum/auto")
 async def set_maximum_auto():
-    return await communicate_with_serial({"cmd": "calibrate", "set_type": "limit_sw"})
-
+    return await communicate_with_serial({"cmd": "calibrate", "set_type": "limit_sw"}, timeout=MOTION_TIMEOUT)
+
+
+def unknown_profile(profile):
+    return JSONResponse(content=f"Unknown profile {profile}, available: {', '.join(PROFILES)}",
+                        status_code=status.HTTP_404_NOT_FOUND)
+
+@app.get("/profiles")
+async def get_profiles():
+    """
+    Encode totals per profile over all cameras, the share of each camera is in /cam/{camera_id}/stats
+    """
+    return {name: profile.stats() for name, profile in PROFILES.items()}
+
+def frame_etag(frame, profile, camera_id=DEFAULT_CAMERA):
+    return f'"{frame_hubs[camera_id].epoch}-{camera_id}-{frame.seq}-{profile}"'
+
+def not_modified(request, frame, etag, hub=None):
+    # ETag 이 있으면 seq 로 정확히 비교, If-Modified-Since 는 무시
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = int(parsedate_to_datetime(if_modified_since).timestamp())
+        except (TypeError, ValueError):
+            return False
+        second = int(frame.timestamp)
+        if second != since:
+            return second < since
+        # Last-Modified 는 초 단위라 같은 초의 더 새 프레임일 수 있음, 그 초의 첫 프레임일 때만 client 가 가진 것과 같음
+        return (hub or frame_hub).first_in_second(frame)
+    return False
 
 @app.get("/get_image")
-async def get_image(background_tasks: BackgroundTasks):
-    global output_frame, lock
-
-    with lock:
-        if output_frame is None:
-            return JSONResponse(content="No frame available", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        frame = output_frame
-
-    # 파일로 저장
-    image_path = makeFileName()
-    with open(image_path, 'wb') as f:
-        f.write(frame)
-
-    # 파일 응답 생성
-    response = FileResponse(image_path)
-
-    # 파일 삭제를 백그라운드 태스크로 등록
-    background_tasks.add_task(delete_file, image_path)
-
-    return response
-
-# 전역 변수로 카메라 객체 선언
-camera = None
-
-def initialize_camera():
-    global camera
+async def get_image(request: Request, profile: str = DEFAULT_PROFILE, wait_new: bool = False, timeout: float = 5):
+    return await image_response(request, DEFAULT_CAMERA, profile, wait_new, timeout)
+
+async def image_response(request, camera_id, profile, wait_new, timeout):
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    hub = frame_hubs[camera_id]
+    latest = hub.latest()
+    if wait_new:
+        # 요청 이후에 새로 들어온 프레임을 기다림
+        try:
+            latest = await asyncio.wait_for(hub.wait_next(latest.seq if latest else 0), timeout)
+        except asyncio.TimeoutError:
+            return JSONResponse(content="No new frame available", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    if latest is None:
+        if not capture_engines[camera_id].healthy:
+            return camera_not_ready(camera_id)
+        return JSONResponse(content="No frame available", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # 파일로 저장하지 않고 메모리의 JPEG 을 그대로 응답
+    etag = frame_etag(latest, profile, camera_id)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(latest.timestamp, usegmt=True),
+        "Cache-Control": "no-cache",
+        "X-Frame-Timestamp": f"{latest.timestamp:.6f}",
+    }
+    if not_modified(request, latest, etag, hub):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    frame = await latest.encoded(PROFILES[profile])
+    FRAMES_SERVED.inc()
+    return Response(content=frame, media_type="image/jpeg", headers=headers)
+
+async def archive_frame(data, frame, position):
+    """
+    :return: archive id of the stored JPEG
+    """
+    try:
+        position = float(position)
+    except (TypeError, ValueError):
+        position = None
+    return await asyncio.to_thread(archive.append, data, frame.timestamp, position, frame.seq)
+
+@app.get("/capture_at/stats")
+async def capture_at_stats():
+    return position_capture.stats()
+
+@app.get("/capture_at/{x}")
+async def capture_at(x: str, profile: str = DEFAULT_PROFILE, settle: float = SETTLE_TIME, archived: bool = False):
+    if profile not in PROFILES:
+        return unknown_profile(profile)
     try:
-        camera = IdsCamera()
-        return True
+        frame, position, _ = await position_capture.capture_at(x, settle)
+    except serial.SerialException as e:
+        return JSONResponse(content=f"Serial communication error: {e}",
+                          status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except TimeoutError as e:
+        return JSONResponse(content=f"Capture timed out: {e}",
+                          status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    except MotionInterrupted as e:
+        return JSONResponse(content=f"Capture interrupted: {e}",
+                          status_code=status.HTTP_409_CONFLICT)
     except Exception as e:
-        print(f"카메라 초기화 실패: {str(e)}")
-        return False
-
-# 프로그램 시작시 카메라 초기화
-if not initialize_camera():
-    print("프로그램을 종료합니다.")
-    sys.exit(1)
-
-def capture_frames():
-    global output_frame, lock, camera
-    
-    while True:
-        try:
-            img = next(camera.streaming_image())
-            img_bgr = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-            # img_bgr = cv2.resize(img_bgr, (640, 480))
-
-            _, buffer = cv2.imencode('.jpg', img_bgr)
-            data = buffer.tobytes()
+        return JSONResponse(content=f"An error occurred: {e}",
+                          status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            with lock:
-                output_frame = data
+    data = await frame.encoded(PROFILES[profile])
+    headers = {
+        "ETag": frame_etag(frame, profile),
+        "Last-Modified": formatdate(frame.timestamp, usegmt=True),
+        "X-Position": str(position),
+        "X-Frame-Timestamp": f"{frame.timestamp:.6f}",
+    }
+    if archived:
+        headers["X-Archive-Id"] = str(await archive_frame(data, frame, position))
+    FRAMES_SERVED.inc()
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+@app.get("/camera/mode")
+async def get_camera_mode():
+    return triggered_capture.stats()
+
+@app.get("/camera/mode/{mode}")
+async def set_camera_mode(mode: str):
+    if mode not in ("freerun", "trigger"):
+        return JSONResponse(content="mode must be freerun or trigger", status_code=status.HTTP_400_BAD_REQUEST)
+    if capture_engine.camera is None:
+        return camera_not_ready()
+    try:
+        await triggered_capture.set_mode(mode == "trigger")
+    except Exception as e:
+        return JSONResponse(content=f"An error occurred: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return triggered_capture.stats()
+
+@app.get("/trigger_image")
+async def trigger_image(profile: str = DEFAULT_PROFILE, resume: bool = True, timeout: float = TRIGGER_TIMEOUT,
+                        archived: bool = False):
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    if capture_engine.camera is None:
+        return camera_not_ready()
+    try:
+        frame = await triggered_capture.still(resume, timeout)
+    except asyncio.TimeoutError:
+        return JSONResponse(content="Triggered frame did not arrive", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(content=f"An error occurred: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    data = await frame.encoded(PROFILES[profile])
+    headers = {
+        "ETag": frame_etag(frame, profile),
+        "Last-Modified": formatdate(frame.timestamp, usegmt=True),
+        "X-Frame-Timestamp": f"{frame.timestamp:.6f}",
+    }
+    if archived:
+        headers["X-Archive-Id"] = str(await archive_frame(data, frame, controller_state.x))
+    FRAMES_SERVED.inc()
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+class ScanRequest(BaseModel):
+    positions: Optional[List[float]] = None
+    start: Optional[float] = None
+    stop: Optional[float] = None
+    step: Optional[float] = None
+    profile: str = DEFAULT_PROFILE
+    settle: float = SETTLE_TIME
+
+def get_scan_job(job_id):
+    job = scan_manager.jobs.get(job_id)
+    if job is None:
+        return None, JSONResponse(content=f"Unknown scan {job_id}", status_code=status.HTTP_404_NOT_FOUND)
+    return job, None
+
+@app.post("/scan")
+async def start_scan(scan: ScanRequest):
+    if scan.profile not in PROFILES:
+        return unknown_profile(scan.profile)
+    try:
+        positions = scan_positions(scan.positions, scan.start, scan.stop, scan.step)
+    except ValueError as e:
+        return JSONResponse(content=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    job = scan_manager.start(positions, PROFILES[scan.profile], scan.settle)
+    return job.stats()
+
+@app.get("/scan")
+async def list_scans():
+    return [job.stats() for job in scan_manager.jobs.values()]
+
+@app.get("/scan/{job_id}")
+async def get_scan(job_id: str):
+    job, error = get_scan_job(job_id)
+    return error or job.stats()
+
+@app.delete("/scan/{job_id}")
+async def cancel_scan(job_id: str):
+    job, error = get_scan_job(job_id)
+    if error:
+        return error
+    scan_manager.cancel(job)
+    return job.stats()
+
+@app.get("/scan/{job_id}/manifest")
+async def get_scan_manifest(job_id: str):
+    job, error = get_scan_job(job_id)
+    return error or job.manifest()
+
+@app.get("/scan/{job_id}/zip")
+async def get_scan_zip(job_id: str):
+    job, error = get_scan_job(job_id)
+    if error:
+        return error
+    if job.state == "running":
+        return JSONResponse(content="Scan is still running", status_code=status.HTTP_409_CONFLICT)
+    return StreamingResponse(scan_manager.iter_zip(job), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="scan-{job.id}.zip"'})
+
+def camera_not_ready(camera_id=DEFAULT_CAMERA):
+    # lazy 모드에서는 이 요청이 카메라를 켬
+    engine = capture_engines[camera_id]
+    engine.start()
+    return JSONResponse(content={"error": f"Camera {camera_id} is not ready", **engine.health()},
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+if CAMERA_STARTUP == "lazy":
+    # frame 을 찾는 첫 요청에서 카메라를 켬
+    for camera_id, engine in capture_engines.items():
+        frame_hubs[camera_id].on_demand = engine.start
+
+@app.on_event("startup")
+async def start_camera_on_startup():
+    if CAMERA_STARTUP == "eager":
+        # 예전 동작: 카메라가 준비될 때까지 서버가 요청을 받지 않음
+        await asyncio.gather(*(asyncio.to_thread(engine.open) for engine in capture_engines.values()))
+    if CAMERA_STARTUP in ("eager", "background"):
+        for engine in capture_engines.values():
+            engine.start()
+
+@app.get("/ready")
+async def get_ready():
+    """
+    200 while every camera delivers frames, 503 while one is starting or recovering; the HTTP and motion API work either way
+
+    The top level health fields are those of the default camera, cameras and axes cover all of them.
+    """
+    ready = all(engine.healthy for engine in capture_engines.values())
+    content = {
+        "ready": ready,
+        "camera_startup": CAMERA_STARTUP,
+        **capture_engine.health(),
+        "cameras": {camera_id: engine.health() for camera_id, engine in capture_engines.items()},
+        "axes": {axis_id: link.stats() for axis_id, link in serial_links.items()},
+        "imported_at": IMPORTED_AT,
+        "uptime_s": round(process_uptime(), 3),
+    }
+    return JSONResponse(content=content, status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@app.get("/camera/health")
+async def get_camera_health():
+    return capture_engine.health()
+
+class CameraSettings(BaseModel):
+    exposure_auto: Optional[str] = None     # Off / Once / Continuous
+    exposure: Optional[float] = None        # us
+    gain_auto: Optional[str] = None         # Off / Once / Continuous
+    gain: Optional[float] = None
+    fps: Optional[float] = None
+    # binning / decimation / ROI, 바꾸면 acquisition 을 잠깐 멈추고 buffer 를 다시 할당
+    binning_x: Optional[int] = None
+    binning_y: Optional[int] = None
+    decimation_x: Optional[int] = None
+    decimation_y: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    offset_x: Optional[int] = None
+    offset_y: Optional[int] = None
+
+@app.get("/camera/settings")
+async def get_camera_settings():
+    return capture_engine.camera_settings()
+
+@app.post("/camera/settings")
+async def set_camera_settings(settings: CameraSettings):
+    """
+    Apply the given settings while streaming, see CaptureEngine.apply_settings for the report
+    """
+    settings = {name: value for name, value in settings if value is not None}
+    if not settings:
+        return JSONResponse(content="No settings given", status_code=status.HTTP_400_BAD_REQUEST)
+    if capture_engine.camera is None:
+        return camera_not_ready()
+    try:
+        return await asyncio.to_thread(capture_engine.apply_settings, settings)
+    except ValueError as e:
+        return JSONResponse(content=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return JSONResponse(content=f"An error occurred: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@app.get("/camera/roi")
+async def get_camera_roi_presets():
+    return ROI_PRESETS
+
+@app.post("/camera/roi/{preset}")
+async def set_camera_roi(preset: str):
+    """
+    Switch to a named ROI / binning preset, the smaller area cuts USB bandwidth, conversion and encode time
+    """
+    if preset not in ROI_PRESETS:
+        return JSONResponse(content=f"Unknown ROI preset {preset}, one of {', '.join(ROI_PRESETS)}",
+                            status_code=status.HTTP_404_NOT_FOUND)
+    camera = capture_engine.camera
+    if camera is None:
+        return camera_not_ready()
+    try:
+        settings = roi_settings(preset, camera.sensor_size, await asyncio.to_thread(camera.settings))
+        return await asyncio.to_thread(capture_engine.apply_settings, settings)
+    except ValueError as e:
+        return JSONResponse(content=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return JSONResponse(content=f"An error occurred: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # 메모리 해제
-            del img
-            del img_bgr
-            del buffer
-            
-        except StopIteration:
-            print("카메라 스트림 종료 - 재연결 시도")
-            camera = None  # 카메라 객체 초기화
-            time.sleep(1)  # 재연결 전 잠시 대기
-            continue
-        except Exception as e:
-            print(f"프레임 생성 중 오류 발생: {str(e)}")
-            camera = None  # 에러 발생 시 카메라 객체 초기화
-            time.sleep(1)
-            continue
-
-lock = Lock()
-output_frame = None
-
-thread = Thread(target=capture_frames)
-thread.daemon = True
-thread.start()
-
-def generate_frames():
-    global output_frame, lock
-    
-    while True:
-        try:
-            with lock:
-                if output_frame is None:
-                    time.sleep(0.1)  # CPU 사용량 감소
-                    continue
-                frame = output_frame.copy()  # 데이터 복사
-            
+async def generate_frames(profile, max_fps=None, hub=None):
+    hub = hub or frame_hub
+    client = hub.subscribe(profile, max_fps)
+    try:
+        async for frame in client.frames():
+            # 프레임 bytes 는 복사하지 않고 그대로 전송
+            data = frame.jpeg(profile)
+            start = time.perf_counter()
             yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                   
-        except Exception as e:
-            print(f"프레임 전송 중 오류 발생: {str(e)}")
-            time.sleep(0.1)
-            continue
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: ' + str(len(data)).encode() + b'\r\n\r\n')
+            yield data
+            yield b'\r\n'
+            # yield 가 다시 돌아올 때까지 = 전송이 밀린 시간
+            STREAM_SEND.observe(time.perf_counter() - start)
+            FRAMES_SERVED.inc()
+    finally:
+        hub.unsubscribe(client)
 
 @app.get("/video_feed")
-async def video_feed():
-    return StreamingResponse(generate_frames(), media_type='multipart/x-mixed-replace; boundary=frame')
+async def video_feed(profile: str = DEFAULT_PROFILE, max_fps: float = None):
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    return StreamingResponse(generate_frames(PROFILES[profile], max_fps), media_type='multipart/x-mixed-replace; boundary=frame')
+
+@app.get("/video_feed/stats")
+async def video_feed_stats():
+    return frame_hub.stats()
+
+async def generate_h264(stream):
+    client = stream.subscribe()
+    try:
+        async for chunk in client.chunks():
+            yield chunk
+    finally:
+        stream.unsubscribe(client)
+
+@app.get("/video_feed/h264")
+async def video_feed_h264(profile: str = DEFAULT_PROFILE):
+    """
+    Same frames as /video_feed as H.264 in fragmented MP4, playable by <video> and MSE
+    """
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    if not h264_available():
+        return JSONResponse(content="H.264 streaming needs PyAV with libx264 (pip install av)",
+                            status_code=status.HTTP_501_NOT_IMPLEMENTED)
+    stream = h264_streams.get(profile)
+    if stream is None:
+        stream = h264_streams[profile] = H264Stream(frame_hub, PROFILES[profile])
+    return StreamingResponse(generate_h264(stream), media_type='video/mp4')
+
+@app.get("/video_feed/h264/stats")
+async def video_feed_h264_stats():
+    """
+    H.264 streams next to the MJPEG clients of the same profile
+    """
+    mjpeg = {}
+    for client in frame_hub.stats()["clients"]:
+        rates = mjpeg.setdefault(client["profile"], [])
+        rates.append(client["bytes_per_s"])
+    return {
+        "h264": {name: stream.stats() for name, stream in h264_streams.items()},
+        "mjpeg": {
+            name: {
+                "clients": len(mjpeg.get(name, [])),
+                "bytes_per_s_per_client": round(sum(mjpeg[name]) / len(mjpeg[name])) if mjpeg.get(name) else None,
+                "encode_ms_per_frame": profile.stats()["cpu_ms_per_frame"],
+            }
+            for name, profile in PROFILES.items()
+        },
+    }
+
+@app.get("/history")
+async def get_history(t0: float = None, t1: float = None, last: float = None, format: str = "zip"):
+    """
+    Recorded frames between t0 and t1 (camera timestamps, epoch seconds) or of the last seconds
+
+    format zip has every JPEG and a manifest with timestamp and position,
+    mjpeg is the concatenated JPEGs.
+    """
+    if format not in ("zip", "mjpeg"):
+        return JSONResponse(content="format must be zip or mjpeg", status_code=status.HTTP_400_BAD_REQUEST)
+    if last is None and t0 is None and t1 is None:
+        return JSONResponse(content="give t0/t1 or last", status_code=status.HTTP_400_BAD_REQUEST)
+    if not frame_ring.enabled:
+        return JSONResponse(content="History is off, set RING_BUDGET_MB to record frames",
+                            status_code=status.HTTP_404_NOT_FOUND)
+    # 요청 시점의 목록을 고정해서 전송 중에 evict 되어도 응답이 바뀌지 않음
+    entries = frame_ring.last(last) if last is not None else frame_ring.between(t0, t1)
+    if not entries:
+        return JSONResponse(content="No frames in that time range", status_code=status.HTTP_404_NOT_FOUND)
+    name = f"history-{entries[0].timestamp:.3f}-{entries[-1].timestamp:.3f}"
+    headers = {"X-Frame-Count": str(len(entries))}
+    if format == "zip":
+        headers["Content-Disposition"] = f'attachment; filename="{name}.zip"'
+        return StreamingResponse(frame_ring.iter_zip(entries), media_type="application/zip", headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="{name}.mjpeg"'
+    return StreamingResponse(frame_ring.iter_mjpeg(entries), media_type="video/x-motion-jpeg", headers=headers)
+
+@app.get("/history/stats")
+async def get_history_stats():
+    return frame_ring.stats()
+
+class RecordRequest(BaseModel):
+    profile: str = "preview"
+    duration: Optional[float] = None    # 초, 없으면 stop 할 때까지
+    start_at: Optional[float] = None    # epoch 초, 없으면 바로 시작
+
+@app.post("/record")
+async def start_recording(record: RecordRequest):
+    if record.profile not in PROFILES:
+        return unknown_profile(record.profile)
+    try:
+        recorder.start(PROFILES[record.profile], record.duration, record.start_at)
+    except RuntimeError as e:
+        return JSONResponse(content=str(e), status_code=status.HTTP_409_CONFLICT)
+    return recorder.stats()
+
+@app.delete("/record")
+async def stop_recording():
+    await recorder.stop()
+    return recorder.stats()
+
+@app.get("/record")
+async def get_recording():
+    return recorder.stats()
+
+@app.get("/record/segments")
+async def list_recording_segments():
+    return recorder.segments()
+
+@app.post("/archive/snapshot")
+async def archive_snapshot(profile: str = DEFAULT_PROFILE):
+    """
+    Store the newest frame with the current carriage position
+    """
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    frame = frame_hub.latest()
+    if frame is None:
+        return JSONResponse(content="No frame available", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    data = await frame.encoded(PROFILES[profile])
+    snapshot_id = await archive_frame(data, frame, frame.position if frame.position is not None else controller_state.x)
+    return archive.get(snapshot_id)[1]
+
+@app.get("/archive/query")
+async def query_archive(t0: float = None, t1: float = None, x: float = None, tolerance: float = 0,
+                        x0: float = None, x1: float = None, limit: int = QUERY_LIMIT):
+    """
+    Snapshots between t0 and t1 (epoch seconds) near x (+- tolerance) or between x0 and x1
+    """
+    total, snapshots = archive.query(t0, t1, x, tolerance, x0, x1, limit)
+    return {"total": total, "snapshots": snapshots}
+
+@app.get("/archive/stats")
+async def get_archive_stats():
+    return archive.stats()
+
+@app.get("/archive/{snapshot_id}")
+async def get_archive_snapshot(snapshot_id: int):
+    snapshot = archive.get(snapshot_id)
+    if snapshot is None:
+        return JSONResponse(content=f"Unknown snapshot {snapshot_id}", status_code=status.HTTP_404_NOT_FOUND)
+    data, info = snapshot
+    headers = {
+        "Last-Modified": formatdate(info["timestamp"], usegmt=True),
+        "Cache-Control": "max-age=31536000, immutable",
+        "X-Position": str(info["position"]),
+        "X-Frame-Timestamp": f"{info['timestamp']:.6f}",
+    }
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+def unknown_camera(camera_id):
+    return JSONResponse(content=f"Unknown camera {camera_id}, available: {', '.join(capture_engines)}",
+                        status_code=status.HTTP_404_NOT_FOUND)
+
+def unknown_axis(axis_id):
+    return JSONResponse(content=f"Unknown axis {axis_id}, available: {', '.join(serial_links)}",
+                        status_code=status.HTTP_404_NOT_FOUND)
+
+def camera_throughput(camera_id):
+    engine = capture_engines[camera_id]
+    hub_stats = frame_hubs[camera_id].stats()
+    return {
+        "device": camera_devices[camera_id],
+        "state": engine.state,
+        "capture_fps": engine.fps(),
+        "frames": engine.frames,
+        "subscribers": hub_stats["subscribers"],
+        "video_feed_bytes_per_s": sum(client["bytes_per_s"] or 0 for client in hub_stats["clients"]),
+        "encode": encode_pool.queue(camera_id).stats(),
+    }
+
+@app.get("/cams")
+async def list_cameras():
+    """
+    Per camera capture rate, viewers and share of the shared encode workers
+    """
+    return {
+        "default": DEFAULT_CAMERA,
+        "encode_workers": encode_pool.workers,
+        "cameras": {camera_id: camera_throughput(camera_id) for camera_id in capture_engines},
+    }
+
+@app.get("/cam/{camera_id}/get_image")
+async def get_camera_image(request: Request, camera_id: str, profile: str = DEFAULT_PROFILE,
+                           wait_new: bool = False, timeout: float = 5):
+    if camera_id not in capture_engines:
+        return unknown_camera(camera_id)
+    return await image_response(request, camera_id, profile, wait_new, timeout)
+
+@app.get("/cam/{camera_id}/video_feed")
+async def camera_video_feed(camera_id: str, profile: str = DEFAULT_PROFILE, max_fps: float = None):
+    if camera_id not in capture_engines:
+        return unknown_camera(camera_id)
+    if profile not in PROFILES:
+        return unknown_profile(profile)
+    return StreamingResponse(generate_frames(PROFILES[profile], max_fps, frame_hubs[camera_id]),
+                             media_type='multipart/x-mixed-replace; boundary=frame')
+
+@app.get("/cam/{camera_id}/health")
+async def get_camera_health_by_id(camera_id: str):
+    if camera_id not in capture_engines:
+        return unknown_camera(camera_id)
+    return capture_engines[camera_id].health()
+
+@app.get("/cam/{camera_id}/stats")
+async def get_camera_stats(camera_id: str):
+    if camera_id not in capture_engines:
+        return unknown_camera(camera_id)
+    return {**camera_throughput(camera_id), "video_feed": frame_hubs[camera_id].stats()}
+
+@app.get("/axes")
+async def list_axes():
+    return {
+        "default": DEFAULT_AXIS,
+        "axes": {axis_id: {"port": axis_ports[axis_id], "state": controller_states[axis_id].snapshot(),
+                           "serial": serial_links[axis_id].stats()} for axis_id in serial_links},
+    }
+
+@app.get("/axis/{axis_id}/status")
+async def get_axis_status(axis_id: str, fresh: bool = False):
+    if axis_id not in serial_links:
+        return unknown_axis(axis_id)
+    state = await cached_state(fresh, {"cmd": "status"}, axis_id)
+    if isinstance(state, JSONResponse):
+        return state
+    return [state]
+
+@app.get("/axis/{axis_id}/stop")
+async def stop_axis(axis_id: str):
+    if axis_id not in serial_links:
+        return unknown_axis(axis_id)
+    return await communicate_with_serial({"cmd": "halt"}, link=serial_links[axis_id])
+
+@app.get("/axis/{axis_id}/go/{x}")
+async def go_axis(axis_id: str, x: str):
+    if axis_id not in serial_links:
+        return unknown_axis(axis_id)
+    return await communicate_with_serial({"cmd": "go_x", "x": x}, 2, MOTION_TIMEOUT, link=serial_links[axis_id])
+
+@app.get("/axis/{axis_id}/events")
+async def axis_state_events(axis_id: str):
+    if axis_id not in serial_links:
+        return unknown_axis(axis_id)
+    return StreamingResponse(controller_states[axis_id].events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+# import 가 끝난 시점, 여기까지는 카메라를 건드리지 않음
+IMPORTED_AT = round(process_uptime(), 3)
@@ -1,41 +1,27 @@
 from fastapi import FastAPI,  status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import serial
-import asyncio, json, time
+from backends import create_serial_link
+from serial_link import COMMAND_TIMEOUT, MOTION_TIMEOUT, MotionInterrupted
+from controller_state import ControllerState
 
 
-def send_json_data(ser, data):
-    try:
-        # 데이터 전송
-        ser.write(json.dumps(data).encode('utf-8') + b'\n')
-    except Exception as e:
-        print(f"Error communicating with serial device: {e}")
-    finally:
-        return None
-
-def receive_multiple_responses(ser, response_count=1):
-    responses = []
-    try:
-        while len(responses) < response_count:
-            line = ser.readline().decode('utf-8').strip()
-            if line:
-                responses.append(json.loads(line))
-    except Exception as e:
-        print(f"Error receiving data from serial device: {e}")
-        return None
-    return responses
+serial_link = create_serial_link()
+controller_state = ControllerState(serial_link)
 
-def communicate_with_serial(command, response_count=1):
+async def communicate_with_serial(command, response_count=1, timeout=COMMAND_TIMEOUT):
     try:
-        with serial.Serial("/dev/ttyAMA0", 115200, timeout=1) as ser:
-            send_json_data(ser, command)
-            responses = receive_multiple_responses(ser, response_count)
+        responses = await serial_link.request(command, response_count, timeout)
         if responses:
             return JSONResponse(content=responses, status_code=status.HTTP_200_OK)
         else:
             return JSONResponse(content="No response from UART device", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except serial.SerialException as e:
         return JSONResponse(content=f"Serial communication error: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except TimeoutError as e:
+        return JSONResponse(content=f"No response from UART device: {e}", status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+    except MotionInterrupted as e:
+        return JSONResponse(content={"error": str(e), "responses": e.responses}, status_code=status.HTTP_409_CONFLICT)
     except Exception as e:
         return JSONResponse(content=f"An error occurred: {e}", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -43,30 +29,72 @@ def communicate_with_serial(command, response_count=1):
 app = FastAPI()
             
 
+@app.on_event("startup")
+async def start_controller_state():
+    # client 수와 관계없이 일정한 간격으로만 UART 에 status 를 물어봄
+    controller_state.start()
+
+@app.on_event("shutdown")
+async def close_serial_link():
+    await controller_state.stop()
+    await serial_link.close()
+
+@app.get("/serial/stats")
+async def get_serial_stats():
+    return serial_link.stats()
+
+async def cached_state(fresh, command):
+    """
+    :return: the cached controller state, read from the UART first if fresh or nothing is cached
+    """
+    if fresh or controller_state.updated_at is None:
+        responses = await communicate_with_serial(command)
+        if responses.status_code != status.HTTP_200_OK:
+            return responses
+    return controller_state.read()
+
 @app.get("/status")
-async def get_status():
-    return communicate_with_serial({"cmd": "status"})
+async def get_status(fresh: bool = False):
+    state = await cached_state(fresh, {"cmd": "status"})
+    if isinstance(state, JSONResponse):
+        return state
+    return [state]
 
 @app.get("/location")
-async def get_camera_location():
-    return communicate_with_serial({"cmd": "get_x"})
+async def get_camera_location(fresh: bool = False):
+    state = await cached_state(fresh, {"cmd": "get_x"})
+    if isinstance(state, JSONResponse):
+        return state
+    return [{"x": state["x"], "timestamp": state["timestamp"], "age_ms": state["age_ms"]}]
+
+@app.get("/state/events")
+async def controller_state_events():
+    """
+    Server-sent events with the controller state whenever it changes
+    """
+    return StreamingResponse(controller_state.events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/state/stats")
+async def controller_state_stats():
+    return controller_state.stats()
 
 @app.get("/stop")
 async def stop_moving_camera():
-    return communicate_with_serial({"cmd": "halt"})
+    return await communicate_with_serial({"cmd": "halt"})
 
 @app.get("/go/{x}")
 async def go_moving_camera(x: str):
-    return communicate_with_serial({"cmd": "go_x", "x": x}, 2)
+    return await communicate_with_serial({"cmd": "go_x", "x": x}, 2, MOTION_TIMEOUT)
 
 @app.get("/calibrate")
 async def calibrate():
-    return communicate_with_serial({"cmd": "calibrate"})
+    return await communicate_with_serial({"cmd": "calibrate"}, timeout=MOTION_TIMEOUT)
 
 @app.get("/setmaximum/manual/{x_max}")
 async def set_maximum_manual(x_max: str):
-    return communicate_with_serial({"cmd": "calibrate", "set_type": "manual", "x_max": x_max})
+    return await communicate_with_serial({"cmd": "calibrate", "set_type": "manual", "x_max": x_max})
 
 @app.get("/setmaximum/auto")
 async def set_maximum_auto():
-    return communicate_with_serial({"cmd": "calibrate", "set_type": "limit_sw"})
\ No newline at end of file
+    return await communicate_with_serial({"cmd": "calibrate", "set_type": "limit_sw"}, timeout=MOTION_TIMEOUT)
\ No newline at end of file
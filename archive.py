@@ -0,0 +1,174 @@
+import mmap, os
+from threading import Lock
+import numpy as np
+
+ARCHIVE_DIRECTORY = "./output/archive"
+QUERY_LIMIT = 1000
+
+# 고정 크기 index 레코드, id 는 레코드 번호
+INDEX_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("position", "<f8"),     # 위치를 모르면 NaN
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("seq", "<u4"),
+])
+
+
+class SnapshotArchive:
+    """
+    Append-only JPEG archive: one packed data file and a fixed-size binary index
+
+    Both files are read through mmap, the index as a numpy record array, so a
+    query by time and position is a vectorized filter over a few bytes per
+    snapshot instead of a directory scan. Data is fsynced before its index
+    record is written, so a crash can only leave unindexed bytes at the end of
+    the data file; those, a partial index record and records whose data is
+    missing are cut off on the next start. The maps are refreshed when the
+    archive is read, not on every append. Nothing is created on disk before
+    open().
+    """
+    def __init__(self, directory=ARCHIVE_DIRECTORY):
+        self.directory = directory
+        self.data_path = os.path.join(directory, "archive.dat")
+        self.index_path = os.path.join(directory, "archive.idx")
+        self.__lock = Lock()
+        self.__index_map = None
+        self.__data_map = None
+        self.__index = np.zeros(0, INDEX_DTYPE)
+        self.__data = None
+        self.__count = 0
+        self.__stale = False
+
+    def open(self):
+        """
+        Create or recover the archive files and map them
+        """
+        if self.__data is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.__recover()
+        self.__data = open(self.data_path, 'ab')
+        self.__index_file = open(self.index_path, 'ab')
+        # append 용 파일은 쓰기 전용이라 mmap 은 읽기용 파일로
+        self.__data_reader = open(self.data_path, 'rb')
+        self.__index_reader = open(self.index_path, 'rb')
+        self.__remap()
+        self.__count = len(self.__index)
+
+    def __recover(self):
+        for path in (self.data_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        index_size = os.path.getsize(self.index_path)
+        records = index_size // INDEX_DTYPE.itemsize
+        if index_size % INDEX_DTYPE.itemsize:
+            print("Archive index: dropping a partial record")
+            os.truncate(self.index_path, records * INDEX_DTYPE.itemsize)
+        with open(self.index_path, 'rb') as f:
+            index = np.frombuffer(f.read(records * INDEX_DTYPE.itemsize), INDEX_DTYPE)
+        # data 가 잘린 레코드부터 뒤는 버림
+        ends = index["offset"].astype(np.int64) + index["length"]
+        missing = np.flatnonzero(ends > os.path.getsize(self.data_path))
+        complete = int(missing[0]) if len(missing) else records
+        if complete < records:
+            print(f"Archive index: dropping {records - complete} records without data")
+            os.truncate(self.index_path, complete * INDEX_DTYPE.itemsize)
+        end = int(ends[complete - 1]) if complete else 0
+        if os.path.getsize(self.data_path) > end:
+            print(f"Archive data: dropping {os.path.getsize(self.data_path) - end} unindexed bytes")
+            os.truncate(self.data_path, end)
+
+    def __remap(self):
+        # 파일이 커졌을 때만 다시 mmap, 새 레코드가 보이기 전에 data 부터
+        data_size = os.path.getsize(self.data_path)
+        if self.__data_map is None or len(self.__data_map) != data_size:
+            self.__data_map = mmap.mmap(self.__data_reader.fileno(), 0, access=mmap.ACCESS_READ) if data_size else None
+        index_size = os.path.getsize(self.index_path)
+        if self.__index_map is None or len(self.__index_map) != index_size:
+            self.__index_map = mmap.mmap(self.__index_reader.fileno(), 0, access=mmap.ACCESS_READ) if index_size else None
+            self.__index = np.frombuffer(self.__index_map, INDEX_DTYPE) if index_size else np.zeros(0, INDEX_DTYPE)
+
+    def append(self, data, timestamp, position=None, seq=0):
+        """
+        :return: id of the stored snapshot
+        """
+        with self.__lock:
+            offset = self.__data.tell()
+            self.__data.write(data)
+            self.__data.flush()
+            # index 레코드가 data 보다 먼저 디스크에 남지 않도록
+            os.fsync(self.__data.fileno())
+            record = np.array([(timestamp, np.nan if position is None else float(position),
+                                offset, len(data), seq)], INDEX_DTYPE)
+            self.__index_file.write(record.tobytes())
+            self.__index_file.flush()
+            self.__count += 1
+            self.__stale = True
+            return self.__count - 1
+
+    def __refresh(self):
+        # 마지막으로 읽은 뒤 append 가 있었을 때만 다시 mmap
+        if self.__stale:
+            with self.__lock:
+                self.__remap()
+                self.__stale = False
+        return self.__index
+
+    def __len__(self):
+        return self.__count
+
+    def get(self, snapshot_id):
+        """
+        :return: (JPEG bytes, record info) or None for an unknown id
+        """
+        index = self.__refresh()
+        if not 0 <= snapshot_id < len(index):
+            return None
+        record = index[snapshot_id]
+        offset, length = int(record["offset"]), int(record["length"])
+        return self.__data_map[offset:offset + length], self.info(snapshot_id, record)
+
+    @staticmethod
+    def info(snapshot_id, record):
+        position = float(record["position"])
+        return {
+            "id": int(snapshot_id),
+            "timestamp": float(record["timestamp"]),
+            "position": None if np.isnan(position) else position,
+            "seq": int(record["seq"]),
+            "bytes": int(record["length"]),
+        }
+
+    def query(self, t0=None, t1=None, x=None, tolerance=0, x0=None, x1=None, limit=QUERY_LIMIT):
+        """
+        Snapshots taken between t0 and t1 whose position is within tolerance of x
+        or between x0 and x1, oldest first
+
+        :return: (total number of matches, info of the first limit matches)
+        """
+        index = self.__refresh()
+        mask = np.ones(len(index), bool)
+        if t0 is not None:
+            mask &= index["timestamp"] >= t0
+        if t1 is not None:
+            mask &= index["timestamp"] <= t1
+        positions = index["position"]
+        if x is not None:
+            mask &= np.abs(positions - x) <= tolerance
+        if x0 is not None:
+            mask &= positions >= x0
+        if x1 is not None:
+            mask &= positions <= x1
+        ids = np.flatnonzero(mask)
+        return len(ids), [self.info(snapshot_id, index[snapshot_id]) for snapshot_id in ids[:limit]]
+
+    def stats(self):
+        index = self.__refresh()
+        return {
+            "snapshots": len(index),
+            "data_bytes": os.path.getsize(self.data_path),
+            "index_bytes": os.path.getsize(self.index_path),
+            "oldest": float(index["timestamp"][0]) if len(index) else None,
+            "newest": float(index["timestamp"][-1]) if len(index) else None,
+        }
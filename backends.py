@@ -0,0 +1,49 @@
+import os
+from serial_link import SerialLink, SERIAL_PORT
+
+# ids / sim: 실제 IDS 카메라 또는 시뮬레이션 카메라
+CAMERA_BACKEND = os.environ.get("CAMERA_BACKEND", "ids")
+# uart / sim: 실제 UART 또는 pty 위의 가짜 motion controller
+SERIAL_BACKEND = os.environ.get("SERIAL_BACKEND", "uart")
+
+# 카메라 여러 대: "front=4104123456,back=4104123457" (id=IDS serial 번호 또는 장치 순서), 비우면 첫번째 카메라 한대
+CAMERAS = os.environ.get("CAMERAS", "")
+# motion controller 여러 축: "x=/dev/ttyUSB0,z=/dev/ttyUSB1", 비우면 SERIAL_PORT 한 축
+AXES = os.environ.get("AXES", "")
+
+# 가짜 controller 는 serial link 가 살아있는 동안 유지되어야 함
+_fake_controllers = []
+
+
+def create_camera(backend=CAMERA_BACKEND, **kwargs):
+    # ids_peak 는 실제 카메라를 쓸 때만 import
+    if backend == "sim":
+        from sim_camera import SimCamera
+        return SimCamera(**kwargs)
+    if backend == "ids":
+        from camera3 import IdsCamera
+        return IdsCamera(**kwargs)
+    raise ValueError(f"Unknown camera backend {backend}")
+
+def parse_devices(spec, default_id="0"):
+    """
+    :return: {id: device} for "id=device,...", an item without "=" is its own device; {default_id: None} if empty
+    """
+    devices = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, separator, device = item.partition("=")
+        devices[name.strip()] = device.strip() if separator else name.strip()
+    return devices or {default_id: None}
+
+def create_serial_link(backend=SERIAL_BACKEND, port=None):
+    if backend == "sim":
+        from fake_controller import FakeController
+        controller = FakeController()
+        _fake_controllers.append(controller)
+        print(f"가짜 motion controller: {controller.port}")
+        return SerialLink(controller.port)
+    if backend == "uart":
+        return SerialLink(port or os.environ.get("SERIAL_PORT", SERIAL_PORT))
+    raise ValueError(f"Unknown serial backend {backend}")
@@ -0,0 +1,386 @@
+import argparse, inspect, json, os, platform, subprocess, time, tracemalloc, queue
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from buffer_pool import BufferPool, RING_SIZE
+from image_formats import bgr_to_yuv420
+from backends import create_camera
+from sim_camera import SimulatedBufferSource, SimulatedConverter, SIM_WIDTH, SIM_HEIGHT
+from jpeg_encoders import ENCODERS, PRESETS, available_encoders
+from metrics import summarize
+from bench_server import bench_server, bench_startup
+
+
+def bench_buffer_pool(frames=300, width=SIM_WIDTH, height=SIM_HEIGHT, ring_size=RING_SIZE, buffer_count=8):
+    """
+    Per-frame allocations and sustained fps of the capture path
+
+    "allocate" is the old path (new generator and a fresh numpy array per frame),
+    "pool" copies every conversion into the preallocated BufferPool.
+    """
+    results = {}
+    for mode in ("allocate", "pool"):
+        source = SimulatedBufferSource(width, height, fps=0, buffer_count=buffer_count)
+        converter = SimulatedConverter(width, height, "rgb")
+        pool = BufferPool((height, width, 3), size=ring_size)
+
+        def grab():
+            buffer = source.wait_for_finished_buffer()
+            try:
+                image = converter.convert(buffer)
+                return image.copy() if mode == "allocate" else pool.store(image)
+            finally:
+                source.queue_buffer(buffer)
+
+        def streaming_image():
+            yield grab()
+
+        def next_frame():
+            return next(streaming_image()) if mode == "allocate" else grab()
+
+        # Warm up, then measure allocated bytes per frame with tracemalloc
+        for _ in range(5):
+            next_frame()
+        tracemalloc.start()
+        allocated = 0
+        for _ in range(min(frames, 50)):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            image = next_frame()
+            _, peak = tracemalloc.get_traced_memory()
+            allocated += peak - before
+            del image
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for _ in range(frames):
+            next_frame()
+        elapsed = time.perf_counter() - start
+
+        results[mode] = {
+            "allocated_bytes_per_frame": allocated // min(frames, 50),
+            "fps": round(frames / elapsed, 1),
+            "ms_per_frame": round(elapsed / frames * 1000, 3),
+        }
+    return {"width": width, "height": height, "frames": frames, "ring_size": ring_size, "results": results}
+
+
+def bench_conversion(frames=300, width=SIM_WIDTH, height=SIM_HEIGHT):
+    """
+    Per-frame conversion time of each route from the raw Bayer buffer
+
+    "rgb_cvtcolor_bgr" is the old path (RGB8 from the camera, then cvtColor to BGR).
+    """
+    source = SimulatedBufferSource(width, height, fps=0)
+    rgb = SimulatedConverter(width, height, "rgb")
+    bgr = SimulatedConverter(width, height, "bgr")
+    routes = {
+        "rgb_cvtcolor_bgr": lambda buffer: cv2.cvtColor(rgb.convert(buffer), cv2.COLOR_RGB2BGR),
+        "bgr": lambda buffer: bgr.convert(buffer),
+        "yuv420": lambda buffer: bgr_to_yuv420(bgr.convert(buffer)),
+    }
+    results = {}
+    for name, route in routes.items():
+        buffer = source.wait_for_finished_buffer()
+        route(buffer)
+        start = time.perf_counter()
+        for _ in range(frames):
+            route(buffer)
+        elapsed = time.perf_counter() - start
+        source.queue_buffer(buffer)
+        results[name] = {"ms_per_frame": round(elapsed / frames * 1000, 3)}
+    return {"width": width, "height": height, "frames": frames, "results": results}
+
+
+def bench_jpeg(frames=300, width=SIM_WIDTH, height=SIM_HEIGHT, quality=90, workers=(1, 2, 4)):
+    """
+    JPEG encode time and size per encoder and preset, and pool throughput
+
+    "pool" submits frames in capture order to a thread pool and collects them in
+    the same order, like FrameHub does for /video_feed.
+    """
+    source = SimulatedBufferSource(width, height, fps=0)
+    converter = SimulatedConverter(width, height, "bgr")
+    images = []
+    for _ in range(4):
+        buffer = source.wait_for_finished_buffer()
+        images.append(converter.convert(buffer).copy())
+        source.queue_buffer(buffer)
+
+    results = {}
+    for name in available_encoders():
+        encoder = ENCODERS[name]()
+        presets = {}
+        for preset in PRESETS:
+            encoder(images[0], quality, preset)
+            size = 0
+            start = time.perf_counter()
+            for i in range(frames):
+                size += len(encoder(images[i % len(images)], quality, preset))
+            elapsed = time.perf_counter() - start
+            presets[preset] = {
+                "ms_per_frame": round(elapsed / frames * 1000, 3),
+                "fps": round(frames / elapsed, 1),
+                "kbytes_per_frame": round(size / frames / 1024, 1),
+            }
+        pool = {}
+        for count in workers:
+            with ThreadPoolExecutor(count) as executor:
+                start = time.perf_counter()
+                futures = [executor.submit(encoder, images[i % len(images)], quality, "fast") for i in range(frames)]
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - start
+            pool[f"workers_{count}"] = {"fps": round(frames / elapsed, 1)}
+        results[name] = {"presets": presets, "pool_fast": pool}
+    return {"width": width, "height": height, "frames": frames, "quality": quality,
+            "cpus": os.cpu_count(), "results": results}
+
+
+def bench_trigger(frames=20, camera_backend="sim"):
+    """
+    Free-run <-> trigger mode switch time and trigger-to-frame latency
+    """
+    camera = create_camera(camera_backend)
+    arrivals = queue.Queue()
+    stop = Event()
+
+    def reader():
+        for _ in camera.frames():
+            arrivals.put(time.perf_counter())
+            if stop.is_set():
+                break
+    thread = Thread(target=reader, daemon=True)
+    thread.start()
+    arrivals.get(timeout=5)
+
+    def drain():
+        time.sleep(0.1)
+        while not arrivals.empty():
+            arrivals.get_nowait()
+
+    switch_on, switch_off, first_frame, latency = [], [], [], []
+    triggers = max(1, frames // 4)
+    for _ in range(4):
+        switch_on.append(camera.set_trigger_mode(True))
+        drain()
+        for _ in range(triggers):
+            start = time.perf_counter()
+            camera.trigger()
+            latency.append(arrivals.get(timeout=2) - start)
+        start = time.perf_counter()
+        switch_off.append(camera.set_trigger_mode(False))
+        # free-run 재개 후 첫 프레임까지
+        first_frame.append(arrivals.get(timeout=2) - start)
+        drain()
+    stop.set()
+    thread.join()
+    return {
+        "triggers": len(latency),
+        "switch_to_trigger": summarize(switch_on),
+        "switch_to_freerun": summarize(switch_off),
+        "freerun_first_frame": summarize(first_frame),
+        "trigger_to_frame": summarize(latency),
+    }
+
+
+def bench_serial(frames=100, speed=100):
+    """
+    Concurrent status polls against the fake controller while a go_x is moving
+
+    frames is the number of concurrent polls. Loop lag is how late a 10 ms
+    asyncio.sleep wakes up meanwhile, halt_ms is how long /stop takes to end the
+    pending go_x.
+    """
+    import asyncio
+    from fake_controller import FakeController
+    from serial_link import SerialLink, MotionInterrupted
+
+    async def run():
+        controller = FakeController(speed=speed)
+        link = SerialLink(controller.port)
+        lag = []
+        running = True
+
+        async def ticker():
+            while running:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag.append(time.perf_counter() - start - 0.01)
+
+        async def poll():
+            start = time.perf_counter()
+            await link.request({"cmd": "status"})
+            return time.perf_counter() - start
+
+        tick = asyncio.get_running_loop().create_task(ticker())
+        go = asyncio.get_running_loop().create_task(link.request({"cmd": "go_x", "x": 1000}, 2))
+        await asyncio.sleep(0.05)
+        polls = await asyncio.gather(*[poll() for _ in range(frames)])
+        start = time.perf_counter()
+        await link.request({"cmd": "halt"})
+        try:
+            await go
+            interrupted = False
+        except MotionInterrupted:
+            interrupted = True
+        halt = time.perf_counter() - start
+        running = False
+        await tick
+        await link.close()
+        controller.close()
+        return polls, lag, halt, interrupted
+
+    polls, lag, halt, interrupted = asyncio.run(run())
+    return {
+        "concurrent_polls": frames,
+        "status_poll": summarize(polls),
+        "loop_lag": summarize(lag),
+        "halt_ms": round(halt * 1000, 2),
+        "go_interrupted": interrupted,
+    }
+
+
+def bench_roi(frames=300, camera_backend="sim", profiles=("full", "preview")):
+    """
+    Capture and encode cost at each camera ROI / binning preset
+
+    The camera runs as fast as it allows at every preset. capture_cpu_ms is the
+    process CPU per frame for grab and conversion, raw_mb_per_s the sensor data
+    the camera sends over USB, encode_cpu_ms the JPEG encode per stream profile.
+    """
+    from camera_settings import ROI_PRESETS, roi_settings
+    from frame_hub import Frame
+    from jpeg_encoders import create_encoder
+    from stream_profiles import PROFILES
+    encode = create_encoder()
+    camera = create_camera(camera_backend)
+    stream = camera.frames()
+    results = {}
+    current = camera.settings()
+    try:
+        for preset in ROI_PRESETS:
+            # relock 은 frames() 안에서 적용
+            _, relock = camera.apply_settings({**roi_settings(preset, camera.sensor_size, current), "fps": 1000}, wait=False)
+            image, _ = next(stream)
+            applied = relock.result(10)
+            for _ in range(5):
+                next(stream)
+            start, cpu = time.perf_counter(), time.process_time()
+            for _ in range(frames):
+                image, _ = next(stream)
+            elapsed, capture_cpu = time.perf_counter() - start, time.process_time() - cpu
+            height, width = image.shape[:2]
+            encode_cpu = {}
+            for name in profiles:
+                count = max(1, frames // 5)
+                cpu = time.process_time()
+                for i in range(count):
+                    # 매번 새 Frame 이라 cache 없이 resize + encode
+                    Frame(i, image, time.time(), encode).jpeg(PROFILES[name])
+                encode_cpu[name] = round((time.process_time() - cpu) / count * 1000, 2)
+            results[preset] = {
+                "settings": applied,
+                "size": [width, height],
+                "fps": round(frames / elapsed, 1),
+                "max_fps": camera.fps_limit,
+                "raw_mb_per_s": round(width * height * frames / elapsed / 1e6, 1),
+                "capture_cpu_ms": round(capture_cpu / frames * 1000, 2),
+                "encode_cpu_ms": encode_cpu,
+            }
+        camera.apply_settings(roi_settings("full", camera.sensor_size, current), wait=False)
+        next(stream)
+    finally:
+        stream.close()
+        if hasattr(camera, "close"):
+            camera.close()
+    return {"frames": frames, "sensor_size": list(camera.sensor_size), "results": results}
+
+
+def bench_recovery(outages=(0.2, 1.0, 3.0), width=640, height=480):
+    """
+    Camera downtime after a simulated USB disconnect of each outage length
+
+    The CaptureEngine reopens the camera with exponential backoff; recovery_s is
+    the time from the failure until frames arrive again, overhead_s what it adds
+    to the outage itself.
+    """
+    from capture_engine import CaptureEngine
+    from frame_hub import FrameHub
+    from sim_camera import SimCamera, unplug
+    from jpeg_encoders import create_encoder
+    hub = FrameHub(create_encoder())
+    engine = CaptureEngine(lambda: SimCamera(width=width, height=height), hub)
+    engine.start()
+
+    def wait(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError(engine.health())
+            time.sleep(0.01)
+    results = []
+    try:
+        wait(lambda: engine.healthy, 10)
+        for outage in outages:
+            recoveries, failures = engine.recoveries, engine.failures
+            unplug(outage)
+            wait(lambda: engine.recoveries > recoveries, outage + 60)
+            results.append({
+                "outage_s": outage,
+                "recovery_s": engine.last_recovery_s,
+                "overhead_s": round(engine.last_recovery_s - outage, 3),
+                # 스트림 실패 한번 + 장치가 없는 동안 실패한 open
+                "failures": engine.failures - failures,
+            })
+    finally:
+        engine.stop()
+        hub.close()
+    return {"results": results, "health": engine.health()}
+
+
+BENCHMARKS = {
+    "buffer_pool": bench_buffer_pool,
+    "conversion": bench_conversion,
+    "jpeg": bench_jpeg,
+    "trigger": bench_trigger,
+    "serial": bench_serial,
+    "server": bench_server,
+    "startup": bench_startup,
+    "recovery": bench_recovery,
+    "roi": bench_roi,
+}
+
+
+def run_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "opencv": cv2.__version__,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="movingCamera benchmarks (simulated camera)")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark", help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--camera", default="sim", help="camera backend for camera benchmarks: sim or ids")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    options = {"frames": args.frames, "camera_backend": args.camera}
+    report = {"meta": run_metadata(), "results": {}}
+    for name in args.benchmarks or BENCHMARKS:
+        parameters = inspect.signature(BENCHMARKS[name]).parameters
+        report["results"][name] = BENCHMARKS[name](**{key: value for key, value in options.items() if key in parameters})
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
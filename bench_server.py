@@ -0,0 +1,244 @@
+import asyncio, os, socket, subprocess, sys, time
+from metrics import summarize
+
+SERVER_STARTUP_TIMEOUT = 30
+VIDEO_CLIENTS = (1, 5, 20)
+VIDEO_DURATION = 5        # /video_feed 측정 시간 (초)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """
+    uvicorn app:app in a subprocess on the simulated camera and controller
+    """
+    def __init__(self, env=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, CAMERA_BACKEND="sim", SERIAL_BACKEND="sim", **(env or {}))
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=self.env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def cpu_time(self):
+        """
+        :return: user + system CPU seconds used by the server process (Linux /proc)
+        """
+        with open(f"/proc/{self.process.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_ready(client, timeout=SERVER_STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/get_image")
+            if response.status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError("server did not deliver a frame")
+
+
+async def measure_capture_to_jpeg(client, requests):
+    """
+    Time from the camera timestamp of a new frame until its JPEG is received
+    """
+    latency = []
+    for _ in range(requests):
+        response = await client.get("/get_image", params={"wait_new": 1})
+        latency.append(time.time() - float(response.headers["x-frame-timestamp"]))
+    return summarize(latency)
+
+
+async def measure_get_image(client, requests, concurrency=4):
+    latency = []
+
+    async def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await client.get("/get_image")
+            response.raise_for_status()
+            latency.append(time.perf_counter() - start)
+    await asyncio.gather(*[worker(requests // concurrency) for _ in range(concurrency)])
+    return summarize(latency)
+
+
+async def count_stream_frames(client, duration, profile):
+    frames = 0
+    tail = b''
+    deadline = time.monotonic() + duration
+    async with client.stream("GET", "/video_feed", params={"profile": profile}) as response:
+        async for chunk in response.aiter_raw():
+            data = tail + chunk
+            frames += data.count(b'--frame\r\n')
+            tail = data[-9:]
+            if time.monotonic() > deadline:
+                break
+    return frames
+
+
+async def measure_video_feed(client, server, clients, duration, profile):
+    before_stats = (await client.get("/video_feed/stats")).json()
+    cpu_before = server.cpu_time()
+    counts = await asyncio.gather(*[count_stream_frames(client, duration, profile) for _ in range(clients)])
+    cpu = server.cpu_time() - cpu_before
+    after_stats = (await client.get("/video_feed/stats")).json()
+    captured = after_stats["seq"] - before_stats["seq"]
+    return {
+        "clients": clients,
+        "fps_per_client_mean": round(sum(counts) / clients / duration, 2),
+        "fps_per_client_min": round(min(counts) / duration, 2),
+        "captured_fps": round(captured / duration, 2),
+        "server_cpu_ms_per_frame": round(cpu / captured * 1000, 2) if captured else None,
+        "server_cpu_percent": round(cpu / duration * 100, 1),
+    }
+
+
+async def count_stream_bytes(client, path, duration, profile):
+    size = 0
+    deadline = time.monotonic() + duration
+    async with client.stream("GET", path, params={"profile": profile}) as response:
+        if response.status_code != 200:
+            return None
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+            if time.monotonic() > deadline:
+                break
+    return size
+
+
+async def measure_h264(client, duration, profile):
+    """
+    Bytes/s of /video_feed/h264 against /video_feed for the same profile, watched side by side
+    """
+    h264, mjpeg = await asyncio.gather(count_stream_bytes(client, "/video_feed/h264", duration, profile),
+                                       count_stream_bytes(client, "/video_feed", duration, profile))
+    if h264 is None:
+        return None
+    stats = (await client.get("/video_feed/h264/stats")).json()
+    return {
+        "h264_bytes_per_s": round(h264 / duration),
+        "mjpeg_bytes_per_s": round(mjpeg / duration),
+        "bandwidth_ratio": round(mjpeg / h264, 1) if h264 else None,
+        "h264_encode_ms_per_frame": stats["h264"][profile]["encode_ms_per_frame"],
+        "mjpeg_encode_ms_per_frame": stats["mjpeg"][profile]["encode_ms_per_frame"],
+    }
+
+
+async def measure_serial(client, path, requests, concurrency):
+    """
+    :return: HTTP latency, and the UART round trips SerialLink saw meanwhile (its rtt window is the last 200)
+    """
+    latency = []
+    before = (await client.get("/serial/stats")).json()
+
+    async def worker(index):
+        for i in range(requests // concurrency):
+            start = time.perf_counter()
+            response = await client.get(path(index, i))
+            response.raise_for_status()
+            latency.append(time.perf_counter() - start)
+    await asyncio.gather(*[worker(index) for index in range(concurrency)])
+    after = (await client.get("/serial/stats")).json()
+    return {
+        **summarize(latency),
+        "concurrency": concurrency,
+        # 상태 polling 도 같은 UART 를 쓰므로 포함됨
+        "serial_requests": after["requests"] - before["requests"],
+        "serial_rtt_ms_p50": after["rtt_ms_p50"],
+        "serial_rtt_ms_p99": after["rtt_ms_p99"],
+    }
+
+
+async def run_server_benchmarks(server, requests, clients, duration, profile):
+    import httpx
+    async with httpx.AsyncClient(base_url=server.url, timeout=60,
+                                 limits=httpx.Limits(max_connections=max(clients) + 20)) as client:
+        await wait_ready(client)
+        results = {
+            "capture_to_jpeg": await measure_capture_to_jpeg(client, min(requests, 50)),
+            "get_image": await measure_get_image(client, requests),
+            "video_feed": [await measure_video_feed(client, server, count, duration, profile) for count in clients],
+            "h264": await measure_h264(client, duration, profile),
+            # /status 는 ControllerState 의 cache 를 읽고, fresh=1 은 SerialLink.request 를 거침
+            "status": await measure_serial(client, lambda index, i: "/status", requests, 10),
+            "status_fresh": await measure_serial(client, lambda index, i: "/status?fresh=1", requests, 10),
+            # 새 go_x 는 진행 중인 go_x 를 끝내므로 (409) 한번에 하나씩
+            "go": await measure_serial(client, lambda index, i: f"/go/{(index * 7 + i) % 100}", min(requests, 40), 1),
+        }
+        results["serial"] = (await client.get("/serial/stats")).json()
+        return results
+
+
+async def measure_startup(server, timeout=SERVER_STARTUP_TIMEOUT):
+    """
+    Seconds from spawning the server until /status answers and until /get_image returns a frame
+    """
+    import httpx
+    results = {}
+    async with httpx.AsyncClient(base_url=server.url, timeout=5) as client:
+        deadline = time.monotonic() + timeout
+        for name, path in (("first_response_s", "/status"), ("first_frame_s", "/get_image")):
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(path)).status_code == 200:
+                        results[name] = round(time.perf_counter() - server.started, 3)
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.01)
+        results["ready"] = (await client.get("/ready")).json()
+    return results
+
+
+def bench_startup(open_time=3.0, modes=("eager", "background", "lazy")):
+    """
+    Cold start to first HTTP response and to first frame for each CAMERA_STARTUP mode
+
+    open_time stands in for ids_peak device open and UserSetLoad on the simulated camera.
+    """
+    results = {}
+    for mode in modes:
+        with ServerProcess({"CAMERA_STARTUP": mode, "SIM_OPEN_TIME": str(open_time)}) as server:
+            results[mode] = asyncio.run(measure_startup(server))
+    return {"sim_open_time_s": open_time, "results": results}
+
+
+def bench_server(frames=300, clients=VIDEO_CLIENTS, duration=VIDEO_DURATION, profile="full"):
+    """
+    End-to-end latency and throughput of app.py on the simulated backends
+
+    frames is used as the number of requests per request-latency measurement.
+    """
+    # carriage 이동 시간을 없애 serial 경로만 측정
+    with ServerProcess({"SIM_SPEED": "1000000"}) as server:
+        results = asyncio.run(run_server_benchmarks(server, frames, clients, duration, profile))
+    results["config"] = {
+        "sim_width": int(server.env.get("SIM_WIDTH", 1936)),
+        "sim_height": int(server.env.get("SIM_HEIGHT", 1096)),
+        "sim_fps": float(server.env.get("SIM_FPS", 30)),
+        "profile": profile,
+        "video_duration_s": duration,
+    }
+    return results
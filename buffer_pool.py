@@ -0,0 +1,72 @@
+import numpy as np
+from threading import Lock
+
+RING_SIZE = 4  # 변환된 이미지를 담는 버퍼 수, pin 되지 않은 한 프레임은 RING_SIZE 프레임 뒤에 덮어써짐
+
+
+class BufferPool:
+    """
+    Ring of preallocated NumPy images the camera converts into
+
+    A slot handed out by next_slot() is reused RING_SIZE frames later unless it
+    is pinned: pin(image) keeps the slot out of the rotation until the matching
+    release(image), so an image that is still queued for encoding is never
+    overwritten. When every slot is pinned the frame gets a new array instead
+    of waiting, the camera never blocks on a slow consumer.
+    """
+    def __init__(self, shape, dtype=np.uint8, size=RING_SIZE):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.__buffers = [np.empty(self.shape, dtype) for _ in range(size)]
+        self.__slots = {id(buffer): index for index, buffer in enumerate(self.__buffers)}
+        self.__pins = [0] * size
+        self.__lock = Lock()
+        self.__index = 0
+        self.overflows = 0  # 모든 slot 이 pin 되어 새로 할당한 횟수
+
+    def __len__(self):
+        return len(self.__buffers)
+
+    def next_slot(self):
+        with self.__lock:
+            for _ in range(len(self.__buffers)):
+                index = self.__index
+                self.__index = (index + 1) % len(self.__buffers)
+                if not self.__pins[index]:
+                    return self.__buffers[index]
+            self.overflows += 1
+        return np.empty(self.shape, self.dtype)
+
+    def store(self, image):
+        """
+        Copy image into the next free slot without allocating
+        """
+        slot = self.next_slot()
+        np.copyto(slot, image.reshape(self.shape))
+        return slot
+
+    def pin(self, image):
+        """
+        Keep the slot holding image from being reused until release(image)
+
+        :return: False if image is not a slot of this pool (nothing to pin)
+        """
+        index = self.__slots.get(id(image))
+        if index is None or self.__buffers[index] is not image:
+            return False
+        with self.__lock:
+            self.__pins[index] += 1
+        return True
+
+    def release(self, image):
+        index = self.__slots.get(id(image))
+        if index is None or self.__buffers[index] is not image:
+            return
+        with self.__lock:
+            self.__pins[index] -= 1
+
+    def pinned(self):
+        """
+        :return: number of slots currently pinned
+        """
+        return sum(1 for pins in self.__pins if pins)
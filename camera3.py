@@ -1,20 +1,52 @@
-import sys, os
+import sys, os, time
+from concurrent.futures import Future
 os.environ['GENICAM_GENTL64_PATH'] = '/usr/lib/ids/cti'
 from ids_peak import ids_peak
 from ids_peak_ipl import ids_peak_ipl
 from ids_peak import ids_peak_ipl_extension
+from buffer_pool import BufferPool, RING_SIZE
+from metrics import CAMERA_WAIT_BUFFER, CAMERA_CONVERT, CAMERA_COPY, FRAMES_INCOMPLETE
+from camera_settings import LIVE_SETTINGS, RELOCK_SETTINGS, SCALING_SETTINGS, DEFAULT_SETTINGS, split_settings
 
 FPS_LIMIT = 30
-TARGET_PIXEL_FORMAT = ids_peak_ipl.PixelFormatName_RGB8
+# OpenCV 는 BGR 순서를 사용하므로 변환 한번으로 바로 인코딩 가능한 BGR8 로 변환
+PIXEL_FORMATS = {
+    "bgr": ids_peak_ipl.PixelFormatName_BGR8,
+    "rgb": ids_peak_ipl.PixelFormatName_RGB8,
+}
+TARGET_PIXEL_FORMAT = "bgr"
+CLOCK_DRIFT = 1e-5  # 카메라/호스트 clock offset 추정치가 프레임당 늘어날 수 있는 양 (초)
+BUFFER_COUNT = 8  # 카메라 datastream 에 announce 할 버퍼 수 (최소 요구량보다 적으면 최소 요구량 사용)
+MAX_TIMEOUTS = 3  # free-run 에서 연속 buffer timeout 이 이보다 많으면 stream 이 멈춘 것으로 봄
+MAX_INCOMPLETE = 30  # 연속으로 incomplete buffer 만 오면 stream 이 멈춘 것으로 봄
+RELOCK_TIMEOUT = 10  # frames() 가 relock 설정을 적용할 때까지 기다리는 시간 (초)
 
 class IdsCamera:
-    def __init__(self):
+    def __init__(self, buffer_count=BUFFER_COUNT, ring_size=RING_SIZE, pixel_format=TARGET_PIXEL_FORMAT,
+                 fps_limit=FPS_LIMIT, device=None):
+        """
+        :param device: serial number or index in the device list of the camera to open, None for the first openable
+        """
+        self.fps_limit = fps_limit
+        self.device = device
+        self.pixel_format = pixel_format
+        self.__target_pixel_format = PIXEL_FORMATS[pixel_format]
+        self.buffer_count = buffer_count
+        self.ring_size = ring_size
+        self.__buffer_pool = None
+        self.__clock_offset = None
+        self.triggered = False
         self.__device = None
         self.__nodemap_remote_device = None
+        self.__nodes = {}
         self.__datastream = None
         self.__acquisition_running = False
+        # 실행 중에 바꾼 설정, acquisition 을 다시 시작할 때 다시 적용
+        self.__live_settings = dict(DEFAULT_SETTINGS)
+        self.__pending_relock = None
         self.__image_converter = ids_peak_ipl.ImageConverter()
         self.__initialized = False
+        self.__closed = False
         try:
             ids_peak.Library.Initialize()
         except Exception as e:
@@ -44,13 +76,16 @@ class IdsCamera:
                 print("Error", "No device found!")
                 return False
 
-            # Open the first openable device in the managers device list
-            for device in device_manager.Devices():
+            # Open the requested device, or the first openable one in the managers device list
+            for index, device in enumerate(device_manager.Devices()):
+                if self.device is not None and str(self.device) not in (str(index), device.SerialNumber()):
+                    continue
                 if device.IsOpenable():
                     self.__device = device.OpenDevice(ids_peak.DeviceAccessType_Control)
                     break
             else:
-                raise Exception("No device could be opened!")
+                raise Exception("No device could be opened!" if self.device is None
+                                else f"Camera {self.device} not found or not openable!")
             # Return if no device could be opened
             if self.__device is None:
                 raise Exception("No device could be opened!")
@@ -66,13 +101,14 @@ class IdsCamera:
             
             # Get nodemap of the remote device for all accesses to the genicam nodemap tree
             self.__nodemap_remote_device = self.__device.RemoteDevice().NodeMaps()[0]
+            self.__nodes = {}
             
             # To prepare for untriggered continuous image acquisition, load the default user set if available and
             # wait until execution is finished
             try:
-                self.__nodemap_remote_device.FindNode("UserSetSelector").SetCurrentEntry("Default")
-                self.__nodemap_remote_device.FindNode("UserSetLoad").Execute()
-                self.__nodemap_remote_device.FindNode("UserSetLoad").WaitUntilDone()
+                self.__node("UserSetSelector").SetCurrentEntry("Default")
+                self.__node("UserSetLoad").Execute()
+                self.__node("UserSetLoad").WaitUntilDone()
                 
             except ids_peak.Exception:
                 # Userset is not available
@@ -80,21 +116,34 @@ class IdsCamera:
                 pass
             
 
-            # Get the payload size for correct buffer allocation
-            payload_size = self.__nodemap_remote_device.FindNode("PayloadSize").Value()
-            
-            # Get minimum number of buffers that must be announced
-            buffer_count_max = self.__datastream.NumBuffersAnnouncedMinRequired()
-            
-            # Allocate and announce image buffers and queue them
-            for i in range(buffer_count_max):
-                buffer = self.__datastream.AllocAndAnnounceBuffer(payload_size)
-                self.__datastream.QueueBuffer(buffer)
-            
+            self.__announce_buffers()
             return True
         except ids_peak.Exception as e:
             raise Exception(str(e))
 
+    def __node(self, name):
+        # FindNode 는 매번 이름으로 nodemap 을 검색하므로 handle 을 한번만 찾아 둠
+        node = self.__nodes.get(name)
+        if node is None:
+            node = self.__nodes[name] = self.__nodemap_remote_device.FindNode(name)
+        return node
+
+    def __announce_buffers(self):
+        # Get the payload size for correct buffer allocation
+        payload_size = self.__node("PayloadSize").Value()
+
+        # Announce at least the minimum number of buffers, more buffers absorb bursts without dropping frames
+        buffer_count_max = max(self.__datastream.NumBuffersAnnouncedMinRequired(), self.buffer_count)
+
+        # Allocate and announce image buffers and queue them
+        for i in range(buffer_count_max):
+            buffer = self.__datastream.AllocAndAnnounceBuffer(payload_size)
+            self.__datastream.QueueBuffer(buffer)
+
+    def __revoke_buffers(self):
+        for buffer in self.__datastream.AnnouncedBuffers():
+            self.__datastream.RevokeBuffer(buffer)
+
 
     def __close_device(self):
         """
@@ -106,11 +155,16 @@ class IdsCamera:
         # If a datastream has been opened, try to revoke its image buffers
         if self.__datastream is not None:
             try:
-                for buffer in self.__datastream.AnnouncedBuffers():
-                    self.__datastream.RevokeBuffer(buffer)
+                self.__revoke_buffers()
             except Exception as e:
                 print("Exception", str(e))
 
+        # 핸들을 놓아야 분리 후 다시 연결된 장치를 새로 열 수 있음
+        self.__datastream = None
+        self.__nodemap_remote_device = None
+        self.__nodes = {}
+        self.__device = None
+
     def __start_acquisition(self):
         """
         Start Acquisition on camera and start the acquisition timer to receive and display images
@@ -123,25 +177,29 @@ class IdsCamera:
         if self.__acquisition_running is True:
             return True
 
-        # Get the maximum framerate possible, limit it to the configured FPS_LIMIT. If the limit can't be reached, set
+        # Get the maximum framerate possible, limit it to the configured fps_limit. If the limit can't be reached, set
         # acquisition interval to the maximum possible framerate
         try:
-            max_fps = self.__nodemap_remote_device.FindNode("AcquisitionFrameRate").Maximum()
-            target_fps = min(max_fps, FPS_LIMIT)
-            self.__nodemap_remote_device.FindNode("AcquisitionFrameRate").SetValue(target_fps)
+            max_fps = self.__node("AcquisitionFrameRate").Maximum()
+            target_fps = min(max_fps, self.fps_limit)
+            self.__node("AcquisitionFrameRate").SetValue(target_fps)
         except ids_peak.Exception:
             # AcquisitionFrameRate is not available. Unable to limit fps. Print warning and continue on.
             print("Warning", "Unable to limit fps, since the AcquisitionFrameRate Node is"
                                 " not supported by the connected camera. Program will continue without limit.")
-        self.setCameraParams(False)
+        for name, value in self.__live_settings.items():
+            try:
+                self.__set(LIVE_SETTINGS[name], value)
+            except Exception as e:
+                print("Exception", name, str(e))
         try:
             # Lock critical features to prevent them from changing during acquisition
-            self.__nodemap_remote_device.FindNode("TLParamsLocked").SetValue(1)
+            self.__node("TLParamsLocked").SetValue(1)
 
-            image_width = self.__nodemap_remote_device.FindNode("Width").Value()
-            image_height = self.__nodemap_remote_device.FindNode("Height").Value()
+            image_width = self.__node("Width").Value()
+            image_height = self.__node("Height").Value()
             input_pixel_format = ids_peak_ipl.PixelFormat(
-                self.__nodemap_remote_device.FindNode("PixelFormat").CurrentEntry().Value())
+                self.__node("PixelFormat").CurrentEntry().Value())
 
             # Pre-allocate conversion buffers to speed up first image conversion
             # while the acquisition is running
@@ -149,13 +207,14 @@ class IdsCamera:
             #       get freed
             self.__image_converter = ids_peak_ipl.ImageConverter()
             self.__image_converter.PreAllocateConversion(
-                input_pixel_format, TARGET_PIXEL_FORMAT,
+                input_pixel_format, self.__target_pixel_format,
                 image_width, image_height)
+            self.__buffer_pool = BufferPool((image_height, image_width, 3), size=self.ring_size)
 
             # Start acquisition on camera
             self.__datastream.StartAcquisition()
-            self.__nodemap_remote_device.FindNode("AcquisitionStart").Execute()
-            self.__nodemap_remote_device.FindNode("AcquisitionStart").WaitUntilDone()
+            self.__node("AcquisitionStart").Execute()
+            self.__node("AcquisitionStart").WaitUntilDone()
         except Exception as e:
             print("Exception: " + str(e))
             return False
@@ -176,8 +235,7 @@ class IdsCamera:
 
         # Otherwise try to stop acquisition
         try:
-            remote_nodemap = self.__device.RemoteDevice().NodeMaps()[0]
-            remote_nodemap.FindNode("AcquisitionStop").Execute()
+            self.__node("AcquisitionStop").Execute()
 
             # Stop and flush datastream
             self.__datastream.KillWait()
@@ -189,51 +247,304 @@ class IdsCamera:
             # Unlock parameters after acquisition stop
             if self.__nodemap_remote_device is not None:
                 try:
-                    self.__nodemap_remote_device.FindNode("TLParamsLocked").SetValue(0)
+                    self.__node("TLParamsLocked").SetValue(0)
                 except Exception as e:
                     print("Exception", str(e))
 
         except Exception as e:
             print("Exception", str(e))
             
-    def streaming_image(self):
-        if not self.__initialized:
-            raise Exception("카메라가 초기화되지 않았습니다")
-        
+    def __frame_time(self, buffer, host_time):
+        """
+        Map the device timestamp of buffer onto the host clock (time.time())
+
+        The smallest host - device difference seen so far is the best estimate of
+        the clock offset, it may drift up by CLOCK_DRIFT per frame.
+        """
+        try:
+            device_time = buffer.Timestamp_ns() / 1e9
+        except ids_peak.Exception:
+            return host_time
+        if device_time <= 0:
+            return host_time
+        sample = host_time - device_time
+        if self.__clock_offset is None or abs(sample - self.__clock_offset) > 1:
+            # 첫 프레임이거나 카메라 clock 이 리셋됨
+            self.__clock_offset = sample
+        else:
+            self.__clock_offset = min(self.__clock_offset + CLOCK_DRIFT, sample)
+        return device_time + self.__clock_offset
+
+    def __grab(self):
+        """
+        :return: (image, timestamp), None for an incomplete buffer
+        """
+        # Get buffer from device's datastream
+        start = time.perf_counter()
+        buffer = self.__datastream.WaitForFinishedBuffer(5000)
+        host_time = time.time()
+        waited = time.perf_counter()
+        CAMERA_WAIT_BUFFER.observe(waited - start)
         try:
-            # Get buffer from device's datastream
-            buffer = self.__datastream.WaitForFinishedBuffer(5000)
-            # Create IDS peak IPL image for debayering and convert it to RGBa8 format
+            if buffer.IsIncomplete():
+                # 전송이 끝나지 않은 버퍼는 버리고 다시 큐에 넣음
+                FRAMES_INCOMPLETE.inc()
+                return None
+            # Create IDS peak IPL image for debayering and convert it to the target format (BGR8 by default)
             ipl_image = ids_peak_ipl_extension.BufferToImage(buffer)
             converted_ipl_image = self.__image_converter.Convert(
-                ipl_image, TARGET_PIXEL_FORMAT)
-            # Convert IDS peak IPL image to numpy array
-            img = converted_ipl_image.get_numpy_3D()
-
+                ipl_image, self.__target_pixel_format)
+            converted = time.perf_counter()
+            CAMERA_CONVERT.observe(converted - waited)
+            # Copy into the next preallocated numpy buffer instead of a new array per frame
+            image = self.__buffer_pool.store(converted_ipl_image.get_numpy_3D())
+            CAMERA_COPY.observe(time.perf_counter() - converted)
+            return image, self.__frame_time(buffer, host_time)
+        finally:
             self.__datastream.QueueBuffer(buffer)
 
-            yield img
-            
-        except ids_peak.Exception as e:
-            print("Exception: " + str(e))
+    def frames(self):
+        """
+        Continuous frame iterator yielding (image, timestamp)
+
+        Each image is a slot of buffer_pool and is overwritten ring_size frames later
+        unless it is pinned there.
+        timestamp is the camera's buffer timestamp on the host clock (time.time()).
+        A single timeout or incomplete buffer is skipped; a stalled stream or a lost
+        device raises, so the caller can close and reopen the camera.
+        """
+        if not self.__initialized:
+            raise Exception("카메라가 초기화되지 않았습니다")
+
+        timeouts = 0
+        incomplete = 0
+        while True:
+            if self.__pending_relock is not None:
+                self.__relock()
+            try:
+                frame = self.__grab()
+            except ids_peak.AbortedException:
+                # apply_settings 가 KillWait 로 깨운 경우, relock 을 적용하고 계속
+                continue
+            except ids_peak.TimeoutException as e:
+                if self.triggered:
+                    # trigger 모드에서는 trigger 가 올 때까지 프레임이 없는 것이 정상
+                    continue
+                timeouts += 1
+                print("Exception: " + str(e))
+                if timeouts >= MAX_TIMEOUTS:
+                    raise Exception(f"{timeouts} buffer timeouts in a row: {e}")
+                continue
+            timeouts = 0
+            if frame is None:
+                incomplete += 1
+                if incomplete >= MAX_INCOMPLETE:
+                    raise Exception(f"{incomplete} incomplete buffers in a row")
+                continue
+            incomplete = 0
+            yield frame
+
+    def streaming_image(self):
+        image, _ = next(self.frames())
+        yield image
 
 
-    def setCameraParams(self, autoExposure=True): 
+    def set_trigger_mode(self, enabled):
+        """
+        Switch between free-run and software triggered acquisition
+
+        Only the camera side acquisition is stopped while TriggerMode changes, the
+        device, datastream and announced buffers stay as they are.
+
+        :return: seconds the switch took
+        """
+        if enabled == self.triggered:
+            return 0.0
+        start = time.perf_counter()
+        self.__node("AcquisitionStop").Execute()
+        try:
+            self.__node("TriggerSelector").SetCurrentEntry("ExposureStart")
+            self.__node("TriggerMode").SetCurrentEntry("On" if enabled else "Off")
+            if enabled:
+                self.__node("TriggerSource").SetCurrentEntry("Software")
+            self.triggered = enabled
+        finally:
+            self.__node("AcquisitionStart").Execute()
+            self.__node("AcquisitionStart").WaitUntilDone()
+        return time.perf_counter() - start
+
+    def trigger(self):
+        """
+        Expose one frame in trigger mode, it is delivered through frames()
+        """
+        if not self.triggered:
+            raise Exception("카메라가 trigger 모드가 아닙니다")
+        self.__node("TriggerSoftware").Execute()
+
+    def set_frame_rate(self, fps):
+        """
+        Change AcquisitionFrameRate while the acquisition keeps running
+
+        :return: the frame rate actually set, None if the node is not available
+        """
+        try:
+            node = self.__node("AcquisitionFrameRate")
+            target_fps = max(node.Minimum(), min(node.Maximum(), fps))
+            node.SetValue(target_fps)
+            return target_fps
+        except ids_peak.Exception as e:
+            print("Exception", str(e))
+            return None
+
+    def setCameraParams(self, autoExposure=True):
         try:
-            node_map_remote_device = self.__device.RemoteDevice().NodeMaps()[0]
-            # Get the NodeMap of the RemoteDevice
             if autoExposure:
-                node_map_remote_device.FindNode("ExposureAuto").SetCurrentEntry("Continuous")
-            else:              
-                node_map_remote_device.FindNode("ExposureAuto").SetCurrentEntry("Off")
-                node_map_remote_device.FindNode("ExposureTime").SetValue(14996.9 )
-        
+                self.apply_settings({"exposure_auto": "Continuous"})
+            else:
+                self.apply_settings(DEFAULT_SETTINGS)
         except Exception as e:
             print(e)
 
-    def __del__(self):
+    def __set(self, node_name, value):
+        """
+        Set a node, numbers clamped to its range and increment
+
+        :return: the value the camera actually took
+        """
+        node = self.__node(node_name)
+        if isinstance(value, str):
+            node.SetCurrentEntry(value)
+            return node.CurrentEntry().SymbolicValue()
+        value = max(node.Minimum(), min(node.Maximum(), value))
+        if isinstance(node, ids_peak.IntegerNode):
+            increment = node.Increment() if node.HasConstantIncrement() else 1
+            value = node.Minimum() + (int(value) - node.Minimum()) // increment * increment
+        node.SetValue(value)
+        return node.Value()
+
+    def apply_settings(self, settings, wait=True):
+        """
+        Change camera settings (camera_settings.LIVE_SETTINGS / RELOCK_SETTINGS) at runtime
+
+        Live settings are set right away while frames keep coming. Settings that
+        change the payload size are handed to frames(), which applies all of them
+        in one acquisition stop with TLParamsLocked released, re-announces the
+        buffers for the new size and starts again.
+
+        :param wait: wait until frames() applied the relock settings, return a Future for them otherwise
+        :return: (values actually set, Future of the relock values or None)
+        """
+        live, relock = split_settings(settings)
+        applied = {}
+        for name, value in live.items():
+            applied[name] = self.__set(LIVE_SETTINGS[name], value)
+            if name == "fps":
+                self.fps_limit = applied[name]
+            else:
+                self.__live_settings[name] = applied[name]
+        if not relock:
+            return applied, None
+        for name in relock:
+            # 없는 node 는 acquisition 을 멈추기 전에 거절
+            try:
+                self.__node(RELOCK_SETTINGS[name])
+            except ids_peak.Exception:
+                raise ValueError(f"The camera has no {RELOCK_SETTINGS[name]} node")
+        future = Future()
+        self.__pending_relock = (relock, future)
+        if self.__acquisition_running:
+            # 버퍼를 기다리는 frames() 를 깨움
+            self.__datastream.KillWait()
+        if wait:
+            applied.update(future.result(RELOCK_TIMEOUT))
+            return applied, None
+        return applied, future
+
+    def __relock(self):
+        relock, future = self.__pending_relock
+        self.__pending_relock = None
+        try:
+            self.__stop_acquisition()
+            self.__revoke_buffers()
+            applied = {}
+            offsets = {"offset_x": "OffsetX", "offset_y": "OffsetY"}
+            previous = {name: self.__node(node_name).Value() for name, node_name in offsets.items()}
+            # offset 을 먼저 0 으로 내려야 더 큰 width / height 가 들어감
+            for node_name in offsets.values():
+                self.__node(node_name).SetValue(0)
+            scaling = [name for name in SCALING_SETTINGS if name in relock]
+            if scaling:
+                # binning / decimation 을 올리면 최대 width / height 가 줄어드므로 ROI 를 최소로 줄인 뒤 변경
+                for node_name in ("Width", "Height"):
+                    node = self.__node(node_name)
+                    node.SetValue(node.Minimum())
+                for name in scaling:
+                    applied[name] = self.__set(RELOCK_SETTINGS[name], relock[name])
+            for name in ("width", "height"):
+                if name in relock:
+                    applied[name] = self.__set(RELOCK_SETTINGS[name], relock[name])
+                elif scaling:
+                    # 크기를 주지 않았으면 binning 후의 전체 화면
+                    node = self.__node(RELOCK_SETTINGS[name])
+                    self.__set(RELOCK_SETTINGS[name], node.Maximum())
+            for name, node_name in offsets.items():
+                value = self.__set(node_name, relock.get(name, previous[name]))
+                if name in relock:
+                    applied[name] = value
+            self.__announce_buffers()
+            if not self.__start_acquisition():
+                raise Exception("Unable to restart acquisition!")
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        future.set_result(applied)
+
+    @property
+    def buffer_pool(self):
+        """
+        BufferPool the images of frames() are stored in, replaced on a relock
+        """
+        return self.__buffer_pool
+
+    @property
+    def sensor_size(self):
+        """
+        :return: (width, height) of the sensor without binning or decimation
+        """
+        try:
+            return self.__node("SensorWidth").Value(), self.__node("SensorHeight").Value()
+        except ids_peak.Exception:
+            return self.__node("WidthMax").Value(), self.__node("HeightMax").Value()
+
+    def settings(self):
+        """
+        :return: current value and range of every setting, None if the camera has no such node
+        """
+        current = {}
+        for name, node_name in {**LIVE_SETTINGS, **RELOCK_SETTINGS}.items():
+            try:
+                node = self.__node(node_name)
+                if isinstance(node, ids_peak.EnumerationNode):
+                    current[name] = {"value": node.CurrentEntry().SymbolicValue()}
+                else:
+                    current[name] = {"value": node.Value(), "min": node.Minimum(), "max": node.Maximum()}
+            except ids_peak.Exception:
+                current[name] = None
+        return current
+
+    def close(self):
+        """
+        Stop acquisition, revoke the announced buffers and release the device, once
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__initialized = False
         self.__destroy_all()
 
+    def __del__(self):
+        self.close()
+
     def __destroy_all(self):
         # Stop acquisition
         self.__stop_acquisition()
@@ -0,0 +1,81 @@
+# 카메라 설정 이름 -> GenICam node, camera3.IdsCamera 와 sim_camera.SimCamera 가 같이 사용
+
+# acquisition 중에 바로 바꿀 수 있는 설정, 이 순서대로 적용 (auto 를 먼저 꺼야 값이 들어감)
+LIVE_SETTINGS = {
+    "exposure_auto": "ExposureAuto",    # Off / Once / Continuous
+    "exposure": "ExposureTime",         # us
+    "gain_auto": "GainAuto",            # Off / Once / Continuous
+    "gain": "Gain",
+    "fps": "AcquisitionFrameRate",
+}
+# payload 크기가 바뀌는 설정, acquisition 을 멈추고 TLParamsLocked 를 푼 상태에서 한번에 적용
+RELOCK_SETTINGS = {
+    # binning / decimation 은 width / height 의 최대값을 바꾸므로 ROI 보다 먼저
+    "binning_x": "BinningHorizontal",
+    "binning_y": "BinningVertical",
+    "decimation_x": "DecimationHorizontal",
+    "decimation_y": "DecimationVertical",
+    "width": "Width",
+    "height": "Height",
+    "offset_x": "OffsetX",
+    "offset_y": "OffsetY",
+}
+SCALING_SETTINGS = ("binning_x", "binning_y", "decimation_x", "decimation_y")
+AUTO_ENTRIES = ("Off", "Once", "Continuous")
+# 이름으로 고르는 ROI: binning 과 (binning 후) 센서 크기에 대한 비율, 가운데 정렬
+ROI_PRESETS = {
+    "full": {"binning": 1, "width": 1.0, "height": 1.0},
+    "center": {"binning": 1, "width": 0.5, "height": 0.5},
+    "strip": {"binning": 1, "width": 1.0, "height": 0.25},
+    "binned": {"binning": 2, "width": 1.0, "height": 1.0},
+    "binned_strip": {"binning": 2, "width": 1.0, "height": 0.25},
+}
+EXPOSURE_TIME = 14996.9
+# 카메라를 열 때 적용하는 설정 (예전 setCameraParams(False) 와 같음)
+DEFAULT_SETTINGS = {"exposure_auto": "Off", "exposure": EXPOSURE_TIME}
+
+
+def split_settings(settings):
+    """
+    :return: (live settings, settings that need a relock), each in the order they must be applied
+    """
+    unknown = set(settings) - set(LIVE_SETTINGS) - set(RELOCK_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown camera settings: {', '.join(sorted(unknown))}")
+    for name in ("exposure_auto", "gain_auto"):
+        if settings.get(name) is not None and settings[name] not in AUTO_ENTRIES:
+            raise ValueError(f"{name} must be one of {', '.join(AUTO_ENTRIES)}")
+    live = {name: settings[name] for name in LIVE_SETTINGS if settings.get(name) is not None}
+    relock = {name: settings[name] for name in RELOCK_SETTINGS if settings.get(name) is not None}
+    return live, relock
+
+
+def roi_settings(preset, sensor_size, current=None):
+    """
+    :param sensor_size: (width, height) of the sensor without binning
+    :param current: camera.settings(), binning / decimation the camera has no node for are left out
+    :return: settings for the ROI_PRESETS entry, the camera rounds them to its increments
+    """
+    roi = ROI_PRESETS[preset]
+    binning = roi["binning"]
+    width, height = sensor_size[0] // binning, sensor_size[1] // binning
+    roi_width, roi_height = int(width * roi["width"]), int(height * roi["height"])
+    settings = {
+        "binning_x": binning,
+        "binning_y": binning,
+        "decimation_x": 1,
+        "decimation_y": 1,
+        "width": roi_width,
+        "height": roi_height,
+        "offset_x": (width - roi_width) // 2,
+        "offset_y": (height - roi_height) // 2,
+    }
+    if current is not None:
+        for name in SCALING_SETTINGS:
+            if current.get(name) is not None:
+                continue
+            if settings[name] != 1:
+                raise ValueError(f"The camera has no {RELOCK_SETTINGS[name]} node, preset {preset} needs it")
+            # 없는 node 를 1 로 두는 것은 아무것도 바꾸지 않음
+            del settings[name]
+    return settings
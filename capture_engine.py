@@ -0,0 +1,300 @@
+import os, time
+from threading import Thread, Lock, Event, Condition
+from camera_settings import split_settings
+from metrics import (CAPTURE_GRAB, CAPTURE_PUBLISH, FRAMES_CAPTURED, FRAMES_LOST, CAMERA_SETTINGS_SECONDS,
+                     CAMERA_FAILURES, CAMERA_RECOVERIES, CAMERA_RECOVERY_SECONDS)
+
+IDLE_FPS = 2  # 보는 사람이 없을 때 카메라 프레임레이트
+BACKOFF_MIN = float(os.environ.get("CAMERA_BACKOFF_MIN", 0.5))  # 첫 재연결 전 대기 (초), 실패할 때마다 두배
+BACKOFF_MAX = float(os.environ.get("CAMERA_BACKOFF_MAX", 30))   # 재연결 간격 상한 (초)
+FAILED_AFTER = 5  # 연속으로 이만큼 실패하면 recovering 대신 failed 로 보고 (재연결은 계속)
+SETTINGS_FRAME_TIMEOUT = 5  # 설정을 바꾼 뒤 다음 프레임을 기다리는 시간 (초)
+
+
+class CaptureEngine:
+    """
+    Supervised capture thread that keeps the camera running
+
+    The thread opens the camera, publishes its frames to the frame hub and, when
+    the stream fails or ends (buffer timeouts, USB disconnect, ...), closes the
+    device and opens it again with exponential backoff, so buffers are announced
+    anew and a replugged camera comes back without restarting the server.
+
+    Settings changed through apply_settings() are kept and applied again to a
+    reopened camera.
+
+    state: stopped / starting / healthy / recovering / failed
+    """
+    def __init__(self, create_camera, frame_hub, idle_fps=IDLE_FPS, backoff_min=BACKOFF_MIN,
+                 backoff_max=BACKOFF_MAX, clock=time.monotonic, name="0"):
+        self.name = name
+        self.create_camera = create_camera
+        self.frame_hub = frame_hub
+        self.idle_fps = idle_fps
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        # ready_at / first_frame_at 을 재는 시계, app 에서는 프로세스 시작부터의 시간
+        self.clock = clock
+        self.camera = None
+        self.state = "stopped"
+        self.error = None
+        self.init_s = None              # 마지막 카메라 초기화에 걸린 시간
+        self.ready_at = None            # 첫 카메라 초기화 완료 시각 (clock)
+        self.first_frame_at = None      # 첫 프레임 시각 (clock)
+        self.frames = 0
+        self.opens = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.recoveries = 0
+        self.last_recovery_s = None
+        self.total_recovery_s = 0.0
+        self.retry_at = None
+        self.settings = {}              # apply_settings() 로 바꾼 값, 카메라를 다시 열면 다시 적용
+        self.last_apply = None
+        self.__down_since = None
+        self.__last_frame = None
+        self.__interval = None          # 최근 프레임 간격 (초)
+        self.__idle = None
+        self.__frame = Condition()
+        self.__thread = None
+        self.__lock = Lock()
+        self.__settings_lock = Lock()
+        self.__stop = Event()
+
+    @property
+    def healthy(self):
+        return self.state == "healthy"
+
+    def start(self):
+        """
+        Start the capture thread, once
+        """
+        if self.__thread is not None:
+            return
+        with self.__lock:
+            if self.__thread is None:
+                self.__stop.clear()
+                if self.camera is None:
+                    self.state = "starting"
+                self.__thread = Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+
+    def stop(self, timeout=None):
+        self.__stop.set()
+        thread = self.__thread
+        if thread is not None:
+            thread.join(timeout)
+        self.__thread = None
+
+    def open(self):
+        """
+        Open the camera in the calling thread
+
+        :return: True if the camera is open
+        """
+        if self.camera is not None:
+            return True
+        start = time.perf_counter()
+        try:
+            camera = self.create_camera()
+        except Exception as e:
+            print(f"카메라 {self.name} 초기화 실패: {str(e)}")
+            self.__fail(e)
+            return False
+        self.camera = camera
+        self.opens += 1
+        self.init_s = round(time.perf_counter() - start, 3)
+        if self.ready_at is None:
+            self.ready_at = round(self.clock(), 3)
+        return True
+
+    def __run(self):
+        while not self.__stop.is_set():
+            if self.consecutive_failures:
+                delay = min(self.backoff_min * 2 ** (self.consecutive_failures - 1), self.backoff_max)
+                self.retry_at = time.time() + delay
+                if self.__stop.wait(delay):
+                    break
+                self.retry_at = None
+            if not self.open():
+                continue
+            try:
+                if self.settings:
+                    # relock 이 필요한 설정은 frames() 가 첫 프레임 전에 적용
+                    self.camera.apply_settings(self.settings, wait=False)
+                self.__stream(self.camera)
+                if self.__stop.is_set():
+                    break
+                self.__fail(Exception("카메라 스트림 종료"))
+            except Exception as e:
+                self.__fail(e)
+        self.__close(self.camera)
+        self.camera = None
+        self.state = "stopped"
+
+    def __stream(self, camera):
+        # 새로 연 카메라는 fps_limit 로 시작
+        self.__idle = False
+        grab_start = time.perf_counter()
+        for img, timestamp in camera.frames():
+            published = time.perf_counter()
+            CAPTURE_GRAB.observe(published - grab_start)
+            FRAMES_CAPTURED.inc()
+            # 인코딩은 frame 을 요청하는 client 가 있을 때만 수행, 인코딩 중인 buffer 는 pool 에서 pin
+            self.frame_hub.publish(img, timestamp, getattr(camera, "buffer_pool", None))
+            CAPTURE_PUBLISH.observe(time.perf_counter() - published)
+            with self.__frame:
+                now = time.monotonic()
+                if self.__last_frame is not None:
+                    interval = now - self.__last_frame
+                    self.__interval = interval if self.__interval is None else 0.8 * self.__interval + 0.2 * interval
+                self.frames += 1
+                self.__last_frame = now
+                self.__frame.notify_all()
+            if self.state != "healthy":
+                self.__recovered()
+
+            idle = self.frame_hub.is_idle()
+            if idle != self.__idle:
+                self.__idle = idle
+                camera.set_frame_rate(self.idle_fps if idle else camera.fps_limit)
+                print(f"카메라 {self.name} " + ("idle 모드" if idle else "스트리밍 모드"))
+            if self.__stop.is_set():
+                return
+            grab_start = time.perf_counter()
+
+    def __recovered(self):
+        if self.first_frame_at is None:
+            self.first_frame_at = round(self.clock(), 3)
+        if self.__down_since is not None:
+            downtime = time.monotonic() - self.__down_since
+            self.__down_since = None
+            self.recoveries += 1
+            self.last_recovery_s = round(downtime, 3)
+            self.total_recovery_s += downtime
+            CAMERA_RECOVERIES.inc()
+            CAMERA_RECOVERY_SECONDS.observe(downtime)
+            print(f"카메라 {self.name} 복구 완료 ({downtime:.1f}s)")
+        self.consecutive_failures = 0
+        self.error = None
+        self.state = "healthy"
+
+    def __fail(self, error):
+        camera, self.camera = self.camera, None
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error = str(error)
+        CAMERA_FAILURES.inc()
+        if self.first_frame_at is not None and self.__down_since is None:
+            # 한번이라도 프레임이 나온 뒤의 장애만 복구 시간으로 셈
+            self.__down_since = time.monotonic()
+        if self.first_frame_at is None and self.consecutive_failures < FAILED_AFTER:
+            self.state = "starting"
+        else:
+            self.state = "failed" if self.consecutive_failures >= FAILED_AFTER else "recovering"
+        if camera is not None:
+            print(f"카메라 {self.name} 오류 - 재연결 시도: {self.error}")
+            self.__close(camera)
+
+    @staticmethod
+    def __close(camera):
+        # 장치와 announce 된 buffer 를 놓아야 다시 열 수 있음
+        if camera is None or not hasattr(camera, "close"):
+            return
+        try:
+            camera.close()
+        except Exception as e:
+            print(f"카메라 종료 중 오류: {str(e)}")
+
+    def apply_settings(self, settings):
+        """
+        Change camera settings while the stream keeps running
+
+        :return: values actually set, time it took and the frames lost around the change
+        """
+        live, relock = split_settings(settings)
+        camera = self.camera
+        if camera is None:
+            raise Exception("카메라가 연결되지 않았습니다")
+        with self.__settings_lock:
+            with self.__frame:
+                frames, last, interval = self.frames, self.__last_frame, self.__interval
+            start = time.perf_counter()
+            applied, _ = camera.apply_settings({**live, **relock})
+            apply_s = time.perf_counter() - start
+            if "fps" in applied or relock:
+                # idle 이면 다음 프레임에서 idle 프레임레이트로 다시 내림
+                self.__idle = None
+            self.settings.update(applied)
+            # 설정 전 마지막 프레임부터 설정 후 첫 프레임까지 받았어야 할 프레임 수와 비교
+            with self.__frame:
+                done = self.frames
+                arrived = self.__frame.wait_for(lambda: self.frames > done, SETTINGS_FRAME_TIMEOUT)
+                received, first = self.frames - frames, self.__last_frame
+        CAMERA_SETTINGS_SECONDS.labels("relock" if relock else "live").observe(apply_s)
+        gap = first - last if arrived and last is not None else None
+        lost = None
+        if gap is not None and interval:
+            lost = max(0, round(gap / interval) - received)
+            FRAMES_LOST.inc(lost)
+        self.last_apply = {
+            "applied": applied,
+            "relock": bool(relock),
+            "apply_ms": round(apply_s * 1000, 1),
+            "frame_gap_ms": round(gap * 1000, 1) if gap is not None else None,
+            "frame_interval_ms": round(interval * 1000, 1) if interval else None,
+            "frames_lost": lost,
+        }
+        return self.last_apply
+
+    def camera_settings(self):
+        """
+        :return: current camera settings with their ranges, what was requested and the last apply report
+        """
+        camera = self.camera
+        return {
+            "current": camera.settings() if camera is not None else None,
+            "requested": self.settings,
+            "last_apply": self.last_apply,
+        }
+
+    def fps(self):
+        """
+        :return: current capture frame rate, None before two frames arrived
+        """
+        interval = self.__interval
+        return round(1 / interval, 1) if interval else None
+
+    def frame_age(self):
+        """
+        :return: seconds since the last frame, None before the first frame
+        """
+        if self.__last_frame is None:
+            return None
+        return time.monotonic() - self.__last_frame
+
+    def health(self):
+        age = self.frame_age()
+        down_since = self.__down_since
+        pool = getattr(self.camera, "buffer_pool", None)
+        return {
+            "state": self.state,
+            "error": self.error,
+            "frames": self.frames,
+            "fps": self.fps(),
+            "frame_age_s": round(age, 3) if age is not None else None,
+            # 인코딩 중이라 pin 된 buffer, 모두 pin 되어 새로 할당한 횟수
+            "buffers_pinned": pool.pinned() if pool is not None else None,
+            "buffer_overflows": pool.overflows if pool is not None else None,
+            "opens": self.opens,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_at": self.retry_at,
+            "recoveries": self.recoveries,
+            "down_s": round(time.monotonic() - down_since, 3) if down_since is not None else None,
+            "last_recovery_s": self.last_recovery_s,
+            "total_recovery_s": round(self.total_recovery_s, 3),
+            "init_s": self.init_s,
+            "ready_at": self.ready_at,
+            "first_frame_at": self.first_frame_at,
+        }
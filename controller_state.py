@@ -0,0 +1,158 @@
+import asyncio, json, os, time
+from serial_link import COMMAND_TIMEOUT, MOTION_DONE
+
+POLL_INTERVAL = float(os.environ.get("STATE_POLL_INTERVAL", 0.2))  # UART 에 status 를 묻는 간격 (초)
+SUBSCRIBER_QUEUE = 16
+# 움직이지 않는 상태로 보는 "status" 값, 쉼표로 여러 개 (MOTION_DONE 과 같이 firmware 가 보내는 값과 맞춰야 함)
+# 이동이 끝났다는 MOTION_DONE 값은 항상 포함, 나머지 값이 오면 moving 으로 봄
+STOPPED = {status.strip() for status in os.environ.get("STOPPED_STATUS", "idle,halted,calibrated").split(",")
+           if status.strip()} | MOTION_DONE
+
+
+class ControllerState:
+    """
+    Last known state of the motion controller, kept up to date for all readers
+
+    A single poller asks for "status" every interval seconds no matter how many
+    clients read the state, and every response that passes the serial link
+    (go_x, halt, calibrate, ...) updates it as well. Changes are pushed to
+    subscribers.
+    """
+    def __init__(self, serial_link, interval=POLL_INTERVAL):
+        self.serial_link = serial_link
+        self.interval = interval
+        self.stopped = STOPPED | getattr(serial_link, "motion_done", set())
+        self.x = None
+        self.x_max = None
+        self.target = None
+        self.status = None
+        self.moving = None
+        self.updated_at = None          # time.monotonic() of the last response
+        self.timestamp = None           # time.time() of the last response
+        self.last_error = None
+        self.polls = 0
+        self.reads = 0
+        self.pushes = 0
+        self.__task = None
+        self.__subscribers = []
+        serial_link.add_listener(self.update)
+
+    def update(self, command, response):
+        if not isinstance(response, dict) or "error" in response:
+            return
+        before = self.__values()
+        status = response.get("status")
+        if "x" in response:
+            self.x = response["x"]
+        if "x_max" in response:
+            self.x_max = response["x_max"]
+        if "target" in response:
+            self.target = response["target"]
+        if status is not None:
+            self.status = status
+            self.moving = status not in self.stopped
+            if not self.moving:
+                self.target = None
+        self.updated_at = time.monotonic()
+        self.timestamp = time.time()
+        if self.__values() != before:
+            self.__push()
+
+    def __values(self):
+        return self.x, self.x_max, self.target, self.status, self.moving
+
+    def snapshot(self):
+        """
+        :return: the cached state with its age, None before the first response
+        """
+        if self.updated_at is None:
+            return None
+        return {
+            "status": self.status,
+            "moving": self.moving,
+            "x": self.x,
+            "x_max": self.x_max,
+            "target": self.target,
+            "timestamp": self.timestamp,
+            "age_ms": round((time.monotonic() - self.updated_at) * 1000, 1),
+        }
+
+    def read(self):
+        """
+        snapshot() for a client request, counted in stats
+        """
+        self.reads += 1
+        return self.snapshot()
+
+    def start(self):
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.get_running_loop().create_task(self.__poll())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+
+    async def __poll(self):
+        while True:
+            start = time.monotonic()
+            try:
+                await self.serial_link.request({"cmd": "status"}, timeout=COMMAND_TIMEOUT)
+                self.polls += 1
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.last_error is None:
+                    print(f"Controller status poll failed: {e}")
+                self.last_error = str(e)
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - start)))
+
+    def subscribe(self):
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE)
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            queue.put_nowait(snapshot)
+        self.__subscribers.append(queue)
+        self.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self.__subscribers:
+            self.__subscribers.remove(queue)
+
+    def __push(self):
+        snapshot = self.snapshot()
+        for queue in self.__subscribers:
+            if queue.full():
+                # 느린 client 는 오래된 상태를 버리고 최신 상태만 받음
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+            self.pushes += 1
+
+    async def events(self):
+        """
+        Server-sent events with the state after every change
+        """
+        queue = self.subscribe()
+        try:
+            while True:
+                snapshot = await queue.get()
+                yield f"data: {json.dumps(snapshot)}\n\n".encode()
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        return {
+            "poll_interval": self.interval,
+            "polling": self.__task is not None and not self.__task.done(),
+            "polls": self.polls,
+            "reads": self.reads,
+            "subscribers": len(self.__subscribers),
+            "pushes": self.pushes,
+            "last_error": self.last_error,
+        }
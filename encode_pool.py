@@ -0,0 +1,142 @@
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from threading import Thread, Condition
+from jpeg_encoders import ENCODE_WORKERS
+from metrics import ENCODE_QUEUE_WAIT
+
+RATE_WINDOW = 5  # encode 처리율을 계산하는 구간 (초)
+
+
+class EncodeQueue(Executor):
+    """
+    The jobs of one camera in a FairEncodePool, usable wherever an Executor is expected
+    """
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.jobs = deque()
+        self.closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.cpu_time = 0.0
+        self.wait_time = 0.0
+        self.__done = deque()
+        self.__wait = ENCODE_QUEUE_WAIT.labels(name)
+
+    def submit(self, fn, /, *args, **kwargs):
+        if self.closed:
+            raise RuntimeError(f"Encode queue {self.name} is shut down")
+        return self.pool.submit_to(self, fn, args, kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.closed = True
+        if cancel_futures:
+            self.pool.cancel(self)
+
+    def finished(self, queued_at, started, cpu_time):
+        now = time.monotonic()
+        self.__wait.observe(started - queued_at)
+        self.completed += 1
+        self.cpu_time += cpu_time
+        self.wait_time += started - queued_at
+        self.__done.append(now)
+        while self.__done and self.__done[0] < now - RATE_WINDOW:
+            self.__done.popleft()
+
+    def stats(self):
+        now = time.monotonic()
+        done = [t for t in list(self.__done) if t >= now - RATE_WINDOW]
+        return {
+            "queued": len(self.jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "jobs_per_s": round(len(done) / RATE_WINDOW, 1),
+            "cpu_ms_total": round(self.cpu_time * 1000, 1),
+            "cpu_share": round(self.cpu_time / self.pool.cpu_time, 3) if self.pool.cpu_time else None,
+            "wait_ms_per_job": round(self.wait_time * 1000 / self.completed, 2) if self.completed else None,
+        }
+
+
+class FairEncodePool:
+    """
+    Encode workers shared by all cameras, serving the cameras in turn
+
+    Each camera submits into its own EncodeQueue. A free worker takes one job
+    from the next camera that has any, round robin, so a camera with many
+    clients and a long queue gets the same share of the workers as a camera
+    with a single client instead of a share proportional to its queue.
+    """
+    def __init__(self, workers=ENCODE_WORKERS):
+        self.workers = workers
+        self.cpu_time = 0.0
+        self.__queues = {}
+        self.__turns = deque()      # 처리할 job 이 있는 queue, 한번씩 돌아가며
+        self.__condition = Condition()
+        self.__closed = False
+        self.__threads = [Thread(target=self.__work, name=f"encode-{i}", daemon=True) for i in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def queue(self, name):
+        with self.__condition:
+            if name not in self.__queues:
+                self.__queues[name] = EncodeQueue(self, name)
+            return self.__queues[name]
+
+    def submit_to(self, queue, fn, args, kwargs):
+        future = Future()
+        with self.__condition:
+            if not queue.jobs:
+                self.__turns.append(queue)
+            queue.jobs.append((future, fn, args, kwargs, time.monotonic()))
+            queue.submitted += 1
+            self.__condition.notify()
+        return future
+
+    def cancel(self, queue):
+        with self.__condition:
+            jobs, queue.jobs = queue.jobs, deque()
+            if queue in self.__turns:
+                self.__turns.remove(queue)
+        for job in jobs:
+            job[0].cancel()
+
+    def __work(self):
+        while True:
+            with self.__condition:
+                while not self.__turns and not self.__closed:
+                    self.__condition.wait()
+                if not self.__turns:
+                    return
+                queue = self.__turns.popleft()
+                future, fn, args, kwargs, queued_at = queue.jobs.popleft()
+                if queue.jobs:
+                    # 다른 camera 뒤로 다시 줄을 섬
+                    self.__turns.append(queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.monotonic()
+            cpu = time.thread_time()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            cpu_time = time.thread_time() - cpu
+            with self.__condition:
+                self.cpu_time += cpu_time
+                queue.finished(queued_at, started, cpu_time)
+
+    def shutdown(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        for queue in list(self.__queues.values()):
+            queue.shutdown(cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "cpu_ms_total": round(self.cpu_time * 1000, 1),
+            "queues": {name: queue.stats() for name, queue in list(self.__queues.items())},
+        }
@@ -0,0 +1,125 @@
+import os, json, time, tty
+from threading import Thread, Lock
+
+SIM_SPEED = float(os.environ.get("SIM_SPEED", 200))   # carriage 이동 속도 (단위/초)
+
+class FakeController:
+    """
+    Pretend motion controller on a pseudo terminal
+
+    Speaks the same line based JSON protocol as the board on /dev/ttyAMA0, so the
+    server can be pointed at self.port instead of the real UART. go_x answers
+    "moving" at once and arrived_status after distance / speed seconds, halt
+    stops the carriage where it is.
+    """
+    def __init__(self, x_max=1000, response_delay=0.002, speed=SIM_SPEED, arrived_status="arrived"):
+        self.x_max = x_max
+        self.arrived_status = arrived_status
+        self.response_delay = response_delay
+        self.speed = speed
+        self.commands = []
+        self.__x = 0
+        self.__target = 0
+        self.__move_start = 0
+        self.__move_id = 0
+        self.__write_lock = Lock()
+        self.__master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.__slave = slave
+        self.__running = True
+        self.__thread = Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+
+    def __reply(self, data):
+        time.sleep(self.response_delay)
+        with self.__write_lock:
+            if not self.__running:
+                return
+            os.write(self.__master, json.dumps(data).encode('utf-8') + b'\n')
+
+    @property
+    def moving(self):
+        return self.__x != self.__target
+
+    @property
+    def x(self):
+        if not self.moving:
+            return self.__x
+        travelled = (time.monotonic() - self.__move_start) * self.speed
+        distance = self.__target - self.__x
+        if travelled >= abs(distance):
+            return self.__target
+        return round(self.__x + travelled * (1 if distance > 0 else -1), 3)
+
+    def __stop(self):
+        self.__x = self.__target = self.x
+        self.__move_id += 1
+
+    def __move(self, move_id, duration):
+        time.sleep(duration)
+        if move_id == self.__move_id:
+            self.__x = self.__target
+            self.__reply({"status": self.arrived_status, "x": self.__x})
+
+    def handle(self, command):
+        cmd = command.get("cmd")
+        if cmd == "status":
+            self.__reply({"status": "moving" if self.moving else "idle", "x": self.x, "x_max": self.x_max})
+        elif cmd == "get_x":
+            self.__reply({"x": self.x})
+        elif cmd == "halt":
+            self.__stop()
+            self.__reply({"status": "halted", "x": self.x})
+        elif cmd == "go_x":
+            self.__stop()
+            target = min(max(float(command.get("x", 0)), 0), self.x_max)
+            self.__reply({"status": "moving", "target": command.get("x")})
+            self.__target = target
+            self.__move_start = time.monotonic()
+            duration = abs(target - self.__x) / self.speed if self.speed else 0
+            Thread(target=self.__move, args=(self.__move_id, duration), daemon=True).start()
+        elif cmd == "calibrate":
+            if command.get("set_type") == "manual":
+                self.x_max = float(command.get("x_max", self.x_max))
+            self.__reply({"status": "calibrated", "x_max": self.x_max})
+        else:
+            self.__reply({"error": f"unknown command {cmd}"})
+
+    def __serve(self):
+        pending = b''
+        while self.__running:
+            try:
+                chunk = os.read(self.__master, 1024)
+            except OSError:
+                break
+            pending += chunk
+            while b'\n' in pending:
+                line, pending = pending.split(b'\n', 1)
+                try:
+                    command = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.commands.append(command)
+                self.handle(command)
+
+    def close(self):
+        """
+        Hang up the pty like an unplugged board, an open SerialLink sees a read error
+        """
+        with self.__write_lock:
+            if not self.__running:
+                return
+            self.__running = False
+        # 읽기 중인 thread 가 master 를 잡고 있으면 close 해도 hang up 되지 않으므로 먼저 깨움
+        os.write(self.__slave, b'\n')
+        self.__thread.join(1)
+        os.close(self.__master)
+        os.close(self.__slave)
+
+
+if __name__ == "__main__":
+    controller = FakeController()
+    print(f"fake controller on {controller.port} (SERIAL_PORT={controller.port} uvicorn app:app)")
+    while True:
+        time.sleep(1)
@@ -0,0 +1,401 @@
+import asyncio, time, itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future
+import cv2
+from threading import Lock
+from jpeg_encoders import ENCODE_WORKERS
+from image_formats import bgr_to_yuv420
+from metrics import FRAME_LOCK_WAIT, STREAM_WAIT_FRAME, STREAM_ENCODE, FRAMES_DROPPED, FRAMES_SKIPPED_BY_RATE
+
+IDLE_AFTER = 10  # 이 시간(초) 동안 요청이 없으면 idle 상태
+
+
+class Frame:
+    """
+    One captured BGR image, never modified after publish so clients can share it
+
+    Derived data (JPEG, YUV420, ...) is only computed when the first consumer
+    asks for it and is then cached for every other consumer of the same frame.
+    Consumers of the same key wait for that one computation, different keys
+    (e.g. two stream profiles) are computed in parallel.
+
+    image may be a slot of the camera's BufferPool. The slot is pinned from the
+    moment an encode is queued or a conversion starts until it finished, so the
+    camera cannot overwrite pixels that are still being encoded.
+    """
+    __slots__ = ("seq", "image", "timestamp", "position", "__encode", "__executor", "__pool", "__pending", "__cache",
+                 "__computing", "__lock")
+
+    def __init__(self, seq, image, timestamp, encode, position=None, executor=None, pool=None):
+        self.seq = seq
+        self.image = image
+        self.timestamp = timestamp
+        self.position = position
+        self.__encode = encode
+        self.__executor = executor
+        self.__pool = pool
+        self.__pending = {}
+        self.__cache = {}
+        self.__computing = {}   # key -> Future, 계산 중인 key 를 기다리는 consumer 용
+        self.__lock = Lock()
+
+    def pin(self):
+        """
+        Keep the camera from reusing the buffer of this frame until release()
+        """
+        if self.__pool is not None:
+            self.__pool.pin(self.image)
+
+    def release(self, *_):
+        # future 의 done callback 으로도 사용
+        if self.__pool is not None:
+            self.__pool.release(self.image)
+
+    def derive(self, key, convert):
+        """
+        :return: convert(self.image), computed once per frame and key
+        """
+        value = self.__cache.get(key)
+        if value is not None:
+            return value
+        start = time.perf_counter()
+        # lock 은 key 의 Future 를 찾거나 만드는 동안만 잡음
+        with self.__lock:
+            value = self.__cache.get(key)
+            if value is not None:
+                return value
+            computing = self.__computing.get(key)
+            if computing is None:
+                computing = self.__computing[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            # 같은 key 를 다른 thread 가 계산 중
+            value = computing.result()
+            FRAME_LOCK_WAIT.observe(time.perf_counter() - start)
+            return value
+        self.pin()
+        try:
+            value = self.__cache[key] = convert(self.image)
+        except BaseException as e:
+            computing.set_exception(e)
+            raise
+        else:
+            computing.set_result(value)
+        finally:
+            self.release()
+            with self.__lock:
+                del self.__computing[key]
+        return value
+
+    def detached(self):
+        """
+        Copy of this frame that keeps its image after the camera reuses the buffer
+        """
+        self.pin()
+        try:
+            image = self.image.copy()
+        finally:
+            self.release()
+        return Frame(self.seq, image, self.timestamp, self.__encode, self.position, self.__executor)
+
+    def resized(self, size):
+        """
+        :return: the image scaled to fit into size (width, height), None keeps the full resolution
+
+        The aspect ratio is kept and small images are not enlarged, so a camera ROI
+        smaller than the profile is encoded at its own size.
+        """
+        if size is None:
+            return self.image
+        height, width = self.image.shape[:2]
+        scale = min(size[0] / width, size[1] / height)
+        if scale >= 1:
+            return self.image
+        # I420 (H.264) 은 짝수 크기만 가능
+        size = (max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2))
+
+        def scale(image):
+            # 이미 축소된 이미지 중 가장 작으면서 size 보다 큰 이미지에서 축소해 profile 간 작업을 공유
+            for key, value in list(self.__cache.items()):
+                if key[0] == "resized" and key[1][0] >= size[0] and key[1][1] >= size[1] \
+                        and value.shape[1] < image.shape[1]:
+                    image = value
+            return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return self.derive(("resized", size), scale)
+
+    def jpeg(self, profile):
+        return self.derive(("jpeg", profile.name), lambda image: profile.render(self, self.__encode))
+
+    def yuv420(self, size=None):
+        """
+        :return: I420 image, scaled to size (width, height) first if given
+        """
+        return self.derive(("yuv420", size), lambda image: bgr_to_yuv420(self.resized(size)))
+
+    def prefetch(self, profile):
+        """
+        Start jpeg() on the encode pool before anyone asks for it
+
+        :return: concurrent.futures.Future of the JPEG bytes
+        """
+        future = self.__pending.get(profile.name)
+        if future is None:
+            # 큐에서 기다리는 동안에도 buffer 가 재사용되지 않도록 끝날 때까지 pin
+            self.pin()
+            try:
+                future = self.__pending[profile.name] = self.__executor.submit(self.jpeg, profile)
+            except Exception:
+                self.release()
+                raise
+            future.add_done_callback(self.release)
+        return future
+
+    async def encoded(self, profile):
+        """
+        jpeg() without blocking the event loop
+        """
+        data = self.__cache.get(("jpeg", profile.name))
+        if data is not None:
+            return data
+        # 같은 profile 을 기다리는 다른 consumer 의 인코딩은 취소하지 않음
+        return await asyncio.shield(asyncio.wrap_future(self.prefetch(profile)))
+
+
+class FrameClient:
+    """
+    A single /video_feed viewer of one stream profile
+
+    The client always jumps to the newest frame, so a slow viewer drops frames
+    instead of building up a queue. Frames passed over while waiting for the
+    max_fps interval are counted in skipped_by_rate, dropped only counts the
+    ones lost because the client or the encoder could not keep up.
+    """
+    __ids = itertools.count(1)
+
+    def __init__(self, hub, profile, max_fps=None):
+        self.id = next(self.__ids)
+        self.hub = hub
+        self.profile = profile
+        self.max_fps = max_fps or profile.fps
+        self.last_seq = 0
+        self.last_timestamp = None
+        self.sent = 0
+        self.dropped = 0
+        self.skipped_by_rate = 0
+        self.bytes_sent = 0
+        self.waiting = False
+        self.connected_at = time.time()
+
+    async def frames(self):
+        interval = 1 / self.max_fps if self.max_fps else 0
+        next_time = 0
+        while True:
+            # 쉬지 않았다면 받았을 프레임, 이후 쉬는 동안 지나간 프레임은 frame rate 제한으로 건너뜀
+            ready_seq = max(self.hub.seq, self.last_seq + 1)
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            start = time.perf_counter()
+            self.waiting = True
+            try:
+                frame = await self.hub.wait_next(self.last_seq)
+            finally:
+                self.waiting = False
+            next_time = time.monotonic() + interval
+            encode_start = time.perf_counter()
+            STREAM_WAIT_FRAME.observe(encode_start - start)
+            data = await frame.encoded(self.profile)
+            STREAM_ENCODE.observe(time.perf_counter() - encode_start)
+            if self.last_seq and frame.seq > self.last_seq + 1:
+                skipped = max(0, frame.seq - ready_seq)
+                dropped = frame.seq - self.last_seq - 1 - skipped
+                self.skipped_by_rate += skipped
+                FRAMES_SKIPPED_BY_RATE.inc(skipped)
+                if dropped:
+                    self.dropped += dropped
+                    FRAMES_DROPPED.inc(dropped)
+            self.last_seq = frame.seq
+            self.last_timestamp = frame.timestamp
+            self.sent += 1
+            self.bytes_sent += len(data)
+            yield frame
+
+    def stats(self):
+        latest = self.hub.latest()
+        connected = time.time() - self.connected_at
+        return {
+            "id": self.id,
+            "profile": self.profile.name,
+            "max_fps": self.max_fps,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "skipped_by_rate": self.skipped_by_rate,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_s": round(self.bytes_sent / connected) if connected else None,
+            "lag_frames": latest.seq - self.last_seq if latest else 0,
+            "lag_ms": round((latest.timestamp - self.last_timestamp) * 1000, 1) if latest and self.last_timestamp else None,
+            "connected_s": round(connected, 1),
+        }
+
+
+class FrameHub:
+    """
+    Publish each captured frame once and wake every waiting client
+
+    publish() is called from the capture thread, clients wait on the asyncio
+    event loop of the server. encode(image, quality, preset) turns a published
+    image into JPEG bytes.
+
+    Every profile that has subscribers is encoded on a pool of workers as soon
+    as a frame is published, so several frames are in flight at once while each
+    client still receives them in seq order. Frames keep their camera buffer
+    pinned until their encodes finished, however long the queue is. When all
+    workers are busy new frames are not prefetched, so the backlog stays
+    bounded and clients move on to the newest frame. executor is the pool to
+    encode on (e.g. the camera's queue of a shared encode_pool.FairEncodePool),
+    the hub creates its own with workers threads if none is given.
+    """
+    def __init__(self, encode, idle_after=IDLE_AFTER, workers=ENCODE_WORKERS, executor=None):
+        self.encode = encode
+        self.idle_after = idle_after
+        self.workers = workers
+        # 프레임을 찾는 요청이 오면 호출, 카메라를 늦게 켤 때 사용
+        self.on_demand = None
+        self.__executor = executor or ThreadPoolExecutor(workers, thread_name_prefix="encode")
+        self.__in_flight = 0
+        self.encodes_skipped = 0
+        # seq 는 재시작하면 1부터 다시 시작하므로 ETag 구분용
+        self.epoch = int(time.time())
+        self.__last_demand = time.monotonic()
+        self.__lock = Lock()
+        self.__latest = None
+        self.__seq = 0
+        self.__second = (None, 0)   # (초, 그 초에 처음 publish 된 seq)
+        self.__loop = None
+        self.__new_frame = None
+        self.__clients = {}
+
+    def publish(self, image, timestamp=None, pool=None):
+        """
+        :param pool: BufferPool image is a slot of, the newest frame stays pinned there
+        """
+        frame = Frame(self.__seq + 1, image, timestamp or time.time(), self.encode, executor=self.__executor, pool=pool)
+        # latest() 로 받은 frame 이 인코딩을 시작하기 전에 덮어써지지 않도록 최신 프레임은 항상 pin
+        frame.pin()
+        with self.__lock:
+            self.__seq += 1
+            previous, self.__latest = self.__latest, frame
+            if self.__second[0] != int(frame.timestamp):
+                self.__second = (int(frame.timestamp), frame.seq)
+            loop = self.__loop
+        if previous is not None:
+            previous.release()
+        self.__prefetch(frame)
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.__wake)
+        return frame
+
+    def __prefetch(self, frame):
+        # frame rate 제한으로 쉬고 있는 client 의 profile 은 미리 인코딩하지 않음
+        for profile in {client.profile for client in list(self.__clients.values()) if client.waiting}:
+            with self.__lock:
+                # 인코딩이 밀리면 새 프레임을 쌓지 않고 건너뜀, client 는 최신 프레임으로 이동
+                if self.__in_flight >= self.workers:
+                    self.encodes_skipped += 1
+                    continue
+                self.__in_flight += 1
+            frame.prefetch(profile).add_done_callback(self.__encode_done)
+
+    def __encode_done(self, future):
+        with self.__lock:
+            self.__in_flight -= 1
+
+    def __wake(self):
+        # 기다리던 client 모두 깨우고 다음 프레임용 이벤트로 교체
+        event, self.__new_frame = self.__new_frame, asyncio.Event()
+        event.set()
+
+    def __bind_loop(self):
+        if self.__loop is None:
+            self.__loop = asyncio.get_running_loop()
+            self.__new_frame = asyncio.Event()
+
+    def latest(self):
+        self.mark_demand()
+        return self.__latest
+
+    def first_in_second(self, frame):
+        """
+        :return: True if frame was the first frame published within its whole second (Last-Modified resolution)
+        """
+        second, seq = self.__second
+        return second == int(frame.timestamp) and seq == frame.seq
+
+    def mark_demand(self):
+        """
+        Keep the camera at full frame rate, for consumers that are not FrameClients
+        """
+        self.__last_demand = time.monotonic()
+        if self.on_demand is not None:
+            self.on_demand()
+
+    def is_idle(self):
+        """
+        :return: True if nobody subscribed or asked for a frame during idle_after seconds
+        """
+        if self.__clients:
+            self.__last_demand = time.monotonic()
+            return False
+        return time.monotonic() - self.__last_demand > self.idle_after
+
+    async def wait_next(self, after_seq=0):
+        """
+        :return: the newest frame with seq greater than after_seq
+        """
+        self.__bind_loop()
+        while True:
+            event = self.__new_frame
+            frame = self.__latest
+            if frame is not None and frame.seq > after_seq:
+                return frame
+            await event.wait()
+
+    def subscribe(self, profile, max_fps=None):
+        self.mark_demand()
+        client = FrameClient(self, profile, max_fps)
+        self.__clients[client.id] = client
+        return client
+
+    def unsubscribe(self, client):
+        self.__clients.pop(client.id, None)
+        self.__last_demand = time.monotonic()
+
+    @property
+    def seq(self):
+        """
+        seq of the newest published frame, 0 before the first
+        """
+        return self.__seq
+
+    @property
+    def subscriber_count(self):
+        return len(self.__clients)
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        latest = self.__latest
+        return {
+            "seq": latest.seq if latest else 0,
+            "subscribers": len(self.__clients),
+            "idle": self.is_idle(),
+            "encoder": getattr(self.encode, "name", None),
+            "encode_workers": self.workers,
+            "encodes_in_flight": self.__in_flight,
+            "encodes_skipped": self.encodes_skipped,
+            "profiles": dict(Counter(client.profile.name for client in list(self.__clients.values()))),
+            "clients": [client.stats() for client in list(self.__clients.values())],
+        }
@@ -0,0 +1,144 @@
+import asyncio, json, os, time, zipfile
+from collections import deque
+from scan import ChunkWriter
+
+# 0 (기본) 이면 기록하지 않음, 켜면 RING_PROFILE 로 매 frame 을 계속 encode 하므로 CPU 를 씀
+RING_BUDGET = int(float(os.environ.get("RING_BUDGET_MB", 0)) * 1024 * 1024)
+RING_PROFILE = os.environ.get("RING_PROFILE", "preview")   # 저장할 stream profile (크기/화질)
+
+
+class RingEntry:
+    __slots__ = ("seq", "timestamp", "position", "moving", "data")
+
+    def __init__(self, seq, timestamp, position, moving, data):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.position = position
+        self.moving = moving
+        self.data = data
+
+    def info(self):
+        return {
+            "seq": self.seq,
+            "timestamp": self.timestamp,
+            "position": self.position,
+            "moving": self.moving,
+            "bytes": len(self.data),
+            "file": self.file_name(),
+        }
+
+    def file_name(self):
+        return f"{self.seq:08d}_{self.timestamp:.3f}.jpg"
+
+
+class FrameRing:
+    """
+    Recent frames as JPEG, bounded by a byte budget instead of a frame count
+
+    Frames are recorded at the rate of profile.fps from the FrameHub and tagged
+    with their camera timestamp and the carriage position known at that time.
+    The oldest frames are evicted once the JPEG bytes exceed budget, so a higher
+    resolution profile simply keeps a shorter history.
+    """
+    def __init__(self, hub, profile, budget=RING_BUDGET, position=None):
+        self.hub = hub
+        self.profile = profile
+        self.budget = budget
+        # () -> (x, moving) 현재 carriage 위치
+        self.position = position
+        self.__entries = deque()
+        self.__bytes = 0
+        self.__task = None
+        self.recorded = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.get_running_loop().create_task(self.__record())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+
+    async def __record(self):
+        interval = 1 / self.profile.fps if self.profile.fps else 0
+        next_time = 0
+        seq = 0
+        while True:
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            frame = await self.hub.wait_next(seq)
+            next_time = time.monotonic() + interval
+            seq = frame.seq
+            position, moving = self.position() if self.position else (None, None)
+            if frame.position is not None:
+                position = frame.position
+            try:
+                data = await frame.encoded(self.profile)
+            except Exception as e:
+                print(f"Frame ring encode error: {e}")
+                continue
+            self.add(RingEntry(frame.seq, frame.timestamp, position, moving, data))
+
+    def add(self, entry):
+        self.__entries.append(entry)
+        self.__bytes += len(entry.data)
+        self.recorded += 1
+        while self.__bytes > self.budget and len(self.__entries) > 1:
+            self.__bytes -= len(self.__entries.popleft().data)
+            self.evicted += 1
+
+    def between(self, t0=None, t1=None):
+        """
+        :return: entries with t0 <= timestamp <= t1, oldest first
+        """
+        return [entry for entry in list(self.__entries)
+                if (t0 is None or entry.timestamp >= t0) and (t1 is None or entry.timestamp <= t1)]
+
+    def last(self, seconds):
+        return self.between(time.time() - seconds)
+
+    def iter_zip(self, entries):
+        stream = ChunkWriter()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+            for entry in entries:
+                archive.writestr(entry.file_name(), entry.data)
+                yield stream.take()
+            archive.writestr("manifest.json", json.dumps({
+                "profile": self.profile.name,
+                "frames": [entry.info() for entry in entries],
+            }, indent=2))
+        yield stream.take()
+
+    def iter_mjpeg(self, entries):
+        # JPEG 을 이어붙인 .mjpeg, ffplay / VLC 로 재생 가능
+        for entry in entries:
+            yield entry.data
+
+    def stats(self):
+        entries = list(self.__entries)
+        return {
+            "profile": self.profile.name,
+            "enabled": self.enabled,
+            "recording": self.__task is not None and not self.__task.done(),
+            "frames": len(entries),
+            "bytes": self.__bytes,
+            "budget": self.budget,
+            "oldest": entries[0].timestamp if entries else None,
+            "newest": entries[-1].timestamp if entries else None,
+            "span_s": round(entries[-1].timestamp - entries[0].timestamp, 2) if entries else 0,
+            "recorded": self.recorded,
+            "evicted": self.evicted,
+        }
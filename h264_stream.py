@@ -0,0 +1,272 @@
+import asyncio, os, struct, time, itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+H264_BITRATE = int(os.environ.get("H264_BITRATE", 2_000_000))   # bit/s
+H264_GOP = int(os.environ.get("H264_GOP", 30))                  # keyframe 간격 (프레임)
+H264_PRESET = os.environ.get("H264_PRESET", "ultrafast")        # x264 preset
+CLIENT_QUEUE = 60      # 이보다 밀린 viewer 는 다음 keyframe 부터 다시 받음
+STATS_WINDOW = 5       # bytes/s 계산 구간 (초)
+MOVFLAGS = "empty_moov+default_base_moof+frag_every_frame"
+
+
+def h264_available():
+    try:
+        import av
+    except ImportError:
+        return False
+    return "libx264" in av.codecs_available
+
+
+class _FragmentSink:
+    """
+    File object for the mp4 muxer that splits its output into top level boxes
+
+    ftyp + moov become the init segment, every moof + mdat pair is one fragment.
+    """
+    def __init__(self):
+        self.init = None
+        self.fragments = []
+        self.__pending = bytearray()
+        self.__header = bytearray()
+        self.__moof = None
+
+    def write(self, data):
+        self.__pending += data
+        while len(self.__pending) >= 8:
+            size, kind = struct.unpack(">I4s", self.__pending[:8])
+            if size == 1:
+                if len(self.__pending) < 16:
+                    break
+                size = struct.unpack(">Q", self.__pending[8:16])[0]
+            if len(self.__pending) < size:
+                break
+            box = bytes(self.__pending[:size])
+            del self.__pending[:size]
+            if kind in (b"ftyp", b"moov"):
+                self.__header += box
+                if kind == b"moov":
+                    self.init = bytes(self.__header)
+            elif kind == b"moof":
+                self.__moof = box
+            elif kind == b"mdat" and self.__moof is not None:
+                self.fragments.append(self.__moof + box)
+                self.__moof = None
+        return len(data)
+
+    def seekable(self):
+        return False
+
+
+class H264Client:
+    """
+    One viewer of an H264Stream, receives the init segment and then fragments
+    starting at the next keyframe
+    """
+    __ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self.__ids)
+        self.queue = asyncio.Queue()
+        self.need_keyframe = True
+        self.sent = 0
+        self.bytes_sent = 0
+        self.resyncs = 0
+        self.connected_at = time.time()
+
+    async def chunks(self):
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                return
+            self.sent += 1
+            self.bytes_sent += len(data)
+            yield data
+
+    def stats(self):
+        connected = time.time() - self.connected_at
+        return {
+            "id": self.id,
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_s": round(self.bytes_sent / connected) if connected else None,
+            "resyncs": self.resyncs,
+            "connected_s": round(connected, 1),
+        }
+
+
+class H264Stream:
+    """
+    Frames of the FrameHub encoded once to H.264 in fragmented MP4, shared by all viewers
+
+    The encoder runs only while somebody is watching. Every frame becomes one
+    moof + mdat fragment (the muxer emits it when the next frame arrives), so a
+    viewer can join at any keyframe after the init segment.
+    """
+    def __init__(self, hub, profile, bitrate=H264_BITRATE, gop=H264_GOP, preset=H264_PRESET):
+        self.hub = hub
+        self.profile = profile
+        self.fps = profile.fps or 30
+        self.bitrate = bitrate
+        self.gop = gop
+        self.preset = preset
+        self.init = None
+        # libx264 상태는 하나의 thread 에서만 사용
+        self.__executor = ThreadPoolExecutor(1, thread_name_prefix=f"h264-{profile.name}")
+        self.__clients = {}
+        self.__task = None
+        self.__container = None
+        self.__stream = None
+        self.__sink = None
+        self.__keyframes = deque()
+        self.__start_time = None
+        self.__window = deque()
+        self.frames = 0
+        self.keyframes = 0
+        self.bytes = 0
+        self.encode_time = 0.0
+        self.restarts = 0
+
+    def subscribe(self):
+        client = H264Client()
+        if self.init is not None:
+            client.queue.put_nowait(self.init)
+        self.__clients[client.id] = client
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.get_running_loop().create_task(self.__run())
+        return client
+
+    def unsubscribe(self, client):
+        self.__clients.pop(client.id, None)
+
+    @property
+    def subscriber_count(self):
+        return len(self.__clients)
+
+    def __open(self, width, height):
+        import av
+        self.__sink = _FragmentSink()
+        self.__container = av.open(self.__sink, mode="w", format="mp4", options={"movflags": MOVFLAGS})
+        stream = self.__container.add_stream("libx264", rate=self.fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.time_base = Fraction(1, 1000)
+        stream.codec_context.bit_rate = self.bitrate
+        stream.codec_context.gop_size = self.gop
+        # B-frame 없이 바로 출력해 지연을 줄임
+        stream.codec_context.options = {"preset": self.preset, "tune": "zerolatency"}
+        self.__stream = stream
+        self.__keyframes.clear()
+        self.__start_time = None
+
+    def __close(self):
+        if self.__container is not None:
+            try:
+                self.__container.close()
+            except Exception as e:
+                print(f"H.264 encoder close error: {e}")
+        self.__container = self.__stream = self.__sink = None
+        self.init = None
+
+    def __encode(self, frame):
+        """
+        :return: list of (fragment bytes, keyframe) completed by this frame
+        """
+        import av
+        yuv = frame.yuv420(self.profile.size)
+        height, width = yuv.shape[0] * 2 // 3, yuv.shape[1]
+        if self.__stream is None or (self.__stream.width, self.__stream.height) != (width, height):
+            self.__close()
+            self.__open(width, height)
+        if self.__start_time is None:
+            self.__start_time = frame.timestamp
+        video_frame = av.VideoFrame.from_ndarray(yuv, format="yuv420p")
+        video_frame.pts = int((frame.timestamp - self.__start_time) * 1000)
+        video_frame.time_base = Fraction(1, 1000)
+        for packet in self.__stream.encode(video_frame):
+            self.__keyframes.append(packet.is_keyframe)
+            self.__container.mux(packet)
+        fragments = [(fragment, self.__keyframes.popleft()) for fragment in self.__sink.fragments]
+        self.__sink.fragments.clear()
+        return fragments
+
+    def __deliver(self, fragments):
+        if self.init is None and self.__sink is not None and self.__sink.init is not None:
+            self.init = self.__sink.init
+            for client in self.__clients.values():
+                client.queue.put_nowait(self.init)
+        for data, keyframe in fragments:
+            self.bytes += len(data)
+            self.keyframes += keyframe
+            self.__window.append((time.monotonic(), len(data)))
+            for client in list(self.__clients.values()):
+                if client.need_keyframe and not keyframe:
+                    continue
+                if client.queue.qsize() >= CLIENT_QUEUE:
+                    # 느린 viewer 는 쌓인 fragment 를 버리고 다음 keyframe 부터
+                    while client.queue.qsize() > 1:
+                        client.queue.get_nowait()
+                    client.need_keyframe = True
+                    client.resyncs += 1
+                    continue
+                client.need_keyframe = False
+                client.queue.put_nowait(data)
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.fps
+        next_time = 0
+        last_seq = 0
+        try:
+            while self.__clients:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.hub.mark_demand()
+                frame = await self.hub.wait_next(last_seq)
+                next_time = time.monotonic() + interval
+                last_seq = frame.seq
+                start = time.perf_counter()
+                fragments = await loop.run_in_executor(self.__executor, self.__encode, frame)
+                self.encode_time += time.perf_counter() - start
+                self.frames += 1
+                self.__deliver(fragments)
+        except Exception as e:
+            print(f"H.264 encoder error: {e}")
+            self.restarts += 1
+            for client in list(self.__clients.values()):
+                client.queue.put_nowait(None)
+            self.__clients.clear()
+        # 닫는 동안 들어온 viewer 가 예전 init segment 를 받지 않도록 먼저 지움
+        self.init = None
+        await loop.run_in_executor(self.__executor, self.__close)
+        if self.__clients:
+            self.__task = loop.create_task(self.__run())
+
+    def bytes_per_second(self):
+        now = time.monotonic()
+        while self.__window and self.__window[0][0] < now - STATS_WINDOW:
+            self.__window.popleft()
+        return round(sum(size for _, size in self.__window) / STATS_WINDOW)
+
+    def stats(self):
+        return {
+            "profile": self.profile.name,
+            "size": self.profile.size,
+            "fps": self.fps,
+            "bitrate": self.bitrate,
+            "gop": self.gop,
+            "preset": self.preset,
+            "running": self.__task is not None and not self.__task.done(),
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "bytes_total": self.bytes,
+            "bytes_per_s": self.bytes_per_second(),
+            "encode_ms_per_frame": round(self.encode_time * 1000 / self.frames, 2) if self.frames else None,
+            "clients": [client.stats() for client in list(self.__clients.values())],
+        }
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
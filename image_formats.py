@@ -0,0 +1,10 @@
+import cv2
+
+
+def bgr_to_yuv420(img_bgr):
+    """
+    Planar YUV 4:2:0 (I420) for JPEG/H.264 encoders that take YUV input
+
+    :return: (height * 3 / 2, width) uint8 array, the Y plane followed by U and V
+    """
+    return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2YUV_I420)
@@ -0,0 +1,98 @@
+import os
+import cv2
+
+# auto: libjpeg-turbo (PyTurboJPEG) 가 설치되어 있으면 사용, 없으면 OpenCV
+JPEG_ENCODER = os.environ.get("JPEG_ENCODER", "auto")
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", 2))
+
+# 속도 / 화질 preset: chroma subsampling 과 DCT 방식
+PRESETS = {
+    "quality": {"subsampling": "444", "fast_dct": False},
+    "balanced": {"subsampling": "422", "fast_dct": False},
+    "fast": {"subsampling": "420", "fast_dct": True},
+}
+DEFAULT_PRESET = "balanced"
+
+
+class OpenCvEncoder:
+    """
+    cv2.imencode, always available
+
+    OpenCV has no switch for libjpeg's fast integer DCT, so fast_dct is ignored.
+    """
+    name = "opencv"
+    SUBSAMPLING = {
+        "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+        "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+        "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    }
+
+    def encode(self, img_bgr, quality=95, preset=DEFAULT_PRESET):
+        options = PRESETS[preset]
+        _, buffer = cv2.imencode('.jpg', img_bgr, [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self.SUBSAMPLING[options["subsampling"]],
+        ])
+        return buffer.tobytes()
+
+    __call__ = encode
+
+
+class TurboJpegEncoder:
+    """
+    libjpeg-turbo through PyTurboJPEG, encodes BGR directly with the fast DCT option
+    """
+    name = "turbo"
+
+    def __init__(self, library_path=None):
+        import turbojpeg
+        self.__turbojpeg = turbojpeg
+        self.__jpeg = turbojpeg.TurboJPEG(library_path)
+        self.__subsampling = {
+            "444": turbojpeg.TJSAMP_444,
+            "422": turbojpeg.TJSAMP_422,
+            "420": turbojpeg.TJSAMP_420,
+        }
+
+    def encode(self, img_bgr, quality=95, preset=DEFAULT_PRESET):
+        options = PRESETS[preset]
+        flags = self.__turbojpeg.TJFLAG_FASTDCT if options["fast_dct"] else 0
+        return self.__jpeg.encode(img_bgr, quality=quality, pixel_format=self.__turbojpeg.TJPF_BGR,
+                                  jpeg_subsample=self.__subsampling[options["subsampling"]], flags=flags)
+
+    __call__ = encode
+
+
+ENCODERS = {
+    "opencv": OpenCvEncoder,
+    "turbo": TurboJpegEncoder,
+}
+
+
+def available_encoders():
+    """
+    :return: names of the encoders that can be created on this machine
+    """
+    names = []
+    for name, encoder_class in ENCODERS.items():
+        try:
+            encoder_class()
+        except (ImportError, OSError, RuntimeError):
+            continue
+        names.append(name)
+    return names
+
+
+def create_encoder(name=JPEG_ENCODER):
+    """
+    :return: encoder callable as encode(image, quality, preset) -> JPEG bytes
+    """
+    if name == "auto":
+        try:
+            return TurboJpegEncoder()
+        except (ImportError, OSError, RuntimeError) as e:
+            print(f"libjpeg-turbo 를 사용할 수 없어 OpenCV 로 인코딩: {e}")
+            return OpenCvEncoder()
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown JPEG encoder {name}")
+    return ENCODERS[name]()
@@ -0,0 +1,211 @@
+import bisect
+from threading import Lock
+
+# 초 단위 histogram bucket, 0.5ms ~ 5s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REGISTRY = []
+
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        :return: the child for these label values, keep it around on hot paths
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{_label_text(labelnames, values)} {self.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_label_text(labelnames, values, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_label_text(labelnames, values, le)} {self.count}")
+        labels = _label_text(labelnames, values)
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Gauge(_Metric):
+    """
+    Value read from a callback at scrape time, so it costs nothing in between
+
+    With labelnames the callback returns {label value (tuple for several labels): value}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.callback()
+        except Exception:
+            value = float("nan")
+        if not self.labelnames:
+            return lines + [f"{self.name} {value}"]
+        if not isinstance(value, dict):
+            return lines
+        for values, child in sorted(value.items()):
+            values = values if isinstance(values, tuple) else (values,)
+            lines.append(f"{self.name}{_label_text(self.labelnames, values)} {child}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def percentile(values, p):
+    """
+    :param values: durations in seconds, sorted
+    :return: the p quantile in ms, None if values is empty
+    """
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+def summarize(values):
+    """
+    :return: p50 / p99 / max in ms and count of durations in seconds, None if values is empty
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    return {"p50_ms": percentile(values, 0.5), "p99_ms": percentile(values, 0.99),
+            "max_ms": round(values[-1] * 1000, 2), "count": len(values)}
+
+
+# Capture pipeline
+CAMERA_STAGE = Histogram("camera_stage_seconds", "Time per stage inside the camera frame grab", ["stage"])
+CAMERA_WAIT_BUFFER = CAMERA_STAGE.labels("wait_buffer")
+CAMERA_CONVERT = CAMERA_STAGE.labels("convert")
+CAMERA_COPY = CAMERA_STAGE.labels("copy")
+CAMERA_FAILURES = Counter("camera_failures_total", "Camera open or stream failures").labels()
+CAMERA_RECOVERIES = Counter("camera_recoveries_total", "Camera streams restored after a failure").labels()
+CAMERA_SETTINGS_SECONDS = Histogram("camera_settings_seconds", "Time to apply a camera settings change", ["kind"])
+CAMERA_RECOVERY_SECONDS = Histogram("camera_recovery_seconds", "Time from a camera failure until frames arrive again",
+                                    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)).labels()
+
+CAPTURE_STAGE = Histogram("capture_stage_seconds", "Time per stage of the capture loop", ["stage"])
+CAPTURE_GRAB = CAPTURE_STAGE.labels("grab")
+CAPTURE_PUBLISH = CAPTURE_STAGE.labels("publish")
+
+ENCODE_SECONDS = Histogram("encode_seconds", "Scale and JPEG encode time per frame", ["profile"])
+ENCODE_QUEUE_WAIT = Histogram("encode_queue_wait_seconds", "Time an encode job waits for a shared worker", ["camera"])
+FRAME_LOCK_WAIT = Histogram("frame_lock_wait_seconds", "Time spent waiting for another thread deriving the same frame").labels()
+
+STREAM_STAGE = Histogram("stream_stage_seconds", "Time per stage of a /video_feed client", ["stage"])
+STREAM_WAIT_FRAME = STREAM_STAGE.labels("wait_frame")
+STREAM_ENCODE = STREAM_STAGE.labels("encode")
+STREAM_SEND = STREAM_STAGE.labels("send")
+
+FRAMES = Counter("frames_total", "Frames by pipeline state", ["state"])
+FRAMES_CAPTURED = FRAMES.labels("captured")
+FRAMES_ENCODED = FRAMES.labels("encoded")
+FRAMES_DROPPED = FRAMES.labels("dropped")
+FRAMES_SKIPPED_BY_RATE = FRAMES.labels("skipped_by_rate")   # client 의 max_fps 때문에 건너뛴 프레임
+FRAMES_SERVED = FRAMES.labels("served")
+FRAMES_INCOMPLETE = FRAMES.labels("incomplete")
+FRAMES_LOST = FRAMES.labels("lost")
+
+# Serial link
+SERIAL_STAGE = Histogram("serial_stage_seconds", "Time per stage of a motion controller request", ["stage"])
+SERIAL_QUEUE_WAIT = SERIAL_STAGE.labels("queue_wait")
+SERIAL_WRITE = SERIAL_STAGE.labels("write")
+SERIAL_READ = SERIAL_STAGE.labels("readline")
+SERIAL_ROUND_TRIP = SERIAL_STAGE.labels("round_trip")
+SERIAL_ERRORS = Counter("serial_errors_total", "Failed motion controller requests").labels()
@@ -0,0 +1,74 @@
+import asyncio, time
+from collections import deque
+from serial_link import MOTION_TIMEOUT
+from metrics import percentile
+
+SETTLE_TIME = 0.2     # 도착 응답 후 진동이 멈출 때까지 기다리는 시간 (초)
+FRAME_TIMEOUT = 5     # 도착 후 유효한 프레임을 기다리는 최대 시간 (초)
+
+
+class PositionCapture:
+    """
+    Move the carriage with go_x and return the first frame exposed after it settled
+
+    Frames whose camera timestamp is older than arrival + settle were (at least
+    partly) exposed while the carriage was still moving and are skipped.
+    """
+    def __init__(self, serial_link, frame_hub):
+        self.serial_link = serial_link
+        self.frame_hub = frame_hub
+        self.captures = 0
+        self.skipped_frames = 0
+        self.__latency = deque(maxlen=200)
+
+    async def capture_at(self, x, settle=SETTLE_TIME, frame_timeout=FRAME_TIMEOUT):
+        """
+        :return: (frame detached from the camera buffer pool, position reported by the controller, controller responses)
+        """
+        responses = await self.__move(x)
+        arrived_at = time.time()
+        arrival = responses[-1]
+        position = arrival.get("x", x) if isinstance(arrival, dict) else x
+
+        valid_after = arrived_at + settle
+        deadline = time.monotonic() + settle + frame_timeout
+        seq = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No frame after arrival at x={position}")
+            frame = await asyncio.wait_for(self.frame_hub.wait_next(seq), remaining)
+            if frame.timestamp >= valid_after:
+                break
+            self.skipped_frames += 1
+            seq = frame.seq
+
+        # hub 의 frame 은 모든 consumer 가 공유하므로 복사본에 위치를 기록
+        frame = frame.detached()
+        frame.position = position
+        self.captures += 1
+        self.__latency.append(frame.timestamp - arrived_at)
+        return frame, position, responses
+
+    async def __move(self, x):
+        # idle 모드면 이동하는 동안 카메라가 원래 fps 로 돌아오고, 긴 이동 중에도 idle 로 내려가지 않도록 계속 요청을 표시
+        self.frame_hub.mark_demand()
+        move = asyncio.ensure_future(self.serial_link.request({"cmd": "go_x", "x": x}, 2, MOTION_TIMEOUT))
+        try:
+            while not move.done():
+                await asyncio.wait({move}, timeout=self.frame_hub.idle_after / 2)
+                self.frame_hub.mark_demand()
+        finally:
+            if not move.done():
+                move.cancel()
+        return move.result()
+
+    def stats(self):
+        latency = sorted(self.__latency)
+        return {
+            "captures": self.captures,
+            "skipped_frames": self.skipped_frames,
+            "arrival_to_frame_ms_p50": percentile(latency, 0.5),
+            "arrival_to_frame_ms_p99": percentile(latency, 0.99),
+            "arrival_to_frame_ms_last": round(self.__latency[-1] * 1000, 1) if self.__latency else None,
+        }
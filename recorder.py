@@ -0,0 +1,274 @@
+import asyncio, json, os, time, queue
+from collections import deque
+from threading import Thread, Lock
+
+RECORD_DIRECTORY = "./output/recordings"
+SEGMENT_SECONDS = float(os.environ.get("RECORD_SEGMENT_SECONDS", 60))
+RECORD_MAX_BYTES = int(float(os.environ.get("RECORD_MAX_MB", 2048)) * 1024 * 1024)     # 보관 용량 상한
+RECORD_RATE_LIMIT = int(float(os.environ.get("RECORD_RATE_MB", 8)) * 1024 * 1024)      # 초당 쓰기 상한
+BATCH_BYTES = 1024 * 1024      # 이만큼 모아서 한번에 write
+BATCH_INTERVAL = 1.0           # 덜 모였어도 이 시간(초)이 지나면 write
+BACKLOG_MAX = 32 * 1024 * 1024 # writer 가 밀려 쌓인 bytes 가 이보다 크면 프레임을 버림
+
+
+class RateLimiter:
+    """
+    Token bucket, wait(n) sleeps until n bytes may be written
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.__tokens = self.burst
+        self.__last = time.monotonic()
+        self.throttled = 0.0
+
+    def wait(self, size):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+        self.__tokens -= size
+        if self.__tokens < 0:
+            delay = -self.__tokens / self.rate
+            self.throttled += delay
+            time.sleep(delay)
+
+
+class _Segment:
+    """
+    One .mjpeg file of concatenated JPEGs and its .jsonl index (offset, length, timestamp, position)
+    """
+    def __init__(self, directory, started):
+        name = time.strftime("rec-%Y%m%d-%H%M%S", time.localtime(started)) + f"-{int(started * 1000) % 1000:03d}"
+        self.path = os.path.join(directory, name + ".mjpeg")
+        self.index_path = os.path.join(directory, name + ".jsonl")
+        self.started = started
+        self.size = 0
+        self.frames = 0
+        self.__data = open(self.path, 'wb', buffering=0)
+        self.__index = open(self.index_path, 'w')
+
+    def write(self, data, entries):
+        self.__data.write(data)
+        self.__index.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.__index.flush()
+        self.size += len(data)
+        self.frames += len(entries)
+
+    def close(self):
+        # segment 가 끝날 때만 fsync 해서 SD 카드 쓰기를 모음
+        os.fsync(self.__data.fileno())
+        self.__data.close()
+        self.__index.close()
+
+
+class Recorder:
+    """
+    Continuous recording of one stream profile into rotated segment files
+
+    The event loop side only encodes (shared with viewers of the same profile)
+    and hands the JPEG to a writer thread through a queue, it never waits for the
+    disk. The writer batches frames into large writes, limits the write rate and
+    deletes the oldest segments above max_bytes. When the disk cannot keep up
+    frames are dropped instead of growing the backlog beyond BACKLOG_MAX.
+    """
+    def __init__(self, hub, directory=RECORD_DIRECTORY, segment_seconds=SEGMENT_SECONDS,
+                 max_bytes=RECORD_MAX_BYTES, rate_limit=RECORD_RATE_LIMIT, position=None):
+        self.hub = hub
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.limiter = RateLimiter(rate_limit)
+        # () -> (x, moving) 현재 carriage 위치
+        self.position = position
+        self.profile = None
+        self.stop_at = None
+        self.__task = None
+        self.__queue = queue.Queue()
+        self.__backlog = 0
+        self.__lock = Lock()
+        self.__writer = None
+        self.__segment = None
+        self.__window = deque()
+        self.frames = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self.segments_deleted = 0
+
+    def open(self):
+        """
+        Create the recording directory, done at server startup instead of import
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def recording(self):
+        return self.__task is not None and not self.__task.done()
+
+    def start(self, profile, duration=None, start_at=None):
+        """
+        Record profile from start_at (epoch seconds, default now) for duration seconds (default until stop)
+        """
+        if self.recording:
+            raise RuntimeError("Recorder is already running")
+        self.profile = profile
+        begin = max(start_at or time.time(), time.time())
+        self.stop_at = begin + duration if duration else None
+        if self.__writer is None or not self.__writer.is_alive():
+            self.__writer = Thread(target=self.__write_loop, daemon=True)
+            self.__writer.start()
+        self.__task = asyncio.get_running_loop().create_task(self.__record(begin))
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        # 남은 batch 를 쓰고 segment 를 닫음
+        self.__queue.put(None)
+
+    async def __record(self, begin):
+        if begin > time.time():
+            await asyncio.sleep(begin - time.time())
+        interval = 1 / self.profile.fps if self.profile.fps else 0
+        next_time = 0
+        seq = 0
+        try:
+            while self.stop_at is None or time.time() < self.stop_at:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # 녹화하는 동안은 카메라를 idle 로 내리지 않음
+                self.hub.mark_demand()
+                frame = await self.hub.wait_next(seq)
+                next_time = time.monotonic() + interval
+                seq = frame.seq
+                data = await frame.encoded(self.profile)
+                with self.__lock:
+                    if self.__backlog + len(data) > BACKLOG_MAX:
+                        self.dropped += 1
+                        continue
+                    self.__backlog += len(data)
+                position, moving = self.position() if self.position else (None, None)
+                if frame.position is not None:
+                    position = frame.position
+                self.__queue.put_nowait((data, {"seq": frame.seq, "timestamp": frame.timestamp,
+                                                "position": position, "moving": moving}))
+                self.frames += 1
+        finally:
+            if self.stop_at is not None:
+                self.__queue.put(None)
+
+    def __write_loop(self):
+        batch = bytearray()
+        entries = []
+        deadline = time.monotonic() + BATCH_INTERVAL
+        while True:
+            try:
+                item = self.__queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if item:
+                data, entry = item
+                if self.__segment is not None and entry["timestamp"] - self.__segment.started >= self.segment_seconds:
+                    self.__flush(batch, entries)
+                    self.__rotate()
+                if self.__segment is None:
+                    self.__segment = _Segment(self.directory, entry["timestamp"])
+                entry["offset"] = self.__segment.size + len(batch)
+                entry["length"] = len(data)
+                batch += data
+                entries.append(entry)
+                if len(batch) < BATCH_BYTES:
+                    continue
+            self.__flush(batch, entries)
+            deadline = time.monotonic() + BATCH_INTERVAL
+            if item is None:
+                self.__rotate()
+
+    def __flush(self, batch, entries):
+        if not batch or self.__segment is None:
+            return
+        try:
+            self.limiter.wait(len(batch))
+            self.__segment.write(bytes(batch), entries)
+            self.bytes_written += len(batch)
+            self.__window.append((time.monotonic(), len(batch)))
+        except OSError as e:
+            print(f"Recording write error: {e}")
+        with self.__lock:
+            self.__backlog -= len(batch)
+        batch.clear()
+        entries.clear()
+
+    def __rotate(self):
+        if self.__segment is not None:
+            try:
+                self.__segment.close()
+            except OSError as e:
+                print(f"Recording close error: {e}")
+            self.__segment = None
+        self.__enforce_retention()
+
+    def segments(self):
+        """
+        :return: finished and current segments, oldest first
+        """
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".mjpeg"):
+                continue
+            path = os.path.join(self.directory, name)
+            segments.append({
+                "name": name,
+                "bytes": os.path.getsize(path),
+                "current": self.__segment is not None and self.__segment.path == path,
+            })
+        return segments
+
+    def __enforce_retention(self):
+        segments = self.segments()
+        total = sum(segment["bytes"] for segment in segments)
+        for segment in segments:
+            if total <= self.max_bytes:
+                break
+            if segment["current"]:
+                continue
+            path = os.path.join(self.directory, segment["name"])
+            try:
+                os.remove(path)
+                os.remove(path[:-len(".mjpeg")] + ".jsonl")
+            except FileNotFoundError:
+                pass
+            total -= segment["bytes"]
+            self.segments_deleted += 1
+
+    def write_rate(self, window=5):
+        now = time.monotonic()
+        while self.__window and self.__window[0][0] < now - window:
+            self.__window.popleft()
+        return round(sum(size for _, size in self.__window) / window)
+
+    def stats(self):
+        segment = self.__segment
+        return {
+            "recording": self.recording,
+            "profile": self.profile.name if self.profile else None,
+            "stop_at": self.stop_at,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "backlog_bytes": self.__backlog,
+            "backlog_frames": self.__queue.qsize(),
+            "bytes_written": self.bytes_written,
+            "write_bytes_per_s": self.write_rate(),
+            "rate_limit_bytes_per_s": self.limiter.rate,
+            "throttled_s": round(self.limiter.throttled, 2),
+            "current_segment": os.path.basename(segment.path) if segment else None,
+            "segment_seconds": self.segment_seconds,
+            "max_bytes": self.max_bytes,
+            "segments_deleted": self.segments_deleted,
+        }
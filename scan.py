@@ -0,0 +1,169 @@
+import asyncio, json, os, time, itertools, zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+SCAN_WORKERS = 2        # 인코딩/저장을 다음 이동과 겹쳐서 처리하는 worker 수
+MAX_POSITIONS = 10000
+
+
+def scan_positions(positions=None, start=None, stop=None, step=None):
+    """
+    :return: list of positions, either given directly or start..stop (inclusive) by step
+    """
+    if positions:
+        return list(positions)
+    if start is None or stop is None or not step:
+        raise ValueError("Give either positions or start, stop and a non-zero step")
+    count = int(round((stop - start) / step)) + 1
+    if count <= 0:
+        raise ValueError("step does not lead from start to stop")
+    if count > MAX_POSITIONS:
+        raise ValueError(f"Too many positions ({count} > {MAX_POSITIONS})")
+    return [round(start + i * step, 6) for i in range(count)]
+
+
+class ScanJob:
+    __ids = itertools.count(1)
+
+    def __init__(self, positions, profile, settle, directory):
+        self.id = f"{time.strftime('%Y%m%d-%H_%M_%S')}-{next(self.__ids)}"
+        self.positions = positions
+        self.profile = profile
+        self.settle = settle
+        self.directory = os.path.join(directory, self.id)
+        self.state = "running"
+        self.error = None
+        self.results = []
+        self.captured = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.motion_time = 0.0
+        self.store_time = 0.0
+        self.task = None
+
+    def manifest(self):
+        return {
+            "id": self.id,
+            "profile": self.profile.name,
+            "settle": self.settle,
+            "positions": self.positions,
+            "images": sorted(self.results, key=lambda result: result["index"]),
+        }
+
+    def stats(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "state": self.state,
+            "error": self.error,
+            "total": len(self.positions),
+            "captured": self.captured,
+            "stored": len(self.results),
+            "elapsed_s": round(elapsed, 3),
+            "motion_s": round(self.motion_time, 3),
+            "store_s": round(self.store_time, 3),
+            # 1 에 가까울수록 인코딩/저장이 이동 시간에 가려짐
+            "motion_ratio": round(self.motion_time / elapsed, 3) if elapsed else None,
+        }
+
+
+class ScanManager:
+    """
+    Server side sweep: move to every position, capture, and store in the background
+
+    The next move starts as soon as a frame is captured; encoding and the disk
+    write of that frame run on a small worker pool meanwhile.
+    """
+    def __init__(self, position_capture, directory, workers=SCAN_WORKERS):
+        self.position_capture = position_capture
+        self.directory = directory
+        self.jobs = {}
+        self.__pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+        self.__lock = asyncio.Lock()
+
+    def start(self, positions, profile, settle):
+        job = ScanJob(positions, profile, settle, self.directory)
+        os.makedirs(job.directory, exist_ok=True)
+        self.jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self.__run(job))
+        return job
+
+    def cancel(self, job):
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    async def __run(self, job):
+        loop = asyncio.get_running_loop()
+        pending = []
+        try:
+            # 한번에 하나의 scan 만 carriage 를 움직임
+            async with self.__lock:
+                for index, x in enumerate(job.positions):
+                    start = time.perf_counter()
+                    # capture_at 은 camera buffer 에서 복사된 frame 을 돌려줌
+                    frame, position, _ = await self.position_capture.capture_at(repr(x), job.settle)
+                    job.motion_time += time.perf_counter() - start
+                    job.captured += 1
+                    pending.append(loop.run_in_executor(self.__pool, self.__store, job, index, frame))
+            await asyncio.gather(*pending)
+            job.state = "done"
+        except asyncio.CancelledError:
+            job.state = "cancelled"
+            await asyncio.gather(*pending, return_exceptions=True)
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            job.finished_at = time.time()
+            self.__write_manifest(job)
+
+    def __store(self, job, index, frame):
+        start = time.perf_counter()
+        data = frame.jpeg(job.profile)
+        filename = f"{index:04d}_x{frame.position}.jpeg"
+        with open(os.path.join(job.directory, filename), 'wb') as f:
+            f.write(data)
+        job.results.append({
+            "index": index,
+            "position": frame.position,
+            "timestamp": frame.timestamp,
+            "file": filename,
+            "bytes": len(data),
+        })
+        job.store_time += time.perf_counter() - start
+
+    def __write_manifest(self, job):
+        with open(os.path.join(job.directory, "manifest.json"), 'w') as f:
+            json.dump(job.manifest(), f, indent=2)
+
+    def iter_zip(self, job):
+        """
+        Stream the stored images and the manifest as a zip without building it in memory
+        """
+        stream = ChunkWriter()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+            for result in job.manifest()["images"]:
+                archive.write(os.path.join(job.directory, result["file"]), result["file"])
+                yield stream.take()
+            archive.writestr("manifest.json", json.dumps(job.manifest(), indent=2))
+        yield stream.take()
+
+
+class ChunkWriter:
+    """
+    Write-only file object that hands out what was written since the last take()
+    """
+    def __init__(self):
+        self.__chunks = []
+
+    def write(self, data):
+        self.__chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.__chunks)
+        self.__chunks = []
+        return data
@@ -0,0 +1,291 @@
+import asyncio, json, os, time
+from collections import deque
+import serial
+from metrics import SERIAL_QUEUE_WAIT, SERIAL_WRITE, SERIAL_READ, SERIAL_ROUND_TRIP, SERIAL_ERRORS, percentile
+
+SERIAL_PORT = "/dev/ttyAMA0"
+BAUDRATE = 115200
+COMMAND_TIMEOUT = 5      # status / get_x / halt 응답 대기 시간 (초)
+MOTION_TIMEOUT = 120     # go_x / calibrate 는 이동이 끝나야 두번째 응답이 옴
+RECONNECT_DELAY_MAX = 10
+COMMAND_TIMEOUTS = {"go_x": MOTION_TIMEOUT, "calibrate": MOTION_TIMEOUT}
+# go_x 가 끝났을 때 board 가 보내는 두번째 응답의 "status" 값, 쉼표로 여러 개
+# 예전 코드는 두번째 줄을 내용과 관계없이 읽었으므로 firmware 가 보내는 값과 맞춰야 함
+# (fake_controller 는 {"status": "arrived", "x": ...}), 다른 값이 오면 대기 중인 다른 명령의 응답으로 처리됨
+MOTION_DONE = {status.strip() for status in os.environ.get("MOTION_DONE", "arrived").split(",") if status.strip()}
+PREEMPTS = {"halt"}         # 진행 중인 go_x 를 끝내는 명령
+
+
+def send_json_data(ser, data):
+    # 데이터 전송
+    ser.write(json.dumps(data).encode('utf-8') + b'\n')
+    ser.flush()
+
+class MotionInterrupted(Exception):
+    """
+    A go_x was stopped by halt or replaced by another go_x before it arrived
+    """
+    def __init__(self, message, responses):
+        super().__init__(message)
+        self.responses = responses
+
+
+class _Motion:
+    __slots__ = ("command", "remaining", "responses", "future")
+
+    def __init__(self, command, remaining, future):
+        self.command = command
+        self.remaining = remaining
+        self.responses = []
+        self.future = future
+
+
+class SerialLink:
+    """
+    One long-lived, non-blocking connection to the motion controller
+
+    The port is read by the event loop itself (add_reader), so no thread and no
+    readline() ever blocks a request. Commands take turns on the UART until their
+    first reply arrived. The remaining responses of a motion (go_x "arrived")
+    are awaited outside of that turn, so status polls and halt keep working
+    while the carriage moves, and halt ends the pending go_x. A line whose
+    "status" is in MOTION_DONE (env MOTION_DONE, set it to what the board
+    firmware sends when a move ends) completes the pending go_x. The port is
+    reopened automatically after an error.
+    """
+    def __init__(self, port=SERIAL_PORT, baudrate=BAUDRATE, motion_done=MOTION_DONE):
+        self.port = port
+        self.baudrate = baudrate
+        self.motion_done = set(motion_done)
+        self.__serial = None
+        self.__loop = None
+        self.__lock = None
+        self.__line = bytearray()
+        self.__reply = None
+        self.__motion = None
+        self.__waiting = 0
+        self.__reconnect_delay = 0
+        self.__next_connect = 0
+        self.__opened = False
+        self.__rtt = deque(maxlen=200)
+        self.requests = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.interrupted = 0
+        self.stale_lines = 0
+        self.__listeners = []
+
+    async def request(self, command, response_count=1, timeout=None):
+        """
+        Send a command and wait for its responses
+
+        timeout defaults to COMMAND_TIMEOUTS of the command. The first reply of a
+        multi-response command must arrive within COMMAND_TIMEOUT, the rest within
+        timeout. Cancelling the caller does not abort a command already on the
+        UART, its reply is still consumed so it cannot be mistaken for the next one.
+
+        :return: list of decoded JSON responses
+        """
+        if timeout is None:
+            timeout = COMMAND_TIMEOUTS.get(command.get("cmd"), COMMAND_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        reply_timeout = timeout if response_count == 1 else min(timeout, COMMAND_TIMEOUT)
+        transaction = asyncio.get_running_loop().create_task(
+            self.__transact(command, response_count, reply_timeout, time.perf_counter()))
+        first, motion = await asyncio.shield(transaction)
+        if motion is None:
+            return [first]
+        try:
+            rest = await asyncio.wait_for(motion.future, deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{command.get('cmd')}: {1 + len(motion.responses)}/{response_count} responses received")
+        except MotionInterrupted as e:
+            e.responses = [first] + e.responses
+            raise
+        finally:
+            # 기다리는 caller 가 없으면 이후의 "arrived" 는 버림
+            if self.__motion is motion:
+                self.__motion = None
+        return [first] + rest
+
+    async def __transact(self, command, response_count, reply_timeout, queued_at):
+        loop = asyncio.get_running_loop()
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        self.__waiting += 1
+        async with self.__lock:
+            self.__waiting -= 1
+            start = time.perf_counter()
+            SERIAL_QUEUE_WAIT.observe(start - queued_at)
+            self.requests += 1
+            motion = None
+            try:
+                ser = self.__connect(loop)
+                if response_count > 1:
+                    self.__interrupt_motion(f"replaced by {command.get('cmd')}")
+                    motion = self.__motion = _Motion(command, response_count - 1, loop.create_future())
+                reply = self.__reply = (command, loop.create_future())
+                send_json_data(ser, command)
+                written = time.perf_counter()
+                SERIAL_WRITE.observe(written - start)
+                try:
+                    first = await asyncio.wait_for(reply[1], reply_timeout)
+                except asyncio.TimeoutError:
+                    # 늦게 온 응답이 다음 명령의 응답으로 읽히지 않도록 버림
+                    # 다른 이동이 진행 중이면 받는 중인 도착 응답까지 버리게 되므로 그대로 둠
+                    pending = self.__motion
+                    if pending is None or pending is motion or pending.future.done():
+                        ser.reset_input_buffer()
+                        self.__line.clear()
+                    raise TimeoutError(f"{command.get('cmd')}: 0/{response_count} responses received")
+                SERIAL_READ.observe(time.perf_counter() - written)
+            except Exception:
+                self.errors += 1
+                SERIAL_ERRORS.inc()
+                if motion is not None and self.__motion is motion:
+                    self.__motion = None
+                raise
+            finally:
+                self.__reply = None
+            self.__rtt.append(time.perf_counter() - start)
+            SERIAL_ROUND_TRIP.observe(self.__rtt[-1])
+            if command.get("cmd") in PREEMPTS:
+                self.__interrupt_motion(f"stopped by {command.get('cmd')}", first)
+            return first, motion
+
+    def __interrupt_motion(self, reason, response=None):
+        motion = self.__motion
+        if motion is None or motion.future.done():
+            return
+        if response is not None:
+            motion.responses.append(response)
+        self.interrupted += 1
+        motion.future.set_exception(
+            MotionInterrupted(f"{motion.command.get('cmd')} {reason}", motion.responses))
+        self.__motion = None
+
+    def __on_readable(self):
+        try:
+            data = self.__serial.read(self.__serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            print(f"Serial read error: {e}")
+            self.__disconnect(e)
+            return
+        self.__line += data
+        while b'\n' in self.__line:
+            line, _, rest = bytes(self.__line).partition(b'\n')
+            self.__line[:] = rest
+            line = line.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Ignoring malformed line from serial device: {line!r}")
+                continue
+            self.__dispatch(response)
+
+    def __dispatch(self, response):
+        command = self.__route(response)
+        for listener in self.__listeners:
+            try:
+                listener(command, response)
+            except Exception as e:
+                print(f"Serial listener error: {e}")
+
+    def __route(self, response):
+        """
+        Hand response to the request waiting for it
+
+        :return: the command it answered, None for a stale line
+        """
+        status = response.get("status") if isinstance(response, dict) else None
+        motion = self.__motion
+        if status in self.motion_done:
+            if motion is not None and not motion.future.done():
+                motion.responses.append(response)
+                motion.remaining -= 1
+                if motion.remaining <= 0:
+                    motion.future.set_result(motion.responses)
+                return motion.command
+            self.stale_lines += 1
+            return None
+        if self.__reply is not None and not self.__reply[1].done():
+            command, future = self.__reply
+            if not (isinstance(response, dict) and "cmd" in response and response["cmd"] != command.get("cmd")):
+                future.set_result(response)
+                return command
+        # 기다리는 요청이 없는 응답 (timeout 이후 도착 등)
+        self.stale_lines += 1
+        return None
+
+    def add_listener(self, listener):
+        """
+        Call listener(command, response) for every line received, command is None
+        if no request was waiting for it
+        """
+        self.__listeners.append(listener)
+
+    def __connect(self, loop):
+        if self.__serial is not None:
+            return self.__serial
+        now = time.monotonic()
+        if now < self.__next_connect:
+            raise serial.SerialException(f"{self.port} unavailable, retrying in {self.__next_connect - now:.1f}s")
+        try:
+            ser = serial.Serial(self.port, self.baudrate, timeout=0)
+            loop.add_reader(ser.fileno(), self.__on_readable)
+        except (serial.SerialException, OSError):
+            # 연결 실패시 재시도 간격을 늘림
+            self.__reconnect_delay = min(max(self.__reconnect_delay * 2, 0.5), RECONNECT_DELAY_MAX)
+            self.__next_connect = now + self.__reconnect_delay
+            raise
+        # 처음 연결에 실패한 뒤 연결된 것은 재연결이 아님
+        if self.__opened:
+            self.reconnects += 1
+        self.__opened = True
+        self.__reconnect_delay = 0
+        self.__serial = ser
+        self.__loop = loop
+        self.__line.clear()
+        return ser
+
+    def __disconnect(self, error=None):
+        if self.__serial is None:
+            return
+        try:
+            self.__loop.remove_reader(self.__serial.fileno())
+        except Exception:
+            pass
+        try:
+            self.__serial.close()
+        except Exception as e:
+            print(f"Error closing serial device: {e}")
+        self.__serial = None
+        error = serial.SerialException(f"{self.port} disconnected: {error}")
+        if self.__reply is not None and not self.__reply[1].done():
+            self.__reply[1].set_exception(error)
+        if self.__motion is not None and not self.__motion.future.done():
+            self.__motion.future.set_exception(error)
+        self.__motion = None
+
+    async def close(self):
+        self.__disconnect("closed")
+
+    def stats(self):
+        rtt = sorted(self.__rtt)
+        motion = self.__motion
+        return {
+            "port": self.port,
+            "connected": self.__serial is not None,
+            "queue_depth": self.__waiting,
+            "motion_pending": motion.command if motion is not None and not motion.future.done() else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "interrupted": self.interrupted,
+            "stale_lines": self.stale_lines,
+            "rtt_ms_p50": percentile(rtt, 0.5),
+            "rtt_ms_p99": percentile(rtt, 0.99),
+            "rtt_ms_last": round(self.__rtt[-1] * 1000, 2) if self.__rtt else None,
+        }
@@ -0,0 +1,300 @@
+import os, time
+from collections import deque
+from concurrent.futures import Future
+from threading import Event
+import numpy as np
+import cv2
+from buffer_pool import BufferPool, RING_SIZE
+from metrics import CAMERA_WAIT_BUFFER, CAMERA_CONVERT, CAMERA_COPY
+from camera_settings import LIVE_SETTINGS, RELOCK_SETTINGS, SCALING_SETTINGS, DEFAULT_SETTINGS, split_settings
+
+SIM_WIDTH = int(os.environ.get("SIM_WIDTH", 1936))
+SIM_HEIGHT = int(os.environ.get("SIM_HEIGHT", 1096))
+SIM_FPS = float(os.environ.get("SIM_FPS", 30))
+SIM_OPEN_TIME = float(os.environ.get("SIM_OPEN_TIME", 0))  # 카메라 open / UserSetLoad 에 걸리는 시간 흉내 (초)
+SIM_EXPOSURE = 0.015   # 노출 + readout 시간 (초), trigger 후 프레임이 나올 때까지 걸림
+BAYER_CONVERSIONS = {
+    "bgr": cv2.COLOR_BayerRG2BGR,
+    "rgb": cv2.COLOR_BayerRG2RGB,
+}
+SIM_RELOCK_TIME = 0.05  # acquisition 정지 / buffer 재할당 / 재시작에 걸리는 시간 흉내 (초)
+# 숫자 설정의 (min, max, increment), ROI 의 max 는 binning / decimation 후의 센서 크기
+SIM_RANGES = {
+    "binning_x": (1, 4, 1),
+    "binning_y": (1, 4, 1),
+    "decimation_x": (1, 4, 1),
+    "decimation_y": (1, 4, 1),
+    "exposure": (28.0, 2000000.0, None),
+    "gain": (1.0, 16.0, None),
+    "fps": (0.5, 120.0, None),
+    "width": (256, None, 16),
+    "height": (2, None, 2),
+    "offset_x": (0, None, 16),
+    "offset_y": (0, None, 2),
+}
+_unplugged_until = 0.0  # time.monotonic() 까지 장치가 분리된 것처럼 동작
+
+
+def unplug(seconds):
+    """
+    Simulate a USB disconnect: open cameras fail and new ones cannot be opened for seconds
+    """
+    global _unplugged_until
+    _unplugged_until = time.monotonic() + seconds
+
+
+def unplugged():
+    return time.monotonic() < _unplugged_until
+
+
+class SimulatedBufferSource:
+    """
+    Stand-in for an ids_peak DataStream
+
+    Hands out raw Bayer buffers at a fixed frame rate from a set of announced
+    buffers that must be queued back, like WaitForFinishedBuffer/QueueBuffer.
+    In trigger mode a buffer is only finished SIM_EXPOSURE after trigger().
+    """
+    def __init__(self, width=SIM_WIDTH, height=SIM_HEIGHT, fps=SIM_FPS, buffer_count=4):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_id = 0
+        self.timestamp = None
+        self.triggered = False
+        self.__trigger = Event()
+        self.__aborted = False
+        pattern = (np.indices((height, width)).sum(axis=0) % 256).astype(np.uint8)
+        self.__queue = deque(pattern.copy() for _ in range(buffer_count))
+        self.__next_time = time.perf_counter()
+
+    def trigger(self):
+        self.__trigger.set()
+
+    def abort(self):
+        # KillWait 처럼 trigger 를 기다리는 wait_for_finished_buffer 를 깨움
+        self.__aborted = True
+        self.__trigger.set()
+
+    def set_triggered(self, enabled):
+        self.triggered = enabled
+        # free-run 중에 들어온 abort 는 읽히지 않으므로 다음 trigger 대기에 남기지 않음
+        self.__aborted = False
+        # trigger 를 기다리던 wait_for_finished_buffer 를 깨워 free-run 으로 돌아가게 함
+        self.__trigger.set()
+        self.__next_time = time.perf_counter()
+
+    def wait_for_finished_buffer(self, timeout_ms=5000):
+        if self.triggered:
+            if not self.__trigger.wait(timeout_ms / 1000):
+                raise TimeoutError("No trigger")
+            self.__trigger.clear()
+            if self.__aborted:
+                self.__aborted = False
+                raise InterruptedError("Wait aborted")
+        if self.triggered:
+            time.sleep(SIM_EXPOSURE)
+        elif self.fps:
+            delay = self.__next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(min(delay, timeout_ms / 1000))
+            self.__next_time = max(self.__next_time + 1 / self.fps, time.perf_counter())
+        if not self.__queue:
+            raise TimeoutError("No buffer queued")
+        buffer = self.__queue.popleft()
+        self.frame_id += 1
+        self.timestamp = time.time() - SIM_EXPOSURE / 2
+        buffer[0, :8] = self.frame_id % 256
+        cv2.putText(buffer, str(self.frame_id), (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 2, 255, 3)
+        return buffer
+
+    def queue_buffer(self, buffer):
+        self.__queue.append(buffer)
+
+
+class SimulatedConverter:
+    """
+    Stand-in for ids_peak_ipl.ImageConverter after PreAllocateConversion
+
+    Debayers into one internal output buffer that is reused for every frame.
+    """
+    def __init__(self, width=SIM_WIDTH, height=SIM_HEIGHT, pixel_format="bgr"):
+        self.pixel_format = pixel_format
+        self.__output = np.empty((height, width, 3), np.uint8)
+
+    def convert(self, buffer):
+        return cv2.cvtColor(buffer, BAYER_CONVERSIONS[self.pixel_format], dst=self.__output)
+
+
+class SimCamera:
+    """
+    Synthetic camera with the same interface as camera3.IdsCamera
+
+    Produces debayered frames of the configured size at the configured frame
+    rate, so the server runs without the ids_peak library or a device.
+    """
+    def __init__(self, buffer_count=8, ring_size=RING_SIZE, pixel_format="bgr",
+                 width=SIM_WIDTH, height=SIM_HEIGHT, fps=SIM_FPS, open_time=SIM_OPEN_TIME, device=None):
+        time.sleep(open_time)
+        self.device = device
+        if unplugged():
+            raise Exception("No device found!")
+        self.buffer_count = buffer_count
+        self.ring_size = ring_size
+        self.pixel_format = pixel_format
+        self.fps_limit = fps
+        self.sensor_size = (width, height)
+        self.__roi = {"binning_x": 1, "binning_y": 1, "decimation_x": 1, "decimation_y": 1,
+                      "width": width, "height": height, "offset_x": 0, "offset_y": 0}
+        self.__live_settings = {"exposure_auto": "Off", "exposure": 10000.0, "gain_auto": "Off", "gain": 1.0}
+        self.__pending_relock = None
+        self.__source = SimulatedBufferSource(width, height, fps, buffer_count)
+        self.__converter = SimulatedConverter(width, height, pixel_format)
+        self.__buffer_pool = BufferPool((height, width, 3), size=ring_size)
+        self.__lost = False
+        self.apply_settings(DEFAULT_SETTINGS)
+        print("시뮬레이션 카메라 초기화 완료")
+
+    @property
+    def buffer_pool(self):
+        return self.__buffer_pool
+
+    @property
+    def triggered(self):
+        return self.__source.triggered
+
+    def __grab(self):
+        start = time.perf_counter()
+        if self.__lost or unplugged():
+            # 분리된 장치는 다시 꽂혀도 새로 열어야 함
+            self.__lost = True
+            raise Exception("Device lost")
+        buffer = self.__source.wait_for_finished_buffer(5000)
+        waited = time.perf_counter()
+        CAMERA_WAIT_BUFFER.observe(waited - start)
+        try:
+            converted_image = self.__converter.convert(buffer)
+            converted = time.perf_counter()
+            CAMERA_CONVERT.observe(converted - waited)
+            image = self.__buffer_pool.store(converted_image)
+            CAMERA_COPY.observe(time.perf_counter() - converted)
+            return image, self.__source.timestamp
+        finally:
+            self.__source.queue_buffer(buffer)
+
+    def frames(self):
+        while True:
+            if self.__pending_relock is not None:
+                self.__relock()
+            try:
+                yield self.__grab()
+            except InterruptedError:
+                continue
+            except TimeoutError as e:
+                if self.triggered:
+                    continue
+                raise Exception(f"Buffer timeout: {e}")
+
+    def streaming_image(self):
+        image, _ = self.__grab()
+        yield image
+
+    def set_trigger_mode(self, enabled):
+        start = time.perf_counter()
+        self.__source.set_triggered(enabled)
+        return time.perf_counter() - start
+
+    def trigger(self):
+        if not self.triggered:
+            raise Exception("카메라가 trigger 모드가 아닙니다")
+        self.__source.trigger()
+
+    def set_frame_rate(self, fps):
+        self.__source.fps = fps
+        return fps
+
+    def __range(self, name):
+        minimum, maximum, increment = SIM_RANGES[name]
+        if maximum is None:
+            # ROI 는 (binning / decimation 후) 센서 안에 있어야 함
+            axis = "x" if name in ("width", "offset_x") else "y"
+            sensor = self.sensor_size[0 if axis == "x" else 1]
+            sensor //= self.__roi["binning_" + axis] * self.__roi["decimation_" + axis]
+            other = {"width": "offset_x", "offset_x": "width", "height": "offset_y", "offset_y": "height"}[name]
+            maximum = sensor - self.__roi[other]
+        return minimum, maximum, increment
+
+    def __clamp(self, name, value):
+        if name.endswith("_auto"):
+            return value
+        minimum, maximum, increment = self.__range(name)
+        value = max(minimum, min(maximum, value))
+        if increment:
+            value = minimum + (int(value) - minimum) // increment * increment
+        return value
+
+    def apply_settings(self, settings, wait=True):
+        """
+        Same as IdsCamera.apply_settings, ROI changes recreate the buffers in frames()
+        """
+        live, relock = split_settings(settings)
+        applied = {}
+        for name, value in live.items():
+            applied[name] = self.__clamp(name, value)
+            if name == "fps":
+                self.fps_limit = applied[name]
+                self.__source.fps = applied[name]
+            else:
+                self.__live_settings[name] = applied[name]
+        if not relock:
+            return applied, None
+        future = Future()
+        self.__pending_relock = (relock, future)
+        self.__source.abort()
+        if wait:
+            applied.update(future.result(10))
+            return applied, None
+        return applied, future
+
+    def __relock(self):
+        relock, future = self.__pending_relock
+        self.__pending_relock = None
+        applied = {}
+        previous = dict(self.__roi)
+        self.__roi["offset_x"] = self.__roi["offset_y"] = 0
+        scaling = [name for name in SCALING_SETTINGS if name in relock]
+        if scaling:
+            self.__roi["width"], self.__roi["height"] = SIM_RANGES["width"][0], SIM_RANGES["height"][0]
+            for name in scaling:
+                self.__roi[name] = applied[name] = self.__clamp(name, relock[name])
+        for name in ("width", "height"):
+            if name in relock:
+                self.__roi[name] = applied[name] = self.__clamp(name, relock[name])
+            elif scaling:
+                self.__roi[name] = self.__clamp(name, self.__range(name)[1])
+        for name in ("offset_x", "offset_y"):
+            self.__roi[name] = self.__clamp(name, relock.get(name, previous[name]))
+            if name in relock:
+                applied[name] = self.__roi[name]
+        time.sleep(SIM_RELOCK_TIME)
+        width, height = self.__roi["width"], self.__roi["height"]
+        triggered = self.__source.triggered
+        self.__source = SimulatedBufferSource(width, height, self.__source.fps, self.buffer_count)
+        self.__source.triggered = triggered
+        self.__converter = SimulatedConverter(width, height, self.pixel_format)
+        self.__buffer_pool = BufferPool((height, width, 3), size=self.ring_size)
+        future.set_result(applied)
+
+    def settings(self):
+        current = {}
+        for name in LIVE_SETTINGS:
+            value = self.fps_limit if name == "fps" else self.__live_settings[name]
+            current[name] = {"value": value}
+            if name in SIM_RANGES:
+                current[name].update(zip(("min", "max"), self.__range(name)[:2]))
+        for name in RELOCK_SETTINGS:
+            current[name] = {"value": self.__roi[name], **dict(zip(("min", "max"), self.__range(name)[:2]))}
+        return current
+
+    def close(self):
+        self.__lost = True
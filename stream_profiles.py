@@ -0,0 +1,57 @@
+import time
+from threading import Lock
+from metrics import ENCODE_SECONDS, FRAMES_ENCODED
+from jpeg_encoders import DEFAULT_PRESET
+
+
+class StreamProfile:
+    """
+    Resolution, JPEG quality and frame rate of one stream derived from the camera
+
+    size is (width, height) or None for the full camera resolution, preset is
+    one of jpeg_encoders.PRESETS.
+    """
+    def __init__(self, name, size=None, quality=90, fps=None, preset=DEFAULT_PRESET):
+        self.name = name
+        self.size = tuple(size) if size else None
+        self.quality = quality
+        self.fps = fps
+        self.preset = preset
+        self.frames = 0
+        self.cpu_time = 0.0
+        self.__lock = Lock()
+        self.__encode_seconds = ENCODE_SECONDS.labels(name)
+
+    def render(self, frame, encode):
+        """
+        Scale and encode frame for this profile, accounting the CPU time spent
+        """
+        start = time.thread_time()
+        wall_start = time.perf_counter()
+        data = encode(frame.resized(self.size), self.quality, self.preset)
+        self.__encode_seconds.observe(time.perf_counter() - wall_start)
+        FRAMES_ENCODED.inc()
+        elapsed = time.thread_time() - start
+        with self.__lock:
+            self.frames += 1
+            self.cpu_time += elapsed
+        return data
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "quality": self.quality,
+            "preset": self.preset,
+            "fps": self.fps,
+            "frames": self.frames,
+            "cpu_ms_total": round(self.cpu_time * 1000, 1),
+            "cpu_ms_per_frame": round(self.cpu_time * 1000 / self.frames, 2) if self.frames else None,
+        }
+
+
+PROFILES = {
+    "full": StreamProfile("full", None, quality=95, fps=30, preset="balanced"),
+    "preview": StreamProfile("preview", (640, 480), quality=70, fps=10, preset="fast"),
+    "thumb": StreamProfile("thumb", (320, 240), quality=60, fps=5, preset="fast"),
+}
+DEFAULT_PROFILE = "full"
@@ -0,0 +1,54 @@
+import os
+from archive import SnapshotArchive, INDEX_DTYPE
+
+SNAPSHOTS = [b"first jpeg", b"second jpeg", b"third jpeg"]
+
+
+def filled_archive(directory):
+    archive = SnapshotArchive(str(directory))
+    archive.open()
+    for i, data in enumerate(SNAPSHOTS):
+        archive.append(data, 1000.0 + i, position=i * 10, seq=i + 1)
+    return archive
+
+
+def test_append_and_query(tmp_path):
+    archive = filled_archive(tmp_path)
+    assert len(archive) == 3
+    data, info = archive.get(1)
+    assert data == b"second jpeg"
+    assert info == {"id": 1, "timestamp": 1001.0, "position": 10.0, "seq": 2, "bytes": 11}
+    total, snapshots = archive.query(t0=1000.5, x=20, tolerance=1)
+    assert total == 1 and snapshots[0]["id"] == 2
+
+
+def test_recover_drops_unindexed_tail(tmp_path):
+    archive = filled_archive(tmp_path)
+    # data 를 쓴 뒤 index 레코드를 다 쓰기 전에 죽은 경우
+    with open(archive.data_path, 'ab') as f:
+        f.write(b"unindexed jpeg")
+    with open(archive.index_path, 'ab') as f:
+        f.write(b"\0" * (INDEX_DTYPE.itemsize // 2))
+
+    recovered = SnapshotArchive(str(tmp_path))
+    recovered.open()
+    assert len(recovered) == 3
+    assert [recovered.get(i)[0] for i in range(3)] == SNAPSHOTS
+    assert os.path.getsize(recovered.data_path) == sum(len(data) for data in SNAPSHOTS)
+    assert os.path.getsize(recovered.index_path) == 3 * INDEX_DTYPE.itemsize
+
+
+def test_recover_drops_records_without_data(tmp_path):
+    archive = filled_archive(tmp_path)
+    # 마지막 snapshot 의 data 가 잘린 경우
+    os.truncate(archive.data_path, os.path.getsize(archive.data_path) - 3)
+
+    recovered = SnapshotArchive(str(tmp_path))
+    recovered.open()
+    assert len(recovered) == 2
+    assert [recovered.get(i)[0] for i in range(2)] == SNAPSHOTS[:2]
+    assert recovered.get(2) is None
+    assert os.path.getsize(recovered.data_path) == len(SNAPSHOTS[0]) + len(SNAPSHOTS[1])
+    # 복구 뒤의 append 는 잘린 자리부터 이어짐
+    assert recovered.append(b"fourth jpeg", 1003.0) == 2
+    assert recovered.get(2)[0] == b"fourth jpeg"
@@ -0,0 +1,33 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from buffer_pool import BufferPool
+from frame_hub import FrameHub
+from stream_profiles import StreamProfile
+
+
+def slow_encode(image, quality, preset):
+    # 인코딩 도중에 buffer 가 덮어써지면 sleep 뒤에 읽는 내용이 달라짐
+    time.sleep(0.05)
+    return image.tobytes()
+
+
+def test_pinned_slot_survives_slow_encode():
+    pool = BufferPool((8, 8, 3), size=4)
+    executor = ThreadPoolExecutor(1)
+    hub = FrameHub(slow_encode, executor=executor)
+    profile = StreamProfile("test")
+    futures = []
+    # 첫 프레임이 인코딩을 기다리는 동안 pool 보다 많은 프레임을 publish
+    for value in range(len(pool) * 2):
+        slot = pool.store(np.full(pool.shape, value, np.uint8))
+        futures.append((value, hub.publish(slot, pool=pool).prefetch(profile)))
+    for value, future in futures:
+        assert future.result(5) == np.full(pool.shape, value, np.uint8).tobytes()
+    executor.shutdown(wait=True)
+    overflows = pool.overflows
+    assert overflows >= len(pool)
+    # 인코딩이 끝나면 slot 이 다시 돌고, 최신 프레임만 pin 되어 있음
+    hub.publish(pool.store(np.zeros(pool.shape, np.uint8)), pool=pool)
+    assert pool.overflows == overflows
+    assert pool.pinned() == 1
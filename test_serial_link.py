@@ -0,0 +1,176 @@
+import asyncio, time
+import pytest
+import serial
+from fake_controller import FakeController
+from serial_link import SerialLink, MotionInterrupted
+
+
+@pytest.fixture
+def controller():
+    controller = FakeController(speed=1000)
+    yield controller
+    controller.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_request_response(controller):
+    async def scenario():
+        link = SerialLink(controller.port)
+        try:
+            status = await link.request({"cmd": "status"})
+            location = await link.request({"cmd": "get_x"})
+        finally:
+            await link.close()
+        return status, location, link.stats()
+
+    status, location, stats = run(scenario())
+    assert status == [{"status": "idle", "x": 0, "x_max": 1000}]
+    assert location == [{"x": 0}]
+    assert stats["requests"] == 2 and stats["errors"] == 0
+    assert controller.commands == [{"cmd": "status"}, {"cmd": "get_x"}]
+
+
+def test_timeout_and_stale_reply(controller):
+    async def scenario():
+        link = SerialLink(controller.port)
+        try:
+            controller.response_delay = 0.3
+            with pytest.raises(TimeoutError):
+                await link.request({"cmd": "status"}, timeout=0.05)
+            controller.response_delay = 0.002
+            # 늦게 온 status 응답은 다음 명령의 응답이 되면 안 됨
+            await asyncio.sleep(0.4)
+            location = await link.request({"cmd": "get_x"})
+        finally:
+            await link.close()
+        return location, link.stats()
+
+    location, stats = run(scenario())
+    assert location == [{"x": 0}]
+    assert stats["errors"] == 1
+    assert stats["stale_lines"] == 1
+
+
+def test_reconnect(controller):
+    async def scenario():
+        link = SerialLink("/dev/does-not-exist")
+        try:
+            with pytest.raises(serial.SerialException):
+                await link.request({"cmd": "status"})
+            link.port = controller.port
+            # 실패한 뒤에는 재시도 간격이 지나야 다시 연결
+            with pytest.raises(serial.SerialException, match="retrying"):
+                await link.request({"cmd": "status"})
+            await asyncio.sleep(0.6)
+            first = await link.request({"cmd": "get_x"})
+
+            # 연결된 장치가 사라지면 기다리던 이동은 실패하고 다음 요청에서 새 장치로 연결
+            controller.speed = 1
+            go = asyncio.create_task(link.request({"cmd": "go_x", "x": 100}, 2))
+            await asyncio.sleep(0.1)
+            controller.close()
+            with pytest.raises(serial.SerialException):
+                await go
+            replacement = FakeController()
+            try:
+                link.port = replacement.port
+                second = await link.request({"cmd": "get_x"})
+            finally:
+                replacement.close()
+        finally:
+            await link.close()
+        return first, second, link.stats()
+
+    first, second, stats = run(scenario())
+    assert first == [{"x": 0}]
+    assert second == [{"x": 0}]
+    assert stats["reconnects"] == 1
+
+
+def test_halt_preempts_go(controller):
+    async def scenario():
+        controller.speed = 100
+        link = SerialLink(controller.port)
+        try:
+            go = asyncio.create_task(link.request({"cmd": "go_x", "x": 1000}, 2))
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            halt = await link.request({"cmd": "halt"})
+            with pytest.raises(MotionInterrupted) as interrupted:
+                await go
+            elapsed = time.monotonic() - start
+        finally:
+            await link.close()
+        return halt, interrupted.value, elapsed, link.stats()
+
+    halt, interrupted, elapsed, stats = run(scenario())
+    assert halt[0]["status"] == "halted"
+    assert 0 < halt[0]["x"] < 1000
+    # go_x 의 첫 응답과 halt 응답
+    assert [response["status"] for response in interrupted.responses] == ["moving", "halted"]
+    assert elapsed < 1
+    assert stats["interrupted"] == 1 and stats["motion_pending"] is None
+
+
+def test_status_poll_during_move(controller):
+    async def scenario():
+        controller.speed = 500
+        link = SerialLink(controller.port)
+        try:
+            go = asyncio.create_task(link.request({"cmd": "go_x", "x": 200}, 2))
+            await asyncio.sleep(0.05)
+            polls = await asyncio.gather(*[link.request({"cmd": "status"}) for _ in range(5)])
+            responses = await go
+        finally:
+            await link.close()
+        return polls, responses, link.stats()
+
+    polls, responses, stats = run(scenario())
+    assert all(poll[0]["status"] == "moving" for poll in polls)
+    assert responses == [{"status": "moving", "target": 200}, {"status": "arrived", "x": 200}]
+    assert stats["stale_lines"] == 0 and stats["errors"] == 0
+
+
+def test_configured_motion_done():
+    controller = FakeController(speed=500, arrived_status="done")
+
+    async def scenario():
+        link = SerialLink(controller.port, motion_done={"done"})
+        try:
+            go = asyncio.create_task(link.request({"cmd": "go_x", "x": 100}, 2))
+            await asyncio.sleep(0.05)
+            poll = await link.request({"cmd": "status"})
+            responses = await asyncio.wait_for(go, 2)
+        finally:
+            await link.close()
+        return poll, responses
+
+    try:
+        poll, responses = run(scenario())
+    finally:
+        controller.close()
+    assert poll[0]["status"] == "moving"
+    assert responses[-1] == {"status": "done", "x": 100}
+
+
+def test_timeout_during_move_keeps_arrival(controller):
+    async def scenario():
+        controller.speed = 500
+        link = SerialLink(controller.port)
+        try:
+            go = asyncio.create_task(link.request({"cmd": "go_x", "x": 150}, 2))
+            await asyncio.sleep(0.05)
+            controller.response_delay = 0.5
+            with pytest.raises(TimeoutError):
+                await link.request({"cmd": "status"}, timeout=0.05)
+            controller.response_delay = 0.002
+            responses = await asyncio.wait_for(go, 2)
+        finally:
+            await link.close()
+        return responses
+
+    responses = run(scenario())
+    assert responses[-1] == {"status": "arrived", "x": 150}
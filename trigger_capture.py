@@ -0,0 +1,82 @@
+import asyncio, time
+from collections import deque
+from metrics import summarize
+
+TRIGGER_TIMEOUT = 2
+
+
+class TriggeredCapture:
+    """
+    Software triggered stills on the running camera
+
+    The triggered frame arrives through the normal capture loop and frame hub,
+    so the datastream keeps a single reader. Free-run frames still in flight
+    after the mode switch are told apart by their camera timestamp, which is
+    earlier than the trigger.
+    """
+    def __init__(self, get_camera, frame_hub):
+        self.get_camera = get_camera
+        self.frame_hub = frame_hub
+        self.stills = 0
+        self.discarded_frames = 0
+        self.__lock = asyncio.Lock()
+        self.__switch_time = deque(maxlen=200)
+        self.__latency = deque(maxlen=200)
+
+    def __camera(self):
+        camera = self.get_camera()
+        if camera is None:
+            raise Exception("카메라가 연결되지 않았습니다")
+        return camera
+
+    async def set_mode(self, triggered):
+        camera = self.__camera()
+        async with self.__lock:
+            if camera.triggered != triggered:
+                self.__switch_time.append(await asyncio.to_thread(camera.set_trigger_mode, triggered))
+        return camera.triggered
+
+    async def still(self, resume=True, timeout=TRIGGER_TIMEOUT):
+        """
+        :param resume: restore the mode the camera was in afterwards, keep trigger mode for a series of stills otherwise
+        :return: the triggered frame, detached from the camera buffer pool
+        """
+        camera = self.__camera()
+        async with self.__lock:
+            was_triggered = camera.triggered
+            if not was_triggered:
+                self.__switch_time.append(await asyncio.to_thread(camera.set_trigger_mode, True))
+            try:
+                latest = self.frame_hub.latest()
+                seq = latest.seq if latest else 0
+                # 전환 전에 노출된 free-run 프레임은 timestamp 가 trigger 보다 이름
+                triggered_at = time.time()
+                start = time.perf_counter()
+                deadline = time.monotonic() + timeout
+                await asyncio.to_thread(camera.trigger)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    frame = await asyncio.wait_for(self.frame_hub.wait_next(seq), remaining)
+                    if frame.timestamp >= triggered_at:
+                        break
+                    self.discarded_frames += 1
+                    seq = frame.seq
+                self.__latency.append(time.perf_counter() - start)
+                frame = frame.detached()
+                self.stills += 1
+            finally:
+                if resume and camera.triggered != was_triggered:
+                    self.__switch_time.append(await asyncio.to_thread(camera.set_trigger_mode, was_triggered))
+        return frame
+
+    def stats(self):
+        camera = self.get_camera()
+        return {
+            "mode": "trigger" if camera is not None and camera.triggered else "freerun",
+            "stills": self.stills,
+            "discarded_frames": self.discarded_frames,
+            "mode_switch": summarize(self.__switch_time),
+            "trigger_to_frame": summarize(self.__latency),
+        }